@@ -0,0 +1,83 @@
+'''Compare the root and path queries of ArrayBranching with and without
+   the LinkCutForest index (`dynamic_index`), on branchings consisting of
+   chains of a given depth. Prints the average time per call of
+   has_path_id() and root_id() on random nodes and of removing and
+   re-adding a leaf edge (which also updates the forest).
+
+   Usage (from the `src` directory):
+       python ../benchmarks/bench_forest.py [NUM_NODES]'''
+
+from morle.datastruct.graph import ArrayBranching, EdgeSet, FullGraph, \
+    GraphEdge
+from morle.datastruct.lexicon import Lexicon, LexiconEntry
+from morle.datastruct.rules import Rule
+import morle.shared as shared
+
+import numpy as np
+import sys
+import timeit
+
+CONFIG = '''
+[General]
+encoding = utf-8
+date_format = %%d.%%m.%%Y %%H:%%M
+supervised = no
+
+[Models]
+root_feature_model = none
+edge_feature_model = none
+
+[Features]
+word_vec_dim = 100
+'''
+
+DEPTHS = (2, 4, 8, 16, 32, 64, 128, 256)
+NUM_QUERIES = 20000
+
+
+def build_graph(num_nodes :int, depth :int) -> FullGraph:
+    'A graph consisting of chains of `depth` nodes.'
+    lexicon = Lexicon([LexiconEntry('w{}'.format(i)) \
+                       for i in range(num_nodes)])
+    rule = Rule.from_string(':/:x')
+    edges = [GraphEdge(lexicon[i-1], lexicon[i], rule) \
+             for i in range(num_nodes) if i % depth != 0]
+    return FullGraph(lexicon, EdgeSet(lexicon, edges))
+
+
+def per_call(fun, args) -> float:
+    'Average time of fun(*a) for a in args, in microseconds.'
+    seconds = timeit.timeit(lambda: [fun(*a) for a in args], number=1)
+    return seconds / len(args) * 1e6
+
+
+def main() -> None:
+    shared.config.read_string(CONFIG)
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = np.random.default_rng(0)
+    print('depth\tindex\thas_path_us\troot_us\tremove_add_us')
+    for depth in DEPTHS:
+        full_graph = build_graph(num_nodes, depth)
+        pairs = rng.integers(num_nodes, size=(NUM_QUERIES, 2)).tolist()
+        # the edges to the last node of every chain
+        leaf_edge_ids = [e_id for e_id in range(len(full_graph.edge_set)) \
+                         if (e_id+1) % (depth-1) == 0][:NUM_QUERIES]
+        for dynamic_index in (False, True):
+            branching = ArrayBranching(full_graph,
+                                       dynamic_index=dynamic_index)
+            for e_id in range(len(full_graph.edge_set)):
+                branching.add_edge_id(e_id)
+
+            def remove_add(e_id :int) -> None:
+                branching.remove_edge_id(e_id)
+                branching.add_edge_id(e_id)
+
+            print('{}\t{}\t{:.2f}\t{:.2f}\t{:.2f}'.format(
+                  depth, 'forest' if dynamic_index else 'walk',
+                  per_call(branching.has_path_id, pairs),
+                  per_call(branching.root_id, [p[:1] for p in pairs]),
+                  per_call(remove_add, [(e_id,) for e_id in leaf_edge_ids])))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@ setup(
         'hfst >= 3.14.0',
         'keras >= 2.2.0',
         'networkx >= 1.10, < 2.0',
-        'numpy >= 1.15.2',
+        'numpy >= 1.17.0',
         'pyyaml >= 3.13',
         'scipy >= 1.1.0',
         'tqdm >= 4.11.2'
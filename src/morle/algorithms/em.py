@@ -1,13 +1,17 @@
 from morle.algorithms.mcmc.statistics import AcceptanceRateStatistic, \
-    EdgeFrequencyStatistic, ExpectedCostStatistic
-from morle.algorithms.mcmc.samplers import MCMCGraphSamplerFactory
+    EdgeFrequencyStatistic, ExpectedCostStatistic, \
+    RaoBlackwellEdgeFrequencyStatistic
+from morle.algorithms.mcmc.samplers import MCMCGraphSampler, \
+    MCMCGraphSamplerFactory, read_checkpoint
 from morle.datastruct.graph import FullGraph
 # from models.point import PointModel
 from morle.models.suite import ModelSuite
+from morle.utils.files import file_exists
 import morle.shared as shared
 
 import numpy as np
 import logging
+import os
 
 
 # def hardem(full_graph :FullGraph, model :PointModel) -> None:
@@ -40,36 +44,128 @@ import logging
 #         logging.getLogger('main').debug('edges_cost = %f' % model.edges_cost)
 
 
+def _last_checkpointed_iteration(checkpoint_file :str, num_chains :int) \
+                                 -> int:
+    '''Return the number of the EM iteration in which the last sampler
+       checkpoint was saved (0 if there is none).'''
+    root, ext = os.path.splitext(checkpoint_file)
+    filenames = [checkpoint_file, '{}.part0{}'.format(root, ext)]
+    if num_chains > 1:
+        filenames.append('{}.chain0{}'.format(root, ext))
+    result = 0
+    for filename in filenames:
+        if file_exists(filename):
+            checkpoint = read_checkpoint(filename)
+            if 'meta.em_iteration' in checkpoint:
+                result = max(result, int(checkpoint['meta.em_iteration']))
+    return result
+
+
+def _create_sampler(full_graph :FullGraph, model :ModelSuite,
+                    checkpoint_file :str) -> MCMCGraphSampler:
+    sampler = MCMCGraphSamplerFactory.new(full_graph, model,
+                warmup_iter=shared.config['fit'].getint('warmup_iterations'),
+                sampling_iter=shared.config['fit'].getint('sampling_iterations'),
+                depth_cost=shared.config['Models'].getfloat('depth_cost'),
+                dynamic_index=shared.config['Models'].get('dynamic_index'),
+                seed=shared.config['General'].getint('seed', fallback=None),
+                checkpoint_file=checkpoint_file,
+                checkpoint_interval=\
+                    shared.config['fit'].getint('checkpoint_interval'),
+                target_ess=shared.config['fit'].getfloat('target_ess'),
+                max_rhat=shared.config['fit'].getfloat('max_rhat'),
+                diagnostic_interval=\
+                    shared.config['fit'].getint('diagnostic_interval'),
+                move_batch_size=\
+                    shared.config['fit'].getint('move_batch_size'),
+                proposal_temperature=\
+                    shared.config['fit'].getfloat('proposal_temperature'))
+    sampler.add_stat('acc_rate', AcceptanceRateStatistic(sampler))
+    rao_blackwell_interval = \
+        shared.config['fit'].getint('rao_blackwell_interval')
+    if rao_blackwell_interval > 0 and sampler.depth_cost == 0 and \
+            sampler.default_proposals:
+        sampler.add_stat('edge_freq',
+                         RaoBlackwellEdgeFrequencyStatistic(
+                             sampler, interval=rao_blackwell_interval))
+    else:
+        if rao_blackwell_interval > 0:
+            logging.getLogger('main').warning(\
+                'The Rao-Blackwellized edge frequencies are not'
+                ' available for this sampler -- rao_blackwell_interval'
+                ' ignored.')
+        sampler.add_stat('edge_freq', EdgeFrequencyStatistic(sampler))
+    sampler.add_stat('exp_cost', ExpectedCostStatistic(sampler))
+    return sampler
+
+
 def softem(full_graph :FullGraph, model :ModelSuite) -> None:
     iter_num = 0
     # initialize the models
     model.initialize(full_graph)
+    checkpoint_file = shared.filenames['fit-checkpoint']
+    num_chains = shared.config['fit'].getint('num_chains')
+    resume = False
+    if shared.options['resume']:
+        # repeat the iteration in which the last checkpoint was saved,
+        # starting from the model saved after the previous iteration
+        iter_num = _last_checkpointed_iteration(checkpoint_file, num_chains)
+        if iter_num > 0:
+            resume = True
+            iter_num -= 1
+            logging.getLogger('main').info(\
+                'Resuming from iteration {}.'.format(iter_num+1))
+            if iter_num > 0:
+                model = ModelSuite.load()
 #     model.root_model.fit(full_graph.lexicon, np.ones(len(full_graph.lexicon)))
 #     model.fit(full_graph.lexicon, full_graph.edge_set,
 #               np.ones(len(full_graph.lexicon)),
 #               np.ones(len(full_graph.edge_set)))
+    # the sampler is created once and reused in every iteration -- only
+    # the cost caches are refreshed after fitting the model
+    sampler = _create_sampler(full_graph, model, checkpoint_file)
+    warm_start = shared.config['fit'].getboolean('warm_start')
+    if warm_start and num_chains > 1:
+        logging.getLogger('main').warning(\
+            'The independent chains start from random branchings --'
+            ' warm_start ignored.')
+        warm_start = False
     # EM iteration
     while iter_num < shared.config['fit'].getint('iterations'):
         iter_num += 1
         logging.getLogger('main').info('Iteration %d' % iter_num)
 
         # expectation step
-        sampler = MCMCGraphSamplerFactory.new(full_graph, model,
-                    warmup_iter=shared.config['fit'].getint('warmup_iterations'),
-                    sampling_iter=shared.config['fit'].getint('sampling_iterations'),
-                    depth_cost=shared.config['Models'].getfloat('depth_cost'))
-        sampler.add_stat('acc_rate', AcceptanceRateStatistic(sampler))
-        sampler.add_stat('edge_freq', EdgeFrequencyStatistic(sampler))
-        sampler.add_stat('exp_cost', ExpectedCostStatistic(sampler))
-        sampler.run_sampling()
+        if warm_start and iter_num > 1:
+            # start from the final branching of the previous iteration,
+            # which is usually close to the new posterior mode, and end
+            # the (shorter) warmup as soon as the chain is stationary
+            if sampler.phase == 'done':
+                sampler.initial_edge_ids = sampler.branching.edge_ids()
+            sampler.warmup_iter = \
+                shared.config['fit'].getint('warm_start_warmup_iterations')
+            sampler.adaptive_warmup = True
+        sampler.checkpoint_metadata['em_iteration'] = iter_num
+        sampler.run_sampling(
+            num_chains=num_chains,
+            num_processes=shared.config['fit'].getint('num_processes'),
+            resume=resume,
+            component_batch_size=\
+                shared.config['fit'].getint('component_batch_size'),
+            exact_component_size=\
+                shared.config['fit'].getint('exact_component_size'),
+            num_temperatures=\
+                shared.config['fit'].getint('num_temperatures'),
+            max_temperature=\
+                shared.config['fit'].getfloat('max_temperature'),
+            swap_interval=shared.config['fit'].getint('swap_interval'))
+        resume = False
 
         # maximization step
         edge_weights = sampler.stats['edge_freq'].value()
-        root_weights = np.ones(len(full_graph.lexicon))
-        for idx in range(edge_weights.shape[0]):
-            root_id = \
-                full_graph.lexicon.get_id(full_graph.edge_set[idx].target)
-            root_weights[root_id] -= edge_weights[idx]
+        root_weights = 1 - np.bincount(full_graph.edge_set.target_ids(),
+                                       weights=edge_weights,
+                                       minlength=len(full_graph.lexicon))
         model.fit(sampler.lexicon, sampler.edge_set, 
                   root_weights, edge_weights)
         model.save()
@@ -0,0 +1,58 @@
+'''Exact edge marginals of a distribution over branchings, in which
+   the probability of a branching is proportional to the product of
+   the weights of its edges. The marginals are computed with Kirchhoff's
+   directed matrix-tree theorem: the branchings correspond to
+   the spanning arborescences of the graph extended with a virtual root,
+   which is connected to every node with weight 1.'''
+
+import numpy as np
+
+
+def edge_marginals(source_ids :np.ndarray, target_ids :np.ndarray,
+                   edge_costs :np.ndarray) -> np.ndarray:
+    '''Return the probability of each edge being contained in
+       the branching. The edges are given by the IDs of their source
+       and target nodes and their costs (negative log-weights). The cost
+       is O(n^3) in the number of nodes, so this is meant for small
+       connected components.'''
+    num_edges = len(edge_costs)
+    if num_edges == 0:
+        return np.zeros(0)
+    nodes, idx = np.unique(np.concatenate((source_ids, target_ids)),
+                           return_inverse=True)
+    sources, targets = idx[:num_edges], idx[num_edges:]
+    n = len(nodes)
+    # scale the weights of the ingoing edges of every node (including
+    # the edge from the virtual root, which has cost 0), so that
+    # the largest one is 1 -- this scales the determinant, but does not
+    # change the marginals
+    min_cost = np.zeros(n)
+    np.minimum.at(min_cost, targets, edge_costs)
+    weights = np.exp(min_cost[targets] - edge_costs)
+    root_weights = np.exp(min_cost)
+    # the Laplacian: rows correspond to parents and columns to children
+    laplacian = np.zeros((n, n))
+    np.add.at(laplacian, (sources, targets), -weights)
+    laplacian[np.diag_indices(n)] += \
+        root_weights + np.bincount(targets, weights=weights, minlength=n)
+    inv_laplacian = np.linalg.inv(laplacian)
+    marginals = weights * (inv_laplacian[targets, targets] -
+                           inv_laplacian[targets, sources])
+    return np.clip(marginals, 0, 1)
+
+
+def max_marginal_edges(target_ids :np.ndarray,
+                       marginals :np.ndarray) -> np.ndarray:
+    '''Return the indices of the edges that are the most probable choice
+       for their target node (more probable than the other ingoing edges
+       and than the node being a root), sorted by decreasing marginal
+       probability. Adding them in this order to a branching while
+       skipping those that would create a cycle yields a representative
+       branching.'''
+    targets, idx = np.unique(target_ids, return_inverse=True)
+    best = np.zeros(len(targets))
+    np.maximum.at(best, idx, marginals)
+    root_marginals = 1 - np.bincount(idx, weights=marginals)
+    selected = np.flatnonzero((marginals >= best[idx]) &
+                              (marginals > root_marginals[idx]))
+    return selected[np.argsort(-marginals[selected], kind='stable')]
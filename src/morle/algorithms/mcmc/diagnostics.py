@@ -0,0 +1,59 @@
+'''Convergence diagnostics for MCMC traces: autocorrelation time,
+   effective sample size and split-R-hat.'''
+
+import numpy as np
+from typing import List
+
+
+def autocorrelation(x :np.ndarray) -> np.ndarray:
+    'Normalized autocorrelation function of a trace (computed with FFT).'
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[0]
+    x = x - np.mean(x)
+    # zero-padding to a power of two avoids the circular correlation
+    size = 1 << (2*n-1).bit_length()
+    f = np.fft.rfft(x, n=size)
+    acf = np.fft.irfft(f * np.conjugate(f), n=size)[:n]
+    if acf[0] == 0:
+        # constant trace
+        result = np.zeros(n)
+        result[0] = 1
+        return result
+    return acf / acf[0]
+
+
+def autocorrelation_time(x :np.ndarray, c :float = 5.0) -> float:
+    '''Integrated autocorrelation time, estimated with the automatic
+       windowing procedure of Sokal (the window is the smallest M
+       with M >= c * tau(M)).'''
+    acf = autocorrelation(x)
+    taus = 2 * np.cumsum(acf) - 1
+    window = np.arange(len(taus)) >= c * taus
+    m = int(np.argmax(window)) if np.any(window) else len(taus)-1
+    return max(float(taus[m]), 1.0)
+
+
+def effective_sample_size(x :np.ndarray) -> float:
+    return len(x) / autocorrelation_time(x)
+
+
+def split_rhat(chains :List[np.ndarray]) -> float:
+    '''The potential scale reduction factor (Gelman-Rubin R-hat), computed
+       on chains split in halves. The chains are truncated to equal
+       length.'''
+    n = min(len(chain) for chain in chains) // 2
+    if n < 2:
+        return float('inf')
+    halves = []
+    for chain in chains:
+        chain = np.asarray(chain, dtype=np.float64)
+        halves.append(chain[:n])
+        halves.append(chain[n:2*n])
+    halves = np.vstack(halves)
+    means = np.mean(halves, axis=1)
+    within_var = np.mean(np.var(halves, axis=1, ddof=1))
+    between_var = n * np.var(means, ddof=1)
+    if within_var == 0:
+        return 1.0 if between_var == 0 else float('inf')
+    var_estimate = (n-1) / n * within_var + between_var / n
+    return float(np.sqrt(var_estimate / within_var))
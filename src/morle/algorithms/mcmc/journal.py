@@ -0,0 +1,140 @@
+'''A journal of the edge changes made by the accepted moves of the sampler.
+   Instead of notifying every statistic of every change, the sampler
+   appends the changes to preallocated arrays, from which the statistics
+   are computed in batches (see MCMCStatistic.flush()).
+
+   The journal can also be saved to a file, so that the statistics of
+   a run can be recomputed later without sampling again
+   (see MCMCGraphSampler.replay_journal()). The file consists of binary
+   records (JOURNAL_DTYPE): a marker (sign 0, edge ID -1) with
+   the log-likelihood of the initial branching, the edges of the initial
+   branching (iteration 0, sign +1), the changes made during sampling and
+   a marker with the final iteration number and log-likelihood.'''
+
+from morle.utils.files import full_path
+
+import numpy as np
+import os
+from typing import Tuple
+
+
+JOURNAL_DTYPE = np.dtype([('iter_num', np.int64), ('edge_id', np.int64),
+                          ('sign', np.int8), ('logl', np.float64)])
+
+
+class MoveJournal:
+    '''Records of the form (iteration, edge ID, +1 for an added or -1 for
+       a removed edge, log-likelihood after the move). The journal counts
+       as full when less than `reserve` records are free, so that
+       the changes of a move can always be recorded before flushing.'''
+
+    def __init__(self, capacity :int = 65536, reserve :int = 16) -> None:
+        self.reserve = reserve
+        self.iter_nums = np.empty(capacity, dtype=np.int64)
+        self.edge_ids = np.empty(capacity, dtype=np.int64)
+        self.signs = np.empty(capacity, dtype=np.int8)
+        self.logls = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def append(self, iter_num :int, edge_id :int, sign :int,
+               logl :float) -> None:
+        i = self.size
+        self.iter_nums[i] = iter_num
+        self.edge_ids[i] = edge_id
+        self.signs[i] = sign
+        self.logls[i] = logl
+        self.size = i+1
+
+    def extend(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+               signs :np.ndarray, logls :np.ndarray) -> None:
+        '''Append several records at once. The journal is enlarged
+           if they do not fit.'''
+        start, end = self.size, self.size + len(iter_nums)
+        if end > len(self.iter_nums):
+            capacity = max(end + self.reserve, 2*len(self.iter_nums))
+            for attr in ('iter_nums', 'edge_ids', 'signs', 'logls'):
+                setattr(self, attr, np.resize(getattr(self, attr), capacity))
+        self.iter_nums[start:end] = iter_nums
+        self.edge_ids[start:end] = edge_ids
+        self.signs[start:end] = signs
+        self.logls[start:end] = logls
+        self.size = end
+
+    def is_full(self) -> bool:
+        return self.size > len(self.iter_nums) - self.reserve
+
+    def records(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                               np.ndarray]:
+        '''Return the columns of the records in chronological order
+           (as views valid until the next clear()).'''
+        return self.iter_nums[:self.size], self.edge_ids[:self.size], \
+               self.signs[:self.size], self.logls[:self.size]
+
+    def clear(self) -> None:
+        self.size = 0
+
+    def save(self, filename :str) -> None:
+        'Append the records to a journal file.'
+        records = np.empty(self.size, dtype=JOURNAL_DTYPE)
+        records['iter_num'], records['edge_id'], records['sign'], \
+            records['logl'] = self.records()
+        with open(full_path(filename), 'ab') as fp:
+            records.tofile(fp)
+
+
+def _marker(iter_num :int, logl :float) -> np.ndarray:
+    return np.array([(iter_num, -1, 0, logl)], dtype=JOURNAL_DTYPE)
+
+
+def start_journal_file(filename :str, edge_ids :np.ndarray,
+                       logl :float) -> None:
+    '''Create a journal file starting from the given initial branching.'''
+    records = np.empty(len(edge_ids)+1, dtype=JOURNAL_DTYPE)
+    records[0] = _marker(0, logl)
+    records[1:] = [(0, e_id, 1, logl) for e_id in edge_ids.tolist()]
+    with open(full_path(filename), 'wb') as fp:
+        records.tofile(fp)
+
+
+def end_journal_file(filename :str, iter_num :int, logl :float) -> None:
+    with open(full_path(filename), 'ab') as fp:
+        _marker(iter_num, logl).tofile(fp)
+
+
+def journal_file_size(filename :str) -> int:
+    '''Return the number of records in a journal file (0 if it does not
+       exist).'''
+    path = full_path(filename)
+    if not os.path.exists(path):
+        return 0
+    return os.path.getsize(path) // JOURNAL_DTYPE.itemsize
+
+
+def truncate_journal_file(filename :str, num_records :int) -> None:
+    '''Discard the records after the first `num_records` (e.g. those
+       written after the checkpoint from which sampling is resumed).'''
+    with open(full_path(filename), 'r+b') as fp:
+        fp.truncate(num_records * JOURNAL_DTYPE.itemsize)
+
+
+def read_journal_file(filename :str) \
+                     -> Tuple[np.ndarray, float, np.ndarray, int]:
+    '''Read a journal file. Returns the edge IDs of the initial branching,
+       its log-likelihood, the records of the changes and the number of
+       iterations (for an unfinished journal: the iteration of the last
+       change).'''
+    records = np.fromfile(full_path(filename), dtype=JOURNAL_DTYPE)
+    if len(records) == 0 or records[0]['sign'] != 0:
+        raise RuntimeError('{} is not a journal file.'.format(filename))
+    initial_logl = float(records[0]['logl'])
+    is_initial = (records['iter_num'][1:] == 0) & (records['sign'][1:] > 0)
+    num_initial = 1 + (len(is_initial) if np.all(is_initial) \
+                       else int(np.argmin(is_initial)))
+    initial_edge_ids = records['edge_id'][1:num_initial]
+    changes = records[num_initial:]
+    if len(changes) > 0 and changes[-1]['sign'] == 0:
+        num_iter = int(changes[-1]['iter_num'])
+        changes = changes[:-1]
+    else:
+        num_iter = int(changes[-1]['iter_num']) if len(changes) > 0 else 0
+    return initial_edge_ids, initial_logl, changes, num_iter
@@ -1,41 +1,192 @@
 import morle.algorithms.fst as FST
 from morle.algorithms.align import extract_all_rules
+from morle.algorithms.matrixtree import edge_marginals, max_marginal_edges
+from morle.algorithms.mcmc.diagnostics import effective_sample_size, \
+    split_rhat
+from morle.algorithms.mcmc.journal import MoveJournal, \
+    end_journal_file, journal_file_size, read_journal_file, \
+    start_journal_file, truncate_journal_file
 from morle.algorithms.mcmc.statistics import \
     MCMCStatistic, ScalarStatistic, IterationStatistic, EdgeStatistic, \
-    RuleStatistic, UnorderedWordPairStatistic
+    MoveStatistic, RuleStatistic, UnorderedWordPairStatistic
+from morle.algorithms.mcmc.trace import TraceReader, TraceWriter, \
+    trace_file_size, truncate_trace_file
 from morle.datastruct.lexicon import LexiconEntry, Lexicon
 from morle.datastruct.graph import EdgeSet, GraphEdge, Branching, FullGraph
 from morle.datastruct.rules import Rule
 from morle.models.suite import ModelSuite
-from morle.utils.files import full_path, open_to_write, write_line
+from morle.utils.files import file_exists, full_path, open_to_write, \
+    remove_file_if_exists, write_line, write_tsv_columns
+from morle.utils.parallel import parallel_execute
 import morle.shared as shared
 
 from collections import defaultdict
+import copy
 import hfst
+import json
 import logging
 import math
+import multiprocessing
 import numpy as np
 from operator import itemgetter
-import random
-from scipy.sparse import csr_matrix
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
 import tqdm
-from typing import Callable, List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
 
 
 class ImpossibleMoveException(Exception):
     pass
 
 
-# TODO monitor the number of moves from each variant and their acceptance rates!
+def alias_table(weights :np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Build an alias table (Vose's method) for sampling indices with
+       probabilities proportional to `weights`: draw `i` uniformly and
+       keep it with probability `prob[i]`, otherwise take `alias[i]`.'''
+    n = len(weights)
+    scaled = (weights * (n / np.sum(weights))).tolist()
+    prob, alias = np.ones(n), np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        prob[i], alias[i] = scaled[i], j
+        scaled[j] -= 1 - scaled[i]
+        if scaled[j] < 1:
+            small.append(j)
+        else:
+            large.append(j)
+    # the remaining entries are 1 up to rounding errors
+    return prob, alias
+
+
+class RandomStream:
+    '''Random numbers for the sampler, drawn from a numpy Generator
+       in large blocks and consumed one at a time from a buffer.
+       If `edge_weights` are given, the edge IDs are drawn with
+       probabilities proportional to them (using an alias table).'''
+
+    def __init__(self, rng :np.random.Generator, num_edges :int,
+                 block_size :int = 65536,
+                 edge_weights :np.ndarray = None) -> None:
+        self.rng = rng
+        self.num_edges = num_edges
+        self.block_size = block_size
+        self._alias_prob, self._alias = None, None
+        if edge_weights is not None:
+            self._alias_prob, self._alias = alias_table(edge_weights)
+        self._edge_ids, self._edge_pos = [], 0     # type: List[int], int
+        self._uniforms, self._uniform_pos = [], 0  # type: List[float], int
+
+    def edge_id(self) -> int:
+        'Draw an edge ID with uniform probability.'
+        if self._edge_pos >= len(self._edge_ids):
+            self._edge_ids = self._draw_edge_ids(self.block_size)
+            self._edge_pos = 0
+        self._edge_pos += 1
+        return self._edge_ids[self._edge_pos-1]
+
+    def _draw_edge_ids(self, size :int) -> List[int]:
+        edge_ids = self.rng.integers(self.num_edges, size=size)
+        if self._alias is not None:
+            edge_ids = np.where(
+                self.rng.random(size) < self._alias_prob[edge_ids],
+                edge_ids, self._alias[edge_ids])
+        return edge_ids.tolist()
+
+    def uniform(self) -> float:
+        'Draw a number from the interval [0, 1).'
+        if self._uniform_pos >= len(self._uniforms):
+            self._uniforms = self.rng.random(self.block_size).tolist()
+            self._uniform_pos = 0
+        self._uniform_pos += 1
+        return self._uniforms[self._uniform_pos-1]
+
+    def choice(self, items :List[Any]) -> Any:
+        return items[min(int(self.uniform() * len(items)), len(items)-1)]
+
+    def edge_id_batch(self, size :int) -> np.ndarray:
+        'Draw `size` edge IDs at once (continuing the same sequence).'
+        if self._edge_pos + size > len(self._edge_ids):
+            self._edge_ids = self._edge_ids[self._edge_pos:] + \
+                self._draw_edge_ids(max(self.block_size, size))
+            self._edge_pos = 0
+        self._edge_pos += size
+        return np.array(self._edge_ids[self._edge_pos-size:self._edge_pos],
+                        dtype=np.int64)
+
+    def uniform_batch(self, size :int) -> np.ndarray:
+        'Draw `size` numbers from [0, 1) at once.'
+        if self._uniform_pos + size > len(self._uniforms):
+            self._uniforms = self._uniforms[self._uniform_pos:] + \
+                self.rng.random(max(self.block_size, size)).tolist()
+            self._uniform_pos = 0
+        self._uniform_pos += size
+        return np.array(
+                   self._uniforms[self._uniform_pos-size:self._uniform_pos])
+
+    def get_state(self) -> Dict[str, Any]:
+        '''Return the state of the generator and the buffers (as numpy
+           types, so that it can be saved with numpy.savez).'''
+        return { 'rng' : json.dumps(self.rng.bit_generator.state),
+                 'edge_ids' : np.array(self._edge_ids, dtype=np.int64),
+                 'edge_pos' : self._edge_pos,
+                 'uniforms' : np.array(self._uniforms, dtype=np.float64),
+                 'uniform_pos' : self._uniform_pos }
+
+    def set_state(self, state :Dict[str, Any]) -> None:
+        self.rng.bit_generator.state = json.loads(str(state['rng']))
+        self._edge_ids = state['edge_ids'].tolist()
+        self._edge_pos = int(state['edge_pos'])
+        self._uniforms = state['uniforms'].tolist()
+        self._uniform_pos = int(state['uniform_pos'])
+
+
+def read_checkpoint(filename :str) -> Dict[str, np.ndarray]:
+    '''Read a checkpoint saved by MCMCGraphSampler.save_checkpoint().'''
+    with np.load(full_path(filename)) as data:
+        return { key : data[key] for key in data.files }
+
+
 class MCMCGraphSampler:
+    # the minimum number of trace points for convergence diagnostics
+    MIN_TRACE_LENGTH = 100
+    # the lower bound on the logarithm of the edge proposal weights
+    # (see _init_edge_proposal_weights())
+    MIN_LOG_PROPOSAL_WEIGHT = -3
+    # the values of the iteration statistics are passed to the trace file
+    # when their buffers are full (see IterationStatistic) or
+    # TRACE_MAX_DELAY seconds have passed (checked at the diagnostic
+    # iterations), in blocks of TRACE_BLOCK_SIZE rows
+    TRACE_BLOCK_SIZE = 4096
+    TRACE_MAX_DELAY = 10.0
+    # whether the moves are proposed as in this class (required for
+    # batches of moves and for cost-aware edge proposals)
+    default_proposals = True
+
     def __init__(self, full_graph :FullGraph, 
                        model :ModelSuite,
                        warmup_iter :int = 1000,
                        sampling_iter :int = 100000,
                        iter_stat_interval :int = 1,
-                       depth_cost :float = 0) -> None:
+                       depth_cost :float = 0,
+                       seed :Any = None,
+                       checkpoint_file :str = None,
+                       checkpoint_interval :int = 0,
+                       target_ess :float = 0,
+                       max_rhat :float = 1.05,
+                       adaptive_warmup :bool = False,
+                       diagnostic_interval :int = 100,
+                       journal_file :str = None,
+                       trace_file :str = None,
+                       output_format :str = 'tsv',
+                       move_batch_size :int = 1,
+                       proposal_temperature :float = 0,
+                       dynamic_index :str = 'auto') -> None:
         self.full_graph = full_graph
         self.lexicon = full_graph.lexicon
         self.edge_set = full_graph.edge_set
@@ -47,188 +198,1238 @@ class MCMCGraphSampler:
         self.sampling_iter = sampling_iter
         self.iter_stat_interval = iter_stat_interval
         self.stats = {}               # type: Dict[str, MCMCStatistic]
+        # the accepted moves are recorded in the journal, from which
+        # the journaled statistics are computed in batches (see
+        # flush_journal()) -- only the other statistics are notified
+        # of every move
+        self.journal = MoveJournal()
+        self.dispatched_stats = []    # type: List[MCMCStatistic]
+        # if set, the journal of the sampling phase is saved to this file
+        # (see replay_journal())
+        self.journal_file = journal_file
+        # if set, the values of the iteration statistics of the sampling
+        # phase are streamed to this file -- otherwise, they are spilled
+        # to another file and copied by save_iter_stats() (see
+        # _trace_path()); only the values not written yet are kept in
+        # memory
+        self.trace_file = trace_file
+        self.trace = None                 # type: TraceWriter
+        self._spill_file = None           # type: str
+        self._spill_file_is_temporary = False
+        self._flushing_journal = False
+        # the format of the files written by save_edge_stats() etc.:
+        # 'tsv' or 'npz' (see _save_table())
+        self.output_format = output_format
+        self._saved_indices = set()       # type: Set[str]
         self.iter_num = 0
         self.depth_cost = depth_cost
-
-        self.unordered_word_pair_index = {}
-        next_id = 0
-        for e in self.edge_set:
-            key = (min(e.source, e.target), max(e.source, e.target))
-            if key not in self.unordered_word_pair_index:
-                self.unordered_word_pair_index[key] = next_id
-                next_id += 1
+        # whether the branching keeps its trees in a LinkCutForest:
+        # 'yes', 'no' or 'auto' (only with the depth cost, which needs
+        # subtree queries at every move -- for the root and path queries
+        # alone, walking up the tree is faster unless the trees are
+        # hundreds of nodes deep, see benchmarks/bench_forest.py)
+        if dynamic_index == 'auto':
+            self.dynamic_index = (depth_cost != 0)
+        elif dynamic_index in ('yes', 'no'):
+            self.dynamic_index = (dynamic_index == 'yes')
+        else:
+            raise ValueError('Unknown value of dynamic_index: {}'\
+                             .format(dynamic_index))
+        # if > 1, the iterations are run in batches of this size
+        # (see next_batch(); not possible with the depth cost)
+        self.move_batch_size = move_batch_size
+        # the costs of the moves are divided by the temperature
+        # (see run_tempering())
+        self.temperature = 1.0
+        self.edge_source_ids = self.edge_set.source_ids()
+        self.edge_target_ids = self.edge_set.target_ids()
+        # the edges sorted by source and target, for vectorized lookups
+        # of the edges between pairs of nodes
+        edge_keys = self.edge_source_ids * len(self.lexicon) + \
+                    self.edge_target_ids
+        self._edge_key_order = np.argsort(edge_keys, kind='stable')
+        self._sorted_edge_keys = edge_keys[self._edge_key_order]
+        # if set, only these edges are proposed (used to sample a part
+        # of the graph consisting of whole connected components)
+        self.proposal_edge_ids = None     # type: np.ndarray
+        # if > 0, the edges are proposed with probabilities proportional
+        # to min(1, exp(gain / proposal_temperature)), where the gain is
+        # the root cost of the target minus the edge cost -- edges that
+        # would almost always be rejected are proposed less often
+        self.proposal_temperature = proposal_temperature
+        self.edge_proposal_weights = None # type: np.ndarray
+        self.seed = seed
+        self.set_seed(seed)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        # additional values saved in the checkpoints -- a checkpoint is only
+        # resumed if they match (e.g. the number of the EM iteration)
+        self.checkpoint_metadata = {}     # type: Dict[str, int]
+        # if set, sampling starts from this branching instead of a random one
+        self.initial_edge_ids = None      # type: np.ndarray
+        self.phase = 'warmup'
+        # adaptive stopping: the warmup ends when the traces of
+        # the log-likelihood and the number of edges are stationary
+        # (split-R-hat below max_rhat), sampling ends when their
+        # effective sample size reaches target_ess (0 = disabled)
+        self.target_ess = target_ess
+        self.max_rhat = max_rhat
+        # if set, the warmup ends at stationarity also without target_ess
+        # (e.g. when starting from a branching that is already warm)
+        self.adaptive_warmup = adaptive_warmup
+        self.diagnostic_interval = diagnostic_interval
+        self.logl_trace = []              # type: List[float]
+        self.num_edges_trace = []         # type: List[int]
+
+        # the index of the unordered word pairs is only built if needed
+        # (see word_pair_index())
+        self._word_pair_keys = None       # type: np.ndarray
+        self._edge_pair_ids = None        # type: np.ndarray
+        self._word_ranks = None           # type: np.ndarray
     
+    def word_ranks(self) -> np.ndarray:
+        '''Return the position of every word (by lexicon ID) in
+           the alphabetical order of the literals, which determines
+           the order of the words in a pair (as LexiconEntry.__lt__).'''
+        if self._word_ranks is None:
+            order = np.argsort([entry.literal for entry in self.lexicon],
+                               kind='stable')
+            self._word_ranks = np.empty(len(self.lexicon), dtype=np.int64)
+            self._word_ranks[order] = np.arange(len(self.lexicon))
+        return self._word_ranks
+
+    def word_pair_keys(self, w_ids_1 :np.ndarray, w_ids_2 :np.ndarray) \
+                      -> np.ndarray:
+        '''Pack the unordered pairs of words given by lexicon IDs into
+           keys `min_rank * len(lexicon) + max_rank` (see word_ranks()).'''
+        ranks_1, ranks_2 = self.word_ranks()[w_ids_1], \
+                           self.word_ranks()[w_ids_2]
+        return np.minimum(ranks_1, ranks_2) * len(self.lexicon) + \
+               np.maximum(ranks_1, ranks_2)
+
+    def word_pair_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        '''Return the unordered pairs of words connected by an edge
+           as sorted keys (see word_pair_keys()) and the index of the pair
+           of every edge. The index is built on the first call.'''
+        if self._edge_pair_ids is None:
+            self._word_pair_keys, self._edge_pair_ids = \
+                np.unique(self.word_pair_keys(self.edge_source_ids,
+                                              self.edge_target_ids),
+                          return_inverse=True)
+        return self._word_pair_keys, self._edge_pair_ids
+
     def add_stat(self, name: str, stat :MCMCStatistic) -> None:
         if name in self.stats:
             raise Exception('Duplicate statistic name: %s' % name)
         self.stats[name] = stat
+        if self.journal is None or not stat.journaled:
+            self.dispatched_stats.append(stat)
 
     def logl(self) -> float:
         return self._logl
 
+    def set_seed(self, seed :Any) -> None:
+        '''(Re-)initialize the random number generator. `seed` can be
+           anything accepted by numpy.random.default_rng().'''
+        self.rng = np.random.default_rng(seed)
+        self._init_random_stream()
+
+    def _init_random_stream(self) -> None:
+        weights = self.edge_proposal_weights
+        if weights is not None and self.proposal_edge_ids is not None:
+            weights = weights[self.proposal_edge_ids]
+        self.random_stream = \
+            RandomStream(self.rng,
+                         len(self.edge_set) \
+                         if self.proposal_edge_ids is None \
+                         else len(self.proposal_edge_ids),
+                         edge_weights=weights)
+
+    def empty_branching_logl(self) -> float:
+        '''The log-likelihood of the branching without edges.'''
+        return float(np.sum(self.root_cost_cache) + self.model.null_cost())
+
     def set_initial_branching(self, branching :Branching) -> None:
-        self._logl = \
-            float(np.sum(self.root_cost_cache) + self.model.null_cost() +\
-                  self.cost_of_change(list(branching.edges_iter()), []))
+        branching_cost = \
+            float(np.sum(self.edge_delta_cache[branching.edge_ids()]))
+        self._logl = self.empty_branching_logl() + branching_cost
         logging.getLogger('main').debug('roots cost = {}'\
             .format(np.sum(self.root_cost_cache)))
         logging.getLogger('main').debug('null cost = {}'\
             .format(self.model.null_cost()))
         logging.getLogger('main').debug('initial branching cost = {}'\
-            .format(self.cost_of_change(list(branching.edges_iter()), [])))
-
-    def run_sampling(self) -> None:
+            .format(branching_cost))
+
+    def run_sampling(self, num_chains :int = 1, num_processes :int = 1,
+                     resume :bool = False,
+                     component_batch_size :int = 0,
+                     exact_component_size :int = 0,
+                     num_temperatures :int = 1,
+                     max_temperature :float = 10.0,
+                     swap_interval :int = 1000) -> None:
+        '''Run the sampler. If `num_chains` > 1, run that many independent
+           chains in `num_processes` processes and merge their statistics.
+           If `component_batch_size` or `exact_component_size` > 0,
+           process the connected components of the graph separately
+           instead (see run_components()). If `num_temperatures` > 1,
+           run parallel tempering with temperatures spaced geometrically
+           between 1 and `max_temperature` (see run_tempering()).
+           If `resume` is set, continue from the last checkpoint
+           (if present).'''
         self.cache_costs()
-        self.branching = self.full_graph.random_branching()
-        self.set_initial_branching(self.branching)
-        logging.getLogger('main').debug(\
-            'initial log-likelihood: {}'.format(self._logl))
-        logging.getLogger('main').info('Warming up the sampler...')
-        self.reset()
-        for i in tqdm.tqdm(range(self.warmup_iter)):
+        if component_batch_size > 0 or exact_component_size > 0:
+            if num_chains > 1:
+                logging.getLogger('main').warning(\
+                    'Sampling connected components separately --'
+                    ' num_chains = {} ignored.'.format(num_chains))
+            if num_temperatures > 1:
+                logging.getLogger('main').warning(\
+                    'Sampling connected components separately --'
+                    ' num_temperatures = {} ignored.'\
+                    .format(num_temperatures))
+            self.run_components(component_batch_size, num_processes,
+                                resume=resume,
+                                exact_component_size=exact_component_size)
+        elif num_temperatures > 1 and self.depth_cost != 0:
+            logging.getLogger('main').warning(\
+                'Parallel tempering is not possible with the depth cost --'
+                ' num_temperatures = {} ignored.'.format(num_temperatures))
+            self.run_chain(resume=resume)
+        elif num_temperatures > 1:
+            if num_chains > 1:
+                logging.getLogger('main').warning(\
+                    'Running parallel tempering -- num_chains = {} ignored.'\
+                    .format(num_chains))
+            self.run_tempering(
+                np.geomspace(1, max_temperature, num_temperatures).tolist(),
+                num_processes, swap_interval=swap_interval, resume=resume)
+        elif num_chains > 1:
+            self.run_parallel_chains(num_chains, num_processes, resume=resume)
+        else:
+            self.run_chain(resume=resume)
+
+    def _create_initial_branching(self) -> Branching:
+        if self.initial_edge_ids is not None:
+            initial_edge_ids = self.initial_edge_ids
+            if self.proposal_edge_ids is not None:
+                initial_edge_ids = initial_edge_ids[
+                    np.isin(initial_edge_ids, self.proposal_edge_ids)]
+            branching = self.full_graph.empty_branching(
+                            dynamic_index=self.dynamic_index)
+            for e_id in initial_edge_ids:
+                branching.add_edge_id(int(e_id))
+            return branching
+        return self.full_graph.random_branching(
+                   dynamic_index=self.dynamic_index, rng=self.rng,
+                   edge_ids=self.proposal_edge_ids)
+
+    def run_chain(self, show_progressbar :bool = True,
+                  resume :bool = False) -> None:
+        '''Run a single chain (warmup and sampling) from a newly created
+           initial branching or from the last checkpoint. Requires
+           the costs to be cached.'''
+        if not (resume and self._resume_checkpoint(self.checkpoint_file)):
+            self.branching = self._create_initial_branching()
+            self.set_initial_branching(self.branching)
+            logging.getLogger('main').debug(\
+                'initial log-likelihood: {}'.format(self._logl))
+            self.phase = 'warmup'
+            self.reset()
+        if self.phase == 'warmup':
+            logging.getLogger('main').info('Warming up the sampler...')
+            self._run_iterations(self.warmup_iter, show_progressbar)
+            logging.getLogger('main').debug(\
+                'log-likelihood after {} warmup iterations: {}'\
+                .format(self.iter_num, self._logl))
+            self.phase = 'sampling'
+            self.reset()
+        if self.phase == 'sampling':
+            logging.getLogger('main').info('Sampling...')
+            self._run_iterations(self.sampling_iter, show_progressbar)
+            self.update_stats()
+            if self.journal_file is not None:
+                end_journal_file(self.journal_file, self.iter_num,
+                                 self._logl)
+            self.close_trace()
+            self.log_diagnostics()
+            self.phase = 'done'
+            if self.checkpoint_file is not None:
+                self.save_checkpoint(self.checkpoint_file)
+
+    def _run_iterations(self, num_iter :int, show_progressbar :bool) -> None:
+        '''Run the current phase until `iter_num` reaches `num_iter`
+           or the convergence criterion of the phase is met.'''
+        if self.move_batch_size > 1 and self.depth_cost == 0 and \
+                self.default_proposals:
+            with tqdm.tqdm(initial=self.iter_num, total=num_iter,
+                           disable=not show_progressbar) as progressbar:
+                while self.iter_num < num_iter:
+                    # a batch ends at the next diagnostic or checkpoint
+                    # iteration
+                    size = min(self.move_batch_size, num_iter-self.iter_num,
+                               self.diagnostic_interval - \
+                                   self.iter_num % self.diagnostic_interval)
+                    if self.checkpoint_interval > 0:
+                        size = min(size, self.checkpoint_interval - \
+                                   self.iter_num % self.checkpoint_interval)
+                    self.next_batch(size)
+                    progressbar.update(size)
+                    if self._iteration_done():
+                        break
+            return
+        for i in tqdm.tqdm(range(self.iter_num, num_iter),
+                           initial=self.iter_num, total=num_iter,
+                           disable=not show_progressbar):
             self.next()
-        logging.getLogger('main').debug(\
-            'log-likelihood after warmup: {}'.format(self._logl))
+            if self._iteration_done():
+                break
+
+    def _iteration_done(self) -> bool:
+        '''Record the traces and save a checkpoint if the current iteration
+           is due. Returns True if the convergence criterion is met.'''
+        if self.iter_num % self.diagnostic_interval == 0:
+            self.logl_trace.append(self._logl)
+            self.num_edges_trace.append(self.branching.number_of_edges())
+            if (self.target_ess > 0 or \
+                    (self.adaptive_warmup and self.phase == 'warmup')) and \
+                    self._has_converged():
+                logging.getLogger('main').info(\
+                    'Convergence criterion met after {} iterations.'\
+                    .format(self.iter_num))
+                return True
+            if self.trace is not None and \
+                    time.monotonic() - self._trace_time >= \
+                        self.TRACE_MAX_DELAY:
+                self.write_trace()
+        if self.checkpoint_interval > 0 and \
+                self.iter_num % self.checkpoint_interval == 0:
+            self.save_checkpoint(self.checkpoint_file)
+        return False
+
+    def _has_converged(self) -> bool:
+        # check after every MIN_TRACE_LENGTH/2 new trace points
+        if len(self.logl_trace) < self.MIN_TRACE_LENGTH or \
+                len(self.logl_trace) % (self.MIN_TRACE_LENGTH // 2) != 0:
+            return False
+        traces = (np.array(self.logl_trace), np.array(self.num_edges_trace))
+        if self.phase == 'warmup':
+            # discard the first half of the warmup trace and check whether
+            # the rest is stationary
+            return all(split_rhat([trace[len(trace)//2:]]) < self.max_rhat \
+                       for trace in traces)
+        else:
+            return all(effective_sample_size(trace) >= self.target_ess \
+                       for trace in traces)
+
+    def log_diagnostics(self) -> None:
+        if len(self.logl_trace) < 2:
+            return
+        logging.getLogger('main').info(\
+            'Effective sample size: {:.1f} (log-likelihood), {:.1f}'
+            ' (number of edges)'.format(
+                effective_sample_size(self.logl_trace),
+                effective_sample_size(self.num_edges_trace)))
+
+    def run_parallel_chains(self, num_chains :int, num_processes :int,
+                            resume :bool = False) -> None:
+        '''Run independent chains (each with its own seed and initial
+           branching) in a process pool and merge their statistics.
+           Afterwards, the sampler holds the final branching of the first
+           chain.'''
+
+        def _run_chains(seeds :List[Tuple[int, np.random.SeedSequence]],
+                        output_fun :Callable[..., None],
+                        sampler :'MCMCGraphSampler',
+                        trace_files :List[str]) -> None:
+            checkpoint_file = sampler.checkpoint_file
+            journal_file = sampler.journal_file
+            for chain_num, seed in seeds:
+                sampler.trace_file = trace_files[chain_num]
+                sampler.set_seed(seed)
+                if checkpoint_file is not None:
+                    # every chain is checkpointed in a separate file
+                    root, ext = os.path.splitext(checkpoint_file)
+                    sampler.checkpoint_file = \
+                        '{}.chain{}{}'.format(root, chain_num, ext)
+                if journal_file is not None:
+                    root, ext = os.path.splitext(journal_file)
+                    sampler.journal_file = \
+                        '{}.chain{}{}'.format(root, chain_num, ext)
+                sampler.run_chain(show_progressbar=False, resume=resume)
+                states = { name : stat.state() \
+                           for name, stat in sampler.stats.items() }
+                output_fun((chain_num, sampler.branching.edge_ids(), states,
+                            sampler.iter_num, sampler.logl_trace,
+                            sampler.num_edges_trace))
+
+        if resume and self._resume_checkpoint(self.checkpoint_file) \
+                and self.phase == 'done':
+            return
+        # every chain writes the values of the iteration statistics to its
+        # own trace file, from which they are merged afterwards
+        trace_files = self._part_trace_files('chain', range(num_chains))
+        # independent random streams for the chains, determined by the seed
+        # of this sampler
+        seeds = list(enumerate(\
+                    np.random.SeedSequence(self.seed).spawn(num_chains)))
+        num_processes = min(num_processes, num_chains)
+        logging.getLogger('main').info(\
+            'Running {} chains in {} processes...'\
+            .format(num_chains, num_processes))
+        results = sorted(parallel_execute(function=_run_chains, data=seeds,
+                                          num_processes=num_processes,
+                                          additional_args=(self, trace_files),
+                                          show_progressbar=True),
+                         key=itemgetter(0))
+        if len(results) < num_chains:
+            raise RuntimeError('{} out of {} chains failed.'\
+                               .format(num_chains-len(results), num_chains))
+        self.branching = self.full_graph.empty_branching(
+                             dynamic_index=self.dynamic_index)
+        for e_id in results[0][1]:
+            self.branching.add_edge_id(int(e_id))
+        self.set_initial_branching(self.branching)
         self.reset()
-        logging.getLogger('main').info('Sampling...')
-        for i in tqdm.tqdm(range(self.sampling_iter)):
-            self.next()
+        # with adaptive stopping, the chains may differ in length --
+        # weight the estimates by the number of iterations
+        chain_iters = [result[3] for result in results]
+        self.iter_num = min(chain_iters)
+        for name, stat in self.stats.items():
+            if isinstance(stat, IterationStatistic):
+                continue
+            stat.merge([result[2][name] for result in results],
+                       weights=chain_iters)
+            if isinstance(stat, ScalarStatistic):
+                logging.getLogger('main').debug(\
+                    '{} = {} (between-chain variance: {})'\
+                    .format(name, stat.value(), stat.chain_var))
+        if all(len(result[4]) >= 4 for result in results):
+            rhat_logl = split_rhat([result[4] for result in results])
+            rhat_edges = split_rhat([result[5] for result in results])
+            logging.getLogger('main').info(\
+                'Split-R-hat across chains: {:.3f} (log-likelihood),'
+                ' {:.3f} (number of edges)'.format(rhat_logl, rhat_edges))
+            if max(rhat_logl, rhat_edges) > self.max_rhat:
+                logging.getLogger('main').warning(\
+                    'The chains have not converged (R-hat > {}).'\
+                    .format(self.max_rhat))
+        self.phase = 'done'
+        self._merge_traces(trace_files)
+        if self.checkpoint_file is not None:
+            self.save_checkpoint(self.checkpoint_file)
+        for filename in trace_files:
+            if filename is not None:
+                remove_file_if_exists(filename)
+
+    def run_tempering(self, temperatures :List[float], num_processes :int,
+                      swap_interval :int = 1000,
+                      resume :bool = False) -> None:
+        '''Parallel tempering (replica exchange): run a copy of the chain
+           at each of the given temperatures, with the costs of the moves
+           divided by the temperature, and every `swap_interval` iterations
+           propose to exchange the branchings of neighbouring temperatures
+           (alternately the even and the odd pairs). The hot replicas
+           cross the barriers between local modes more easily and pass
+           their states down to the cold ones. This sampler runs
+           the replica at temperatures[0] (normally 1) and only this
+           replica feeds the statistics. The other replicas are copies of
+           this sampler, distributed over `num_processes` processes.
+           Adaptive stopping and intermediate checkpoints are not used.
+           Requires depth_cost = 0.'''
+
+        def _execute(replicas :Dict[int, 'MCMCGraphSampler'],
+                     command :str, arg :Any) -> Dict[int, Any]:
+            results = {}
+            for slot, replica in replicas.items():
+                if command == 'init':
+                    replica.branching = replica._create_initial_branching()
+                    replica.set_initial_branching(replica.branching)
+                    replica.phase = 'warmup'
+                    replica.reset()
+                elif command == 'sampling':
+                    replica.phase = 'sampling'
+                    replica.reset()
+                elif command == 'run':
+                    replica._run_iterations(arg, False)
+                    results[slot] = replica._logl
+                elif command == 'get' and slot in arg:
+                    results[slot] = replica.branching.edge_ids()
+                elif command == 'set' and slot in arg:
+                    replica._replace_branching(arg[slot])
+            return results
+
+        def _serve(replicas :Dict[int, 'MCMCGraphSampler'],
+                   conn :'multiprocessing.connection.Connection') -> None:
+            while True:
+                command, arg = conn.recv()
+                if command == 'stop':
+                    break
+                conn.send(_execute(replicas, command, arg))
+            conn.close()
+
+        if resume and self._resume_checkpoint(self.checkpoint_file) \
+                and self.phase == 'done':
+            return
+        # independent random streams for the replicas and the swaps,
+        # determined by the seed of this sampler
+        seeds = np.random.SeedSequence(self.seed)\
+                .spawn(len(temperatures)+1)
+        swap_rng = np.random.default_rng(seeds[-1])
+        saved_settings = \
+            self.target_ess, self.checkpoint_interval, self.adaptive_warmup
+        self.target_ess, self.checkpoint_interval, self.adaptive_warmup = \
+            0, 0, False
+        replicas = []
+        for slot, temperature in enumerate(temperatures):
+            replica = self
+            if slot > 0:
+                replica = copy.copy(self)
+                replica.stats, replica.dispatched_stats = {}, []
+                replica.journal = MoveJournal()
+                replica.journal_file, replica.checkpoint_file = None, None
+                replica.trace_file = None
+            replica.temperature = temperature
+            replica.set_seed(seeds[slot])
+            replicas.append(replica)
+        # the replicas of the first group run in this process
+        num_processes = max(1, min(num_processes, len(temperatures)))
+        groups = [{ slot : replicas[slot] \
+                    for slot in range(i, len(replicas), num_processes) } \
+                  for i in range(num_processes)]
+        connections, processes = [], []
+        for group in groups[1:]:
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve,
+                                              args=(group, child_conn))
+            process.start()
+            connections.append(conn)
+            processes.append(process)
+
+        def _broadcast(command :str, arg :Any = None) -> Dict[int, Any]:
+            for conn in connections:
+                conn.send((command, arg))
+            results = _execute(groups[0], command, arg)
+            for conn in connections:
+                results.update(conn.recv())
+            return results
+
+        logging.getLogger('main').info(\
+            'Running parallel tempering with temperatures {} in {}'
+            ' processes...'.format(
+                ', '.join('{:.3g}'.format(t) for t in temperatures),
+                num_processes))
+        num_proposed = np.zeros(len(temperatures)-1, dtype=np.int64)
+        num_accepted = np.zeros(len(temperatures)-1, dtype=np.int64)
+        round_num = 0
+        try:
+            _broadcast('init')
+            for phase, num_iter in (('warmup', self.warmup_iter),
+                                    ('sampling', self.sampling_iter)):
+                if phase == 'warmup':
+                    logging.getLogger('main').info('Warming up the sampler...')
+                else:
+                    _broadcast('sampling')
+                    logging.getLogger('main').info('Sampling...')
+                for start in tqdm.tqdm(range(0, num_iter, swap_interval)):
+                    logls = _broadcast('run',
+                                       min(start+swap_interval, num_iter))
+                    swaps = {}
+                    for i in range(round_num % 2, len(temperatures)-1, 2):
+                        log_acc_prob = \
+                            (1/temperatures[i] - 1/temperatures[i+1]) * \
+                            (logls[i] - logls[i+1])
+                        num_proposed[i] += 1
+                        if log_acc_prob >= 0 or \
+                                swap_rng.random() < math.exp(log_acc_prob):
+                            swaps[i], swaps[i+1] = i+1, i
+                            num_accepted[i] += 1
+                    if swaps:
+                        edge_ids = _broadcast('get', set(swaps))
+                        _broadcast('set', { slot : edge_ids[other] \
+                                            for slot, other in swaps.items() })
+                    round_num += 1
+        finally:
+            for conn in connections:
+                conn.send(('stop', None))
+            for process in processes:
+                process.join()
+            self.target_ess, self.checkpoint_interval, \
+                self.adaptive_warmup = saved_settings
         self.update_stats()
+        if self.journal_file is not None:
+            end_journal_file(self.journal_file, self.iter_num, self._logl)
+        self.close_trace()
+        self.log_diagnostics()
+        logging.getLogger('main').info(\
+            'Swap acceptance rates: {}'.format(', '.join(
+                '{:.3f}'.format(acc / max(prop, 1)) \
+                for acc, prop in zip(num_accepted, num_proposed))))
+        self.phase = 'done'
+        if self.checkpoint_file is not None:
+            self.save_checkpoint(self.checkpoint_file)
+
+    def _replace_branching(self, edge_ids :np.ndarray) -> None:
+        '''Change the current branching into the one consisting of
+           `edge_ids` by a single move (used to exchange the branchings
+           of parallel tempering replicas).'''
+        old_edge_ids = self.branching.edge_ids()
+        edge_ids_to_remove = np.setdiff1d(old_edge_ids, edge_ids)
+        edge_ids_to_add = np.setdiff1d(edge_ids, old_edge_ids)
+        self._logl += self.cost_of_change(edge_ids_to_add, edge_ids_to_remove)
+        for e_id in edge_ids_to_remove.tolist():
+            self.branching.remove_edge_id(e_id)
+            for stat in self.dispatched_stats:
+                stat.edge_removed(e_id)
+        for e_id in edge_ids_to_add.tolist():
+            self.branching.add_edge_id(e_id)
+            for stat in self.dispatched_stats:
+                stat.edge_added(e_id)
+        num_changes = len(edge_ids_to_remove) + len(edge_ids_to_add)
+        self.journal.extend(
+            np.full(num_changes, self.iter_num),
+            np.concatenate((edge_ids_to_remove, edge_ids_to_add)),
+            np.repeat(np.array([-1, 1], dtype=np.int8),
+                      [len(edge_ids_to_remove), len(edge_ids_to_add)]),
+            np.full(num_changes, self._logl))
+        if self.journal.is_full():
+            self.flush_journal()
+
+    @staticmethod
+    def _partition_components(components :List[np.ndarray],
+                              batch_size :int) -> List[List[np.ndarray]]:
+        '''Group connected components (given as arrays of edge IDs) into
+           parts of roughly `batch_size` edges. Components with at least
+           `batch_size` edges form parts of their own. If `batch_size` is
+           0, all components form a single part.'''
+        if batch_size <= 0:
+            return [components] if components else []
+        parts, batch, batch_len = [], [], 0
+        for component in components:
+            if len(component) >= batch_size:
+                parts.append([component])
+                continue
+            batch.append(component)
+            batch_len += len(component)
+            if batch_len >= batch_size:
+                parts.append(batch)
+                batch, batch_len = [], 0
+        if batch:
+            parts.append(batch)
+        return parts
+
+    def exact_edge_marginals(self, edge_ids :np.ndarray) -> np.ndarray:
+        '''Compute the marginal probabilities of the edges of a connected
+           component exactly (valid only without the depth cost).'''
+        return edge_marginals(self.edge_source_ids[edge_ids],
+                              self.edge_target_ids[edge_ids],
+                              self.edge_delta_cache[edge_ids])
+
+    def run_components(self, batch_size :int, num_processes :int,
+                       resume :bool = False,
+                       exact_component_size :int = 0) -> None:
+        '''Sample the connected components of the graph separately.
+           The moves never cross component boundaries, so the components
+           are independent given the cached costs. Small components are
+           sampled in batches (see _partition_components()) and every
+           part gets a share of the warmup and sampling iterations
+           proportional to its number of edges. For components of at most
+           `exact_component_size` nodes, the edge marginals are computed
+           exactly instead of sampling (if the depth cost is 0).
+           The parts are processed in `num_processes` processes and their
+           statistics reassembled afterwards.'''
+
+        def _run_parts(parts :List[Tuple[int, List[np.ndarray],
+                                         np.random.SeedSequence, bool]],
+                       output_fun :Callable[..., None],
+                       sampler :'MCMCGraphSampler',
+                       trace_files :List[str]) -> None:
+            checkpoint_file = sampler.checkpoint_file
+            journal_file = sampler.journal_file
+            warmup_iter, sampling_iter = \
+                sampler.warmup_iter, sampler.sampling_iter
+            for part_num, components, seed, exact in parts:
+                edge_ids = np.concatenate(components)
+                if exact:
+                    marginals = np.concatenate(
+                        [sampler.exact_edge_marginals(component) \
+                         for component in components])
+                    states = { name : stat.exact_state(edge_ids, marginals) \
+                               for name, stat in sampler.stats.items() }
+                    # represent the part in the final branching by
+                    # the most probable parent of every node
+                    best_edge_ids = edge_ids[max_marginal_edges(
+                        sampler.edge_target_ids[edge_ids], marginals)]
+                    output_fun((part_num, best_edge_ids, states, 0))
+                    continue
+                sampler.proposal_edge_ids = edge_ids
+                sampler.trace_file = trace_files[part_num]
+                sampler.set_seed(seed)
+                fraction = len(edge_ids) / len(sampler.edge_set)
+                sampler.warmup_iter = math.ceil(warmup_iter * fraction)
+                sampler.sampling_iter = math.ceil(sampling_iter * fraction)
+                if checkpoint_file is not None:
+                    root, ext = os.path.splitext(checkpoint_file)
+                    sampler.checkpoint_file = \
+                        '{}.part{}{}'.format(root, part_num, ext)
+                if journal_file is not None:
+                    root, ext = os.path.splitext(journal_file)
+                    sampler.journal_file = \
+                        '{}.part{}{}'.format(root, part_num, ext)
+                sampler.run_chain(show_progressbar=False, resume=resume)
+                states = { name : stat.component_state(edge_ids) \
+                           for name, stat in sampler.stats.items() }
+                output_fun((part_num, sampler.branching.edge_ids(), states,
+                            sampler.iter_num))
+
+        if resume and self._resume_checkpoint(self.checkpoint_file) \
+                and self.phase == 'done':
+            return
+        if exact_component_size > 0 and self.depth_cost != 0:
+            logging.getLogger('main').warning(\
+                'Exact edge marginals are not available with a depth cost'
+                ' -- sampling all components.')
+            exact_component_size = 0
+        components = self.full_graph.connected_components()
+        sampled_components, exact_components = [], []
+        for component in components:
+            num_nodes = len(np.union1d(self.edge_source_ids[component],
+                                       self.edge_target_ids[component]))
+            if num_nodes <= exact_component_size:
+                exact_components.append(component)
+            else:
+                sampled_components.append(component)
+        exact_batch_size = batch_size if batch_size > 0 else \
+            math.ceil(sum(len(c) for c in exact_components) / num_processes)
+        parts = \
+            [(part, False) for part in \
+             self._partition_components(sampled_components, batch_size)] +\
+            [(part, True) for part in \
+             self._partition_components(exact_components, exact_batch_size)]
+        part_edge_ids = [np.concatenate(part) for part, exact in parts]
+        # every sampled part writes the values of the iteration statistics
+        # to its own trace file (see run_parallel_chains())
+        trace_files = self._part_trace_files('part', range(len(parts)))
+        seeds = np.random.SeedSequence(self.seed).spawn(len(parts))
+        num_processes = max(1, min(num_processes, len(parts)))
+        logging.getLogger('main').info(\
+            'Sampling {} connected components ({} computed exactly)'
+            ' in {} parts in {} processes...'\
+            .format(len(components), len(exact_components), len(parts),
+                    num_processes))
+        # distribute the large parts evenly among the processes
+        data = [(i, parts[i][0], seeds[i], parts[i][1]) \
+                for p in range(num_processes) \
+                for i in range(p, len(parts), num_processes)]
+        results = sorted(parallel_execute(function=_run_parts, data=data,
+                                          num_processes=num_processes,
+                                          additional_args=(self, trace_files),
+                                          show_progressbar=True),
+                         key=itemgetter(0))
+        if len(results) < len(parts):
+            raise RuntimeError('{} out of {} parts failed.'\
+                               .format(len(parts)-len(results), len(parts)))
+        # the final branching is the union of the branchings of the parts
+        self.branching = self.full_graph.empty_branching(
+                             dynamic_index=self.dynamic_index)
+        for result in results:
+            for e_id in result[1].tolist():
+                if self.branching.is_edge_possible_id(e_id):
+                    self.branching.add_edge_id(e_id)
+        self.set_initial_branching(self.branching)
+        self.reset()
+        # the parts run simultaneously -- iteration i of the whole graph
+        # corresponds to iteration i in every part
+        self.iter_num = max(result[3] for result in results)
+        for name, stat in self.stats.items():
+            if isinstance(stat, IterationStatistic):
+                continue
+            # statistics that cannot be computed from exact marginals
+            # (like the acceptance rate) are merged from sampled parts only
+            merged = [(result[2][name], part_edge_ids[result[0]], result[3]) \
+                      for result in results if result[2][name] is not None]
+            if merged:
+                states, edge_ids, weights = zip(*merged)
+                stat.merge_components(list(states), list(edge_ids),
+                                      weights=list(weights))
+        self.phase = 'done'
+        sampled_parts = [i for i, (part, exact) in enumerate(parts) \
+                         if not exact]
+        self._merge_traces([trace_files[i] for i in sampled_parts],
+                           part_edge_ids=[part_edge_ids[i] \
+                                          for i in sampled_parts],
+                           exact_results=[(result[2], part_edge_ids[result[0]]) \
+                                          for result in results \
+                                          if parts[result[0]][1]])
+        if self.checkpoint_file is not None:
+            self.save_checkpoint(self.checkpoint_file)
+        for filename in trace_files:
+            if filename is not None:
+                remove_file_if_exists(filename)
+
+    def save_checkpoint(self, filename :str) -> None:
+        '''Save the current state of the sampler: the branching,
+           the iteration number, the random number generator and
+           the statistics.'''
+        # (the statistics of a finished run are already up to date and
+        # may be merged from several chains)
+        if self.journal is not None and self.phase != 'done':
+            self.flush_journal()
+        data = { 'edge_ids' : self.branching.edge_ids(),
+                 'num_edges' : len(self.edge_set),
+                 'logl' : self._logl,
+                 'iter_num' : self.iter_num,
+                 'phase' : self.phase,
+                 'logl_trace' : np.array(self.logl_trace),
+                 'num_edges_trace' : np.array(self.num_edges_trace,
+                                              dtype=np.int64) }
+        if self.journal_file is not None:
+            data['journal_size'] = journal_file_size(self.journal_file)
+        if self.trace is not None:
+            self.write_trace()
+            self.trace.flush()
+            data['trace_size'] = trace_file_size(self._trace_path())
+        for key, value in self.random_stream.get_state().items():
+            data['random_stream.' + key] = value
+        for name, stat in self.stats.items():
+            for attr, value in stat.checkpoint_state().items():
+                data['stat.{}.{}'.format(name, attr)] = value
+        for key, value in self.checkpoint_metadata.items():
+            data['meta.' + key] = value
+        # write to a temporary file first, so that an interruption
+        # does not destroy the previous checkpoint
+        path = full_path(filename)
+        with open(path + '.tmp', 'wb') as fp:
+            np.savez(fp, **data)
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, filename :str) -> None:
+        data = read_checkpoint(filename)
+        if int(data['num_edges']) != len(self.edge_set):
+            raise RuntimeError('The checkpoint {} does not match the graph.'\
+                               .format(filename))
+        self.branching = self.full_graph.empty_branching(
+                             dynamic_index=self.dynamic_index)
+        for e_id in data['edge_ids'].tolist():
+            self.branching.add_edge_id(e_id)
+        self.set_initial_branching(self.branching)
+        self.reset()
+        self._logl = float(data['logl'])
+        self.iter_num = int(data['iter_num'])
+        self.phase = str(data['phase'])
+        self.logl_trace = data['logl_trace'].tolist()
+        self.num_edges_trace = data['num_edges_trace'].tolist()
+        self.random_stream.set_state(
+            { key[len('random_stream.'):] : value \
+              for key, value in data.items() \
+              if key.startswith('random_stream.') })
+        for name, stat in self.stats.items():
+            stat.restore_state(
+                { attr : data['stat.{}.{}'.format(name, attr)] \
+                  for attr in stat.checkpoint_attrs })
+        if self.phase == 'sampling' and self.journal_file is not None \
+                and 'journal_size' in data:
+            # discard the moves journaled after the checkpoint
+            truncate_journal_file(self.journal_file,
+                                  int(data['journal_size']))
+        if self.phase == 'sampling' and self._iter_stats():
+            if 'trace_size' in data:
+                # discard the rows written after the checkpoint
+                truncate_trace_file(self._trace_path(),
+                                    int(data['trace_size']))
+                self.start_trace(append=True)
+            else:
+                self.start_trace()
+
+    def _resume_checkpoint(self, filename :str) -> bool:
+        '''Load the checkpoint if it exists and belongs to the current run.
+           Returns True if the checkpoint was loaded.'''
+        if filename is None or not file_exists(filename):
+            return False
+        data = read_checkpoint(filename)
+        metadata = { key[len('meta.'):] : int(value) \
+                     for key, value in data.items() \
+                     if key.startswith('meta.') }
+        if metadata != self.checkpoint_metadata or \
+                int(data['num_edges']) != len(self.edge_set):
+            logging.getLogger('main').warning(\
+                'Ignoring the checkpoint {}: it does not match the current'
+                ' run.'.format(filename))
+            return False
+        self.load_checkpoint(filename)
+        logging.getLogger('main').info(\
+            'Resuming from {} ({}, iteration {}).'\
+            .format(filename, self.phase, self.iter_num))
+        return True
 
     def next(self) -> None:
         # increase the number of iterations
         self.iter_num += 1
 
         # select an edge randomly
-        edge = self.full_graph.random_edge()
+        edge_id = self.random_stream.edge_id()
+        if self.proposal_edge_ids is not None:
+            edge_id = int(self.proposal_edge_ids[edge_id])
 
         # try the move determined by the selected edge
+        accepted = False
+        time_started = time.perf_counter()
         try:
-            edges_to_add, edges_to_remove, prop_prob_ratio, depth_change =\
-                self.determine_move_proposal(edge)
-            acc_prob = self.compute_acc_prob(\
-                edges_to_add, edges_to_remove, prop_prob_ratio, depth_change)
-            if acc_prob >= 1 or acc_prob >= random.random():
-                self.accept_move(edges_to_add, edges_to_remove)
+            edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio, \
+                depth_change = self.determine_move_proposal(edge_id)
+            move_type = self.move_type
+            time_proposed = time.perf_counter()
+            acc_prob = self.compute_acc_prob(edge_ids_to_add,
+                                             edge_ids_to_remove,
+                                             prop_prob_ratio, depth_change)
+            if acc_prob >= 1 or acc_prob >= self.random_stream.uniform():
+                self.accept_move(edge_ids_to_add, edge_ids_to_remove)
+                accepted = True
         # if move impossible -- propose staying in the current graph
         # (the acceptance probability for that is 1, so this move
         # is automatically accepted and nothing needs to be done)
         except ImpossibleMoveException:
-            pass
-
-        # inform all the statistics that the iteration is completed
-        for stat in self.stats.values():
+            move_type = 'impossible'
+            time_proposed = time.perf_counter()
+        time_finished = time.perf_counter()
+
+        # inform the statistics that the iteration is completed
+        for stat in self.dispatched_stats:
+            stat.move_done(move_type, accepted,
+                           time_proposed - time_started,
+                           time_finished - time_proposed)
             stat.next_iter()
 
-    # TODO fit to the new Branching class
+    def next_batch(self, size :int) -> None:
+        '''Run `size` iterations at once (requires depth_cost = 0).
+           The candidate moves that involve only trees not touched by
+           an earlier candidate of the batch are independent of each
+           other: they are proposed, evaluated and applied with vectorized
+           operations. The remaining candidates are processed afterwards,
+           in order, like in next(). A move changes only the trees it
+           involves, so the result is distributed like that of `size`
+           calls of next().
+
+           The statistics that are not journaled are notified of the moves
+           afterwards, with the time of the batch divided evenly among
+           them.'''
+        time_started = time.perf_counter()
+        first_iter = self.iter_num + 1
+        edge_ids = self.random_stream.edge_id_batch(size)
+        if self.proposal_edge_ids is not None:
+            edge_ids = self.proposal_edge_ids[edge_ids]
+        # for every candidate: acceptance, type of flip, edge for a flip
+        u_acc, u_flip, u_edge = \
+            self.random_stream.uniform_batch(3*size).reshape((3, size))
+        source_ids = self.edge_source_ids[edge_ids]
+        target_ids = self.edge_target_ids[edge_ids]
+        depths, jumps = self.branching.ancestor_index()
+        roots = jumps[-1]
+        cand_ids = np.arange(size)
+        first_cand = np.full(len(roots), size)
+        np.minimum.at(first_cand, roots[source_ids], cand_ids)
+        np.minimum.at(first_cand, roots[target_ids], cand_ids)
+        independent = (first_cand[roots[source_ids]] == cand_ids) & \
+                      (first_cand[roots[target_ids]] == cand_ids)
+
+        # determine the moves (as in determine_move_proposal(), with
+        # the nodes numbered as in nodes_for_flip())
+        parent_edge = self.branching.parent_edge
+        target_parent_edge_ids = parent_edge[target_ids]
+        is_delete = target_parent_edge_ids == edge_ids
+        # node_5: the ancestor of the source one level below the target
+        node_5 = self.branching.ancestors_at_distance(
+            jumps, source_ids,
+            np.maximum(depths[source_ids] - depths[target_ids] - 1, 0))
+        node_5_parent_edge_ids = parent_edge[node_5]
+        is_flip = ~is_delete & \
+                  (depths[source_ids] > depths[target_ids]) & \
+                  (self.edge_source_ids[node_5_parent_edge_ids] == target_ids)
+        is_flip_1 = is_flip & (u_flip < 0.5)
+        is_flip_2 = is_flip & ~is_flip_1
+        is_swap = ~is_delete & ~is_flip & (target_parent_edge_ids >= 0)
+        is_add = ~is_delete & ~is_flip & (target_parent_edge_ids < 0)
+        node_3 = np.where(target_parent_edge_ids >= 0,
+                          self.edge_source_ids[target_parent_edge_ids], -1)
+        has_node_3 = is_flip & (node_3 >= 0)
+        # flip_1 adds an edge node_3 -> node_1, flip_2 node_3 -> node_5
+        num_new_edges, new_edge_ids = self._choose_edges_between(
+            node_3, np.where(is_flip_1, source_ids, node_5), u_edge)
+        num_old_edges = self._choose_edges_between(
+            node_3, target_ids, u_edge)[0]
+        is_impossible = has_node_3 & (num_new_edges == 0)
+        # the reverse move chooses one of the edges node_3 -> node_2
+        prop_prob_ratio = np.where(has_node_3,
+                                   num_new_edges / np.maximum(num_old_edges, 1),
+                                   1.0)
+        removed = np.vstack([
+            np.select([is_delete, is_swap, is_flip_1, is_flip_2],
+                      [edge_ids, target_parent_edge_ids,
+                       parent_edge[source_ids], node_5_parent_edge_ids], -1),
+            np.where(has_node_3, target_parent_edge_ids, -1)])
+        added = np.vstack([np.where(is_delete, -1, edge_ids),
+                           np.where(has_node_3, new_edge_ids, -1)])
+        if self.edge_proposal_weights is not None:
+            # the reverse of a swap or a flip is triggered by the first
+            # removed edge
+            reverse_edge_ids = np.where(removed[0] >= 0, removed[0], edge_ids)
+            prop_prob_ratio *= self.edge_proposal_weights[reverse_edge_ids] / \
+                               self.edge_proposal_weights[edge_ids]
+        delta = self.edge_delta_cache
+        costs = np.sum(np.where(added >= 0, delta[added], 0), axis=0) - \
+                np.sum(np.where(removed >= 0, delta[removed], 0), axis=0)
+        with np.errstate(divide='ignore'):
+            acc_probs = np.exp(np.minimum(np.log(prop_prob_ratio) - \
+                                          costs / self.temperature, 0))
+        accepted = independent & ~is_impossible & (u_acc <= acc_probs)
+
+        # apply the independent moves
+        acc_ids = np.flatnonzero(accepted)
+        for e_id in removed[:,acc_ids].ravel().tolist():
+            if e_id >= 0:
+                self.branching.remove_edge_id(e_id)
+        for e_id in added[:,acc_ids].ravel().tolist():
+            if e_id >= 0:
+                self.branching.add_edge_id(e_id)
+        rec_cand_ids = np.tile(acc_ids, 4).tolist()
+        rec_edge_ids = np.concatenate((removed[:,acc_ids].ravel(),
+                                       added[:,acc_ids].ravel())).tolist()
+        rec_signs = [-1] * (2*len(acc_ids)) + [1] * (2*len(acc_ids))
+
+        # process the remaining candidates sequentially
+        move_types = {}                   # type: Dict[int, str]
+        for i in np.flatnonzero(~independent).tolist():
+            try:
+                edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio_i, \
+                    depth_change = \
+                        self.determine_move_proposal(int(edge_ids[i]))
+                move_types[i] = self.move_type
+                acc_prob = self.compute_acc_prob(edge_ids_to_add,
+                                                 edge_ids_to_remove,
+                                                 prop_prob_ratio_i,
+                                                 depth_change)
+                if acc_prob >= 1 or acc_prob >= u_acc[i]:
+                    for e_id in edge_ids_to_remove:
+                        self.branching.remove_edge_id(e_id)
+                        rec_cand_ids.append(i)
+                        rec_edge_ids.append(e_id)
+                        rec_signs.append(-1)
+                    for e_id in edge_ids_to_add:
+                        self.branching.add_edge_id(e_id)
+                        rec_cand_ids.append(i)
+                        rec_edge_ids.append(e_id)
+                        rec_signs.append(1)
+                    accepted[i] = True
+                    costs[i] = self.cost_of_change(edge_ids_to_add,
+                                                   edge_ids_to_remove)
+            except ImpossibleMoveException:
+                move_types[i] = 'impossible'
+
+        # record the changes in the order of the iterations
+        rec_cand_ids = np.array(rec_cand_ids, dtype=np.int64)
+        rec_edge_ids = np.array(rec_edge_ids, dtype=np.int64)
+        rec_signs = np.array(rec_signs, dtype=np.int8)
+        order = np.lexsort((rec_signs, rec_cand_ids))
+        order = order[rec_edge_ids[order] >= 0]
+        rec_cand_ids = rec_cand_ids[order]
+        rec_edge_ids = rec_edge_ids[order]
+        rec_signs = rec_signs[order]
+        logls = self._logl + np.cumsum(np.where(accepted, costs, 0))
+        if np.isnan(logls[-1]):
+            raise RuntimeError('NaN log-likelihood at iteration {}'\
+                               .format(first_iter+np.argmax(np.isnan(logls))))
+        self.journal.extend(first_iter + rec_cand_ids, rec_edge_ids,
+                            rec_signs, logls[rec_cand_ids])
+        if self.dispatched_stats:
+            move_time = (time.perf_counter() - time_started) / size
+            vectorized_move_types = \
+                np.select([is_impossible, is_delete, is_add, is_swap,
+                           is_flip_1, is_flip_2],
+                          ['impossible', 'delete', 'add', 'swap_parent',
+                           'flip_1', 'flip_2'], '').tolist()
+            rec_bounds = np.searchsorted(rec_cand_ids, np.arange(size+1))
+            for i in range(size):
+                self.iter_num, self._logl = first_iter + i, float(logls[i])
+                for j in range(rec_bounds[i], rec_bounds[i+1]):
+                    for stat in self.dispatched_stats:
+                        if rec_signs[j] < 0:
+                            stat.edge_removed(int(rec_edge_ids[j]))
+                        else:
+                            stat.edge_added(int(rec_edge_ids[j]))
+                move_type = move_types[i] if i in move_types \
+                            else vectorized_move_types[i]
+                for stat in self.dispatched_stats:
+                    stat.move_done(move_type, bool(accepted[i]),
+                                   move_time, 0.0)
+                    stat.next_iter()
+        self.iter_num = first_iter + size - 1
+        self._logl = float(logls[-1])
+        if self.journal.is_full():
+            self.flush_journal()
+
+    def _choose_edges_between(self, source_ids :np.ndarray,
+                              target_ids :np.ndarray,
+                              uniforms :np.ndarray) \
+                             -> Tuple[np.ndarray, np.ndarray]:
+        '''For each pair of nodes, count the edges from the source to
+           the target and choose one of them using the given uniform
+           random numbers (-1 if there is none). Negative source IDs
+           stand for missing nodes.'''
+        keys = source_ids * len(self.lexicon) + target_ids
+        start = np.searchsorted(self._sorted_edge_keys, keys, side='left')
+        counts = np.searchsorted(self._sorted_edge_keys, keys,
+                                 side='right') - start
+        counts[source_ids < 0] = 0
+        chosen = start + np.minimum((uniforms * counts).astype(np.int64),
+                                    counts-1)
+        return counts, np.where(counts > 0,
+                                self._edge_key_order[np.clip(
+                                    chosen, 0, len(self._edge_key_order)-1)],
+                                -1)
+
     # TODO a more reasonable return value?
-    def determine_move_proposal(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float]:
-        if self.branching.has_edge(edge.source, edge.target, edge.rule):
-            return self.propose_deleting_edge(edge)
-        elif self.branching.has_path(edge.target, edge.source):
-            return self.propose_flip(edge)
-        elif self.branching.parent(edge.target) is not None:
-            return self.propose_swapping_parent(edge)
+    def determine_move_proposal(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        '''Determine the move triggered by the given edge. Returns the IDs
+           of the edges to add and to remove, the proposal probability
+           ratio and the change of the depth term.'''
+        source_id = int(self.edge_source_ids[edge_id])
+        target_id = int(self.edge_target_ids[edge_id])
+        if self.branching.has_edge_id(edge_id):
+            return self.propose_deleting_edge(edge_id)
+        elif self.branching.has_path_id(target_id, source_id):
+            return self.propose_flip(edge_id)
+        elif self.branching.parent_id(target_id) >= 0:
+            return self.propose_swapping_parent(edge_id)
         else:
-            return self.propose_adding_edge(edge)
-
-    def propose_adding_edge(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float, int]:
-        d = self.branching.depth(edge.source) * \
-            self.branching.count_nonleaves(edge.target)
-        return [edge], [], 1, d
-
-    def propose_deleting_edge(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float, int]:
-        d = -self.branching.depth(edge.source) * \
-            self.branching.count_nonleaves(edge.target)
-        return [], [edge], 1, d
-
-    def propose_flip(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float]:
-        if random.random() < 0.5:
-            return self.propose_flip_1(edge)
+            return self.propose_adding_edge(edge_id)
+
+    def propose_adding_edge(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        self.move_type = 'add'
+        d = 0
+        if self.depth_cost != 0:
+            d = self.branching.depth_id(self.edge_source_ids[edge_id]) * \
+                self.branching.count_nonleaves_id(
+                    self.edge_target_ids[edge_id])
+        return [edge_id], [], 1, d
+
+    def propose_deleting_edge(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        self.move_type = 'delete'
+        d = 0
+        if self.depth_cost != 0:
+            d = -self.branching.depth_id(self.edge_source_ids[edge_id]) * \
+                self.branching.count_nonleaves_id(
+                    self.edge_target_ids[edge_id])
+        return [], [edge_id], 1, d
+
+    def propose_flip(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        if self.random_stream.uniform() < 0.5:
+            return self.propose_flip_1(edge_id)
         else:
-            return self.propose_flip_2(edge)
+            return self.propose_flip_2(edge_id)
 
-    def propose_flip_1(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float, int]:
-        edges_to_add, edges_to_remove = [edge], []
-        node_1, node_2, node_3, node_4, node_5 = self.nodes_for_flip(edge)
+    def propose_flip_1(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        self.move_type = 'flip_1'
+        edge_ids_to_add, edge_ids_to_remove = [edge_id], []
+        node_1, node_2, node_3, node_4, node_5 = self.nodes_for_flip(edge_id)
         prop_prob_ratio = 1.0
-        if node_3 is not None:
-            if not self.full_graph.edges_between(node_3, node_1):
+        if node_3 >= 0:
+            edge_ids_3_1 = self.full_graph.edge_ids_between(node_3, node_1)
+            if not edge_ids_3_1:
                 raise ImpossibleMoveException()
-            edges_to_add.append(
-                random.choice(self.full_graph.edges_between(node_3, node_1)))
-            prop_prob_ratio = \
-                len(self.full_graph.edges_between(node_3, node_2)) / \
-                len(self.full_graph.edges_between(node_3, node_1))
-            if prop_prob_ratio == 0:
-                logging.getLogger('main').warn(\
-                    'prop_prob_ratio = 0 (no edge between {} and {}?)'\
-                    .format(node_3, node_2))
-        edges_to_remove.extend(self.branching.edges_between(node_3, node_2))
-        edges_to_remove.extend(self.branching.edges_between(node_4, node_1))
-        n_1 = self.branching.count_nonleaves(node_1)
-        n_2 = self.branching.count_nonleaves(node_2)
-        d_1 = self.branching.depth(node_1)
-        d_3 = self.branching.depth(node_3) if node_3 is not None else 0
-        d = n_2 - n_1 - n_1 * (d_1-d_3-1)
-        return edges_to_add, edges_to_remove, prop_prob_ratio, d
-
-    def propose_flip_2(self, edge :GraphEdge) \
-            -> Tuple[List[GraphEdge], List[GraphEdge], float, int]:
-        edges_to_add, edges_to_remove = [edge], []
-        node_1, node_2, node_3, node_4, node_5 = self.nodes_for_flip(edge)
+            edge_ids_to_add.append(self.random_stream.choice(edge_ids_3_1))
+            # the reverse move chooses one of the edges node_3 -> node_2
+            prop_prob_ratio = len(edge_ids_3_1) / \
+                len(self.full_graph.edge_ids_between(node_3, node_2))
+            # remove the edge node_3 -> node_2
+            edge_ids_to_remove.append(int(self.branching.parent_edge[node_2]))
+        if node_4 >= 0:
+            # remove the edge node_4 -> node_1 (the reverse move is
+            # a flip_2 triggered by this edge)
+            edge_ids_to_remove.append(int(self.branching.parent_edge[node_1]))
+            prop_prob_ratio *= \
+                self._edge_proposal_ratio(edge_ids_to_remove[-1], edge_id)
+        d = 0
+        if self.depth_cost != 0:
+            n_1 = self.branching.count_nonleaves_id(node_1)
+            n_2 = self.branching.count_nonleaves_id(node_2)
+            d_1 = self.branching.depth_id(node_1)
+            d_3 = self.branching.depth_id(node_3) if node_3 >= 0 else 0
+            d = n_2 - n_1 - n_1 * (d_1-d_3-1)
+        return edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio, d
+
+    def propose_flip_2(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        self.move_type = 'flip_2'
+        edge_ids_to_add, edge_ids_to_remove = [edge_id], []
+        node_1, node_2, node_3, node_4, node_5 = self.nodes_for_flip(edge_id)
         prop_prob_ratio = 1.0
-        if node_3 is not None:
-            if not self.full_graph.edges_between(node_3, node_5):
+        if node_3 >= 0:
+            edge_ids_3_5 = self.full_graph.edge_ids_between(node_3, node_5)
+            if not edge_ids_3_5:
                 raise ImpossibleMoveException()
-            edges_to_add.append(\
-                random.choice(self.full_graph.edges_between(node_3, node_5)))
-            prop_prob_ratio = \
-                len(self.full_graph.edges_between(node_3, node_2)) / \
-                len(self.full_graph.edges_between(node_3, node_5))
-            if prop_prob_ratio == 0:
-                logging.getLogger('main').warn(\
-                    'prop_prob_ratio = 0 (no edge between {} and {}?)'\
-                    .format(node_3, node_2))
-        edges_to_remove.extend(self.branching.edges_between(node_2, node_5))
-        edges_to_remove.extend(self.branching.edges_between(node_3, node_2))
-        n_2 = self.branching.count_nonleaves(node_2)
-        n_5 = self.branching.count_nonleaves(node_5)
-        d_1 = self.branching.depth(node_1)
-        d_3 = self.branching.depth(node_3) if node_3 is not None else 0
-        d = (n_2-n_5) * (d_1-d_3) - n_5
-        return edges_to_add, edges_to_remove, prop_prob_ratio, d
-
-    def nodes_for_flip(self, edge :GraphEdge) -> List[LexiconEntry]:
-        node_1, node_2 = edge.source, edge.target
-        node_3 = self.branching.parent(node_2)
-        node_4 = self.branching.parent(node_1)
-        node_5 = node_1
-        while self.branching.parent(node_5) != node_2: 
-            node_5 = self.branching.parent(node_5)
+            edge_ids_to_add.append(self.random_stream.choice(edge_ids_3_5))
+            # the reverse move chooses one of the edges node_3 -> node_2
+            prop_prob_ratio = len(edge_ids_3_5) / \
+                len(self.full_graph.edge_ids_between(node_3, node_2))
+        # remove the edges node_2 -> node_5 and node_3 -> node_2 (the reverse
+        # move is a flip_1 triggered by the former)
+        edge_ids_to_remove.append(int(self.branching.parent_edge[node_5]))
+        prop_prob_ratio *= \
+            self._edge_proposal_ratio(edge_ids_to_remove[0], edge_id)
+        if node_3 >= 0:
+            edge_ids_to_remove.append(int(self.branching.parent_edge[node_2]))
+        d = 0
+        if self.depth_cost != 0:
+            n_2 = self.branching.count_nonleaves_id(node_2)
+            n_5 = self.branching.count_nonleaves_id(node_5)
+            d_1 = self.branching.depth_id(node_1)
+            d_3 = self.branching.depth_id(node_3) if node_3 >= 0 else 0
+            d = (n_2-n_5) * (d_1-d_3) - n_5
+        return edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio, d
+
+    def nodes_for_flip(self, edge_id :int) -> List[int]:
+        '''Return the lexicon IDs of the nodes involved in a flip
+           (-1 for nodes that do not exist).'''
+        node_1 = int(self.edge_source_ids[edge_id])
+        node_2 = int(self.edge_target_ids[edge_id])
+        node_3 = self.branching.parent_id(node_2)
+        node_4 = self.branching.parent_id(node_1)
+        # node_5 is the child of node_2 on the path to node_1
+        node_5 = self.branching.ancestor_at_depth_id(
+                     node_1, self.branching.depth_id(node_2)+1)
         return [node_1, node_2, node_3, node_4, node_5]
 
-    def propose_swapping_parent(self, edge :GraphEdge) \
-                             -> Tuple[List[GraphEdge], List[GraphEdge],
-                                      float, int]:
-        edges_to_remove = self.branching.edges_between(
-                              self.branching.parent(edge.target),
-                              edge.target)
-        d = self.branching.count_nonleaves(edge.target) * \
-            (self.branching.depth(edge.source) -
-             self.branching.depth(edges_to_remove[0].source))
-        return [edge], edges_to_remove, 1, d
-
-    def compute_acc_prob(self, edges_to_add :List[GraphEdge], 
-                         edges_to_remove :List[GraphEdge], 
+    def propose_swapping_parent(self, edge_id :int) \
+            -> Tuple[List[int], List[int], float, int]:
+        self.move_type = 'swap_parent'
+        target_id = self.edge_target_ids[edge_id]
+        edge_ids_to_remove = [int(self.branching.parent_edge[target_id])]
+        d = 0
+        if self.depth_cost != 0:
+            d = self.branching.count_nonleaves_id(target_id) * \
+                (self.branching.depth_id(self.edge_source_ids[edge_id]) -
+                 self.branching.depth_id(self.branching.parent_id(target_id)))
+        return [edge_id], edge_ids_to_remove, \
+               self._edge_proposal_ratio(edge_ids_to_remove[0], edge_id), d
+
+    def _edge_proposal_ratio(self, reverse_edge_id :int,
+                             edge_id :int) -> float:
+        '''The probability of proposing the edge that triggers the reverse
+           move divided by that of the edge that triggers the move.'''
+        if self.edge_proposal_weights is None:
+            return 1.0
+        return float(self.edge_proposal_weights[reverse_edge_id] / \
+                     self.edge_proposal_weights[edge_id])
+
+    def compute_acc_prob(self, edge_ids_to_add :List[int],
+                         edge_ids_to_remove :List[int],
                          prop_prob_ratio :float, depth_change :int) -> float:
-        cost = self.cost_of_change(edges_to_add, edges_to_remove) +\
-               depth_change * self.depth_cost
+        cost = (self.cost_of_change(edge_ids_to_add, edge_ids_to_remove) +\
+                depth_change * self.depth_cost) / self.temperature
         if cost < math.log(prop_prob_ratio):
             return 1.0
         else: 
@@ -245,50 +1446,271 @@ class MCMCGraphSampler:
             logging.getLogger('main').warn('Infinity in root costs!')
         if (np.any(np.isnan(self.edge_cost_cache))):
             logging.getLogger('main').warn('NaN in edge costs!')
-       
-
-    def cost_of_change(self, edges_to_add :List[GraphEdge], 
-                       edges_to_remove :List[GraphEdge]) -> float:
+        # the change of cost caused by adding an edge
+        # (the target stops being a root)
+        self.edge_delta_cache = self.edge_cost_cache - \
+                                self.root_cost_cache[self.edge_target_ids]
+        self.edge_rule_ids = np.array(
+            [self.rule_set.get_id(edge.rule) for edge in self.edge_set],
+            dtype=np.int64)
+        self._init_edge_proposal_weights()
+
+    def _init_edge_proposal_weights(self) -> None:
+        if self.proposal_temperature > 0 and self.default_proposals:
+            # the weights are bounded from below, so that edges that
+            # do get into the branching are still removed quickly enough
+            gains = -self.edge_delta_cache
+            self.edge_proposal_weights = np.exp(np.clip(
+                gains / self.proposal_temperature,
+                self.MIN_LOG_PROPOSAL_WEIGHT, 0))
+            self._init_random_stream()
+
+    def cost_of_change(self, edge_ids_to_add :List[int],
+                       edge_ids_to_remove :List[int]) -> float:
         result = 0.0
-        for e in edges_to_add:
-            result += self.edge_cost_cache[self.edge_set.get_id(e)]
-            result -= self.root_cost_cache[self.lexicon.get_id(e.target)]
-        for e in edges_to_remove:
-            result -= self.edge_cost_cache[self.edge_set.get_id(e)]
-            result += self.root_cost_cache[self.lexicon.get_id(e.target)]
+        for e_id in edge_ids_to_add:
+            result += self.edge_delta_cache[e_id]
+        for e_id in edge_ids_to_remove:
+            result -= self.edge_delta_cache[e_id]
         return float(result)
 
-    def accept_move(self, edges_to_add, edges_to_remove):
-        self._logl += self.cost_of_change(edges_to_add, edges_to_remove)
+    def accept_move(self, edge_ids_to_add :List[int],
+                    edge_ids_to_remove :List[int]) -> None:
+        self._logl += self.cost_of_change(edge_ids_to_add, edge_ids_to_remove)
         if np.isnan(self._logl):
             logging.getLogger('main').info('adding:')
-            for e in edges_to_add:
-                print(e.source, e.target, e.rule, \
-                      self.edge_cost_cache[self.edge_set.get_id(e)])
+            for e_id in edge_ids_to_add:
+                e = self.edge_set[e_id]
+                print(e.source, e.target, e.rule, self.edge_cost_cache[e_id])
             logging.getLogger('main').info('deleting:')
-            for e in edges_to_remove:
-                print(e.source, e.target, e.rule, \
-                      self.edge_cost_cache[self.edge_set.get_id(e)])
+            for e_id in edge_ids_to_remove:
+                e = self.edge_set[e_id]
+                print(e.source, e.target, e.rule, self.edge_cost_cache[e_id])
             raise RuntimeError('NaN log-likelihood at iteration {}'\
                                .format(self.iter_num))
         # remove edges and update stats
-        for e in edges_to_remove:
-            self.branching.remove_edge(e)
-            for stat in self.stats.values():
-                stat.edge_removed(e)
+        for e_id in edge_ids_to_remove:
+            self.branching.remove_edge_id(e_id)
+            self.journal.append(self.iter_num, e_id, -1, self._logl)
+            for stat in self.dispatched_stats:
+                stat.edge_removed(e_id)
         # add edges and update stats
-        for e in edges_to_add:
-            self.branching.add_edge(e)
+        for e_id in edge_ids_to_add:
+            self.branching.add_edge_id(e_id)
+            self.journal.append(self.iter_num, e_id, 1, self._logl)
+            for stat in self.dispatched_stats:
+                stat.edge_added(e_id)
+        if self.journal.is_full():
+            self.flush_journal()
+
+    def flush_journal(self) -> None:
+        '''Pass the journaled moves to the statistics (which brings them
+           up to date with the current iteration) and clear the journal.'''
+        iter_nums, edge_ids, signs, logls = self.journal.records()
+        # (the statistics may fill their buffers meanwhile and call
+        # write_trace(), which must not flush the journal again)
+        self._flushing_journal = True
+        try:
             for stat in self.stats.values():
-                stat.edge_added(e)
-    
+                if stat.journaled:
+                    stat.flush(iter_nums, edge_ids, signs, logls)
+        finally:
+            self._flushing_journal = False
+        if self.journal_file is not None and self.phase == 'sampling':
+            self.journal.save(self.journal_file)
+        self.journal.clear()
+
+    def replay_journal(self, filename :str) -> None:
+        '''Recompute the journaled statistics from a journal file saved
+           during sampling, without sampling again. Afterwards, the sampler
+           holds the final branching. The costs must be cached and
+           the statistics added beforehand (the statistics that are not
+           journaled are only reset).'''
+        initial_edge_ids, initial_logl, records, num_iter = \
+            read_journal_file(filename)
+        self.branching = self.full_graph.empty_branching(
+                             dynamic_index=self.dynamic_index)
+        for e_id in initial_edge_ids.tolist():
+            self.branching.add_edge_id(e_id)
+        self.set_initial_branching(self.branching)
+        self._logl = initial_logl
+        self.phase = 'done'
+        self.reset()
+        self.iter_num = num_iter
+        for stat in self.stats.values():
+            if stat.journaled:
+                stat.flush(records['iter_num'], records['edge_id'],
+                           records['sign'], records['logl'])
+        for e_id, sign in zip(records['edge_id'].tolist(),
+                              records['sign'].tolist()):
+            if sign > 0:
+                self.branching.add_edge_id(e_id)
+            else:
+                self.branching.remove_edge_id(e_id)
+        if len(records) > 0:
+            self._logl = float(records['logl'][-1])
+
     def reset(self):
         self.iter_num = 0
+        self.logl_trace, self.num_edges_trace = [], []
+        if self.journal is not None:
+            # discard the moves of the previous phase
+            self.journal.clear()
+            if self.journal_file is not None and self.phase == 'sampling':
+                start_journal_file(self.journal_file,
+                                   self.branching.edge_ids(), self._logl)
         for stat in self.stats.values():
             stat.reset()
+        if self.phase == 'sampling':
+            self.start_trace()
+
+    def _iter_stats(self) -> List[Tuple[str, IterationStatistic]]:
+        return [(stat_name, stat) \
+                for stat_name, stat in sorted(self.stats.items(),
+                                              key = itemgetter(0)) \
+                if isinstance(stat, IterationStatistic)]
+
+    def _num_traced(self) -> int:
+        return self._iter_stats()[0][1].num_traced
+
+    def _trace_path(self) -> str:
+        '''Return the file to which the values of the iteration statistics
+           are passed: `trace_file` or, if not set, a spill file from which
+           they are copied by save_iter_stats(). The spill file is kept
+           next to the checkpoint (so that sampling can be resumed) or
+           is a temporary file in the working directory (removed by
+           save_iter_stats()).'''
+        if self.trace_file is not None:
+            return self.trace_file
+        if self._spill_file is None:
+            if self.checkpoint_file is not None:
+                root, ext = os.path.splitext(self.checkpoint_file)
+                self._spill_file = root + '.iter-stats.txt'
+            else:
+                fd, self._spill_file = \
+                    tempfile.mkstemp(prefix='iter-stats-', suffix='.txt',
+                                     dir=full_path(''))
+                os.close(fd)
+                self._spill_file_is_temporary = True
+        return self._spill_file
+
+    def _part_trace_files(self, kind :str, nums :Iterable[int]) -> List[str]:
+        '''Return the names of the trace files of the chains or parts
+           (`kind`) with the given numbers, derived from the trace file of
+           this sampler (None if there are no iteration statistics).'''
+        if not self._iter_stats():
+            return [None for num in nums]
+        root, ext = os.path.splitext(self._trace_path())
+        return ['{}.{}{}{}'.format(root, kind, num, ext) for num in nums]
+
+    def start_trace(self, append :bool = False) -> None:
+        '''Start passing the values of the iteration statistics to
+           the trace file (if there are any). If `append` is set,
+           continue an existing file.'''
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+        iter_stats = self._iter_stats()
+        if iter_stats:
+            self.trace = TraceWriter(self._trace_path(),
+                                     [name for name, stat in iter_stats],
+                                     block_size=self.TRACE_BLOCK_SIZE,
+                                     append=append)
+            self._trace_time = time.monotonic()
+
+    def write_trace(self) -> None:
+        '''Pass the values of the iteration statistics recorded since
+           the last call to the trace file and remove them from memory.
+           Only the values recorded by all statistics are passed. Without
+           an open trace file (e.g. during warmup), the values are
+           discarded. Called also by the statistics when their buffers are
+           full.'''
+        # (the statistics of a finished run are already up to date, see
+        # save_checkpoint())
+        if self.journal is not None and self.phase != 'done' and \
+                not self._flushing_journal:
+            self.flush_journal()
+        iter_stats = self._iter_stats()
+        if not iter_stats:
+            return
+        start = self._num_traced()
+        num_values = min(stat.num_values for name, stat in iter_stats)
+        values = np.array([stat.take_values(num_values) \
+                           for name, stat in iter_stats])
+        if self.trace is not None:
+            self.trace.write(
+                np.arange(start+1, start+num_values+1) * \
+                    self.iter_stat_interval,
+                values.T)
+            self._trace_time = time.monotonic()
+
+    def close_trace(self) -> None:
+        if self.trace is not None:
+            self.write_trace()
+            self.trace.close()
+            self.trace = None
+
+    def _merge_traces(self, trace_files :List[str],
+                      part_edge_ids :List[np.ndarray] = None,
+                      exact_results :List[Tuple[Dict[str, Any],
+                                                np.ndarray]] = None) \
+                     -> None:
+        '''Merge the values of the iteration statistics from the trace
+           files of independent chains (see IterationStatistic.merge()) or,
+           if `part_edge_ids` is given, of the sampled parts of the graph
+           (see merge_components()) into the trace file of this sampler.
+           The states of the parts computed exactly are given in
+           `exact_results` together with their edge IDs. The files are
+           read in blocks, so that the values are never all in memory.'''
+        iter_stats = self._iter_stats()
+        if not iter_stats:
+            return
+        self.start_trace()
+        readers = [TraceReader(filename, block_size=self.TRACE_BLOCK_SIZE) \
+                   for filename in trace_files]
+        # the last row of every file -- the parts that stopped earlier
+        # keep their last values
+        last_rows = [None] * len(readers)
+        first_block = True
+        while True:
+            blocks = [reader.read() for reader in readers]
+            if part_edge_ids is None:
+                length = min(len(block) for block in blocks)
+                if length == 0:
+                    break
+            else:
+                length = max([len(block) for block in blocks], default=0)
+                if length == 0 and not first_block:
+                    break
+                for i, block in enumerate(blocks):
+                    if len(block) > 0:
+                        last_rows[i] = block[-1]
+                    if last_rows[i] is not None:
+                        blocks[i] = np.concatenate(
+                            (block, np.tile(last_rows[i],
+                                            (length-len(block), 1))))
+            for name, stat in iter_stats:
+                states = [block[:length, reader.columns.index(name)] \
+                          for reader, block in zip(readers, blocks)]
+                if part_edge_ids is None:
+                    stat.merge(states)
+                    continue
+                edge_ids = list(part_edge_ids)
+                for result, result_edge_ids in exact_results:
+                    if result[name] is not None:
+                        states.append(result[name])
+                        edge_ids.append(result_edge_ids)
+                if states:
+                    stat.merge_components(states, edge_ids)
+            first_block = False
+        for reader in readers:
+            reader.close()
+        self.close_trace()
 
     def update_stats(self):
-        for stat in self.stats.values():
+        if self.journal is not None:
+            self.flush_journal()
+        for stat in self.dispatched_stats:
             stat.update()
 
     def print_scalar_stats(self):
@@ -312,25 +1734,69 @@ class MCMCGraphSampler:
             if isinstance(stat, ScalarStatistic):
                 logging.getLogger('main').info('%s = %f' % (stat_name, stat.value()))
 
+    def _rule_index(self) -> Tuple[List[Rule], np.ndarray]:
+        '''Return the rules to which the rule columns of the output files
+           refer and the index of the rule of every edge.'''
+        return self.rule_set, self.edge_rule_ids
+
+    def _index_strings(self, index :str) -> np.ndarray:
+        if index == 'words':
+            return np.array([str(entry) for entry in self.lexicon],
+                            dtype=object)
+        elif index == 'rules':
+            return np.array([str(rule) for rule in self._rule_index()[0]],
+                            dtype=object)
+        else:
+            raise ValueError(index)
+
+    def _save_table(self, filename :str,
+                    columns :List[Tuple[str, np.ndarray, str]],
+                    header :bool = True) -> None:
+        '''Save a table given as columns (name, values, index), where
+           `index` is 'words' or 'rules' if the values are IDs of words
+           or rules and None otherwise. With the TSV output format,
+           the IDs are replaced by strings. With the NPZ format, every
+           column is saved as an array (in a file with the extension
+           .npz) and the strings of the words and rules are saved once
+           as separate index files.'''
+        if self.output_format == 'npz':
+            np.savez(full_path(os.path.splitext(filename)[0] + '.npz'),
+                     **{ name : values for name, values, index in columns })
+            for name, values, index in columns:
+                if index is not None and index not in self._saved_indices:
+                    write_tsv_columns(
+                        shared.filenames['sample-' + index],
+                        [self._index_strings(index)])
+                    self._saved_indices.add(index)
+        elif self.output_format == 'tsv':
+            strings = { index : self._index_strings(index) \
+                        for index in set(col[2] for col in columns) \
+                        if index is not None }
+            names = [name for name, values, index in columns]
+            write_tsv_columns(filename,
+                              [strings[index][values] \
+                                   if index is not None else values \
+                               for name, values, index in columns],
+                              header=names if header else None)
+        else:
+            raise ValueError('Unknown output format: {}'\
+                             .format(self.output_format))
+
     def save_edge_stats(self, filename):
-        stats, stat_names = [], []
+        columns = [('word_1', self.edge_source_ids, 'words'),
+                   ('word_2', self.edge_target_ids, 'words'),
+                   ('rule', self._rule_index()[1], 'rules')]
         for stat_name, stat in sorted(self.stats.items(), key = itemgetter(0)):
             if isinstance(stat, EdgeStatistic):
-                stat_names.append(stat_name)
-                stats.append(stat)
-        with open_to_write(filename) as fp:
-            write_line(fp, ('word_1', 'word_2', 'rule') + tuple(stat_names))
-            for idx, edge in enumerate(self.edge_set):
-                write_line(fp, 
-                           (str(edge.source), str(edge.target), 
-                            str(edge.rule)) + tuple([stat.val[idx]\
-                                                     for stat in stats]))
+                columns.append((stat_name, stat.val, None))
+        self._save_table(filename, columns)
 
     def save_rule_stats(self, filename):
         freq, contrib = self.compute_rule_stats()
-        with open_to_write(filename) as fp:
-            for r_id, rule in enumerate(self.model.rule_set):
-                write_line(fp, (rule, freq[r_id], contrib[r_id]))
+        self._save_table(filename,
+                         [('rule', np.arange(len(self.rule_set)), 'rules'),
+                          ('freq', freq, None), ('contrib', contrib, None)],
+                         header=False)
 #         stats, stat_names = [], []
 #         for stat_name, stat in sorted(self.stats.items(), key = itemgetter(0)):
 #             if isinstance(stat, RuleStatistic):
@@ -343,61 +1809,96 @@ class MCMCGraphSampler:
 #                                tuple([stat.val[idx] for stat in stats]))
 
     def save_wordpair_stats(self, filename):
-        stats, stat_names = [], []
+        columns = []
         for stat_name, stat in sorted(self.stats.items(), key = itemgetter(0)):
             if isinstance(stat, UnorderedWordPairStatistic):
-                stat_names.append(stat_name)
-                stats.append(stat)
-        with open_to_write(filename) as fp:
-            write_line(fp, ('word_1', 'word_2') + tuple(stat_names))
-            for key in self.unordered_word_pair_index:
-                write_line(fp, key +\
-                               tuple([stat.value(key) for stat in stats]))
+                columns.append((stat_name, stat.values, None))
+        pair_keys = self.word_pair_index()[0]
+        num_words = len(self.lexicon)
+        # the lexicon IDs of the words in alphabetical order
+        word_ids = np.argsort(self.word_ranks())
+        self._save_table(filename,
+                         [('word_1', word_ids[pair_keys // num_words],
+                           'words'),
+                          ('word_2', word_ids[pair_keys % num_words],
+                           'words')] + \
+                         columns)
 
     def save_iter_stats(self, filename :str) -> None:
-        stats, stat_names = [], []
+        '''Copy the values of the iteration statistics from the file to
+           which they were passed during sampling (see _trace_path()).'''
+        self.close_trace()
+        if not self._iter_stats():
+            with open_to_write(filename) as fp:
+                write_line(fp, ('iter_num',))
+            return
+        path = full_path(self._trace_path())
+        if path != full_path(filename):
+            shutil.copyfile(path, full_path(filename))
+        if self._spill_file_is_temporary:
+            os.remove(path)
+            self._spill_file, self._spill_file_is_temporary = None, False
+
+    def save_move_stats(self, filename :str) -> None:
         for stat_name, stat in sorted(self.stats.items(), key = itemgetter(0)):
-            if isinstance(stat, IterationStatistic):
-                stat_names.append(stat_name)
-                stats.append(stat)
+            if isinstance(stat, MoveStatistic):
+                break
+        else:
+            return
+        acc_rate = stat.acceptance_rate()
         with open_to_write(filename) as fp:
-            write_line(fp, ('iter_num',) + tuple(stat_names))
-            for iter_num in range(self.iter_stat_interval, 
-                                  self.sampling_iter+1, 
-                                  self.iter_stat_interval):
-                write_line(fp, (str(iter_num),) + \
-                               tuple([stat.value(iter_num) for stat in stats]))
-            
+            write_line(fp, ('move', 'proposed', 'accepted', 'acc_rate',
+                            'proposal_time', 'acceptance_time'))
+            for i, move_type in enumerate(stat.move_types):
+                write_line(fp, (move_type, stat.num_proposed[i],
+                                stat.num_accepted[i], acc_rate[i],
+                                stat.proposal_time[i],
+                                stat.acceptance_time[i]))
+
     def summary(self):
         self.print_scalar_stats()
-        self.save_iter_stats(shared.filenames['sample-iter-stats'])
+        if self.trace_file is None:
+            self.save_iter_stats(shared.filenames['sample-iter-stats'])
+        self.save_move_stats(shared.filenames['sample-move-stats'])
         self.save_edge_stats(shared.filenames['sample-edge-stats'])
         self.save_rule_stats(shared.filenames['sample-rule-stats'])
         self.save_wordpair_stats(shared.filenames['sample-wordpair-stats'])
 
     def save_root_costs(self, filename):
-        with open_to_write(filename) as fp:
-            for i, entry in enumerate(self.lexicon):
-                write_line(fp, (entry, self.root_cost_cache[i]))
+        self._save_table(filename,
+                         [('word', np.arange(len(self.lexicon)), 'words'),
+                          ('cost', self.root_cost_cache, None)],
+                         header=False)
 
     def save_edge_costs(self, filename):
-        with open_to_write(filename) as fp:
-            for i, edge in enumerate(self.edge_set):
-                write_line(fp, (edge, self.edge_cost_cache[i]))
+        if self.output_format == 'tsv':
+            # the edges are written as in str(GraphEdge)
+            words = self._index_strings('words')
+            edge_strs = ['{} -> {} by {}'.format(source, target, rule) \
+                         for source, target, rule in zip(
+                             words[self.edge_source_ids].tolist(),
+                             words[self.edge_target_ids].tolist(),
+                             self._index_strings('rules')\
+                                 [self._rule_index()[1]].tolist())]
+            write_tsv_columns(filename, [edge_strs, self.edge_cost_cache])
+            return
+        self._save_table(filename,
+                         [('word_1', self.edge_source_ids, 'words'),
+                          ('word_2', self.edge_target_ids, 'words'),
+                          ('rule', self._rule_index()[1], 'rules'),
+                          ('cost', self.edge_cost_cache, None)])
 
     def compute_rule_stats(self):
         # compute the rule statistics (frequency and contribution)
         # from the expected edge frequencies
-        freq = np.zeros(len(self.model.rule_set))
-        contrib = np.array([-self.model.rule_cost(rule) \
-                            for rule in self.model.rule_set])
-        for e_id, edge in enumerate(self.edge_set):
-            e_freq = self.stats['edge_freq'].val[e_id]
-            r_id = self.model.rule_set.get_id(edge.rule)
-            tgt_id = self.lexicon.get_id(edge.target)
-            freq[r_id] += e_freq
-            contrib[r_id] += e_freq * (self.root_cost_cache[tgt_id] - \
-                                       self.edge_cost_cache[e_id])
+        num_rules = len(self.model.rule_set)
+        edge_freq = self.stats['edge_freq'].val
+        freq = np.bincount(self.edge_rule_ids, weights=edge_freq,
+                           minlength=num_rules)
+        contrib = -self.model.rules_cost(self.model.rule_set) - \
+                  np.bincount(self.edge_rule_ids,
+                              weights=edge_freq * self.edge_delta_cache,
+                              minlength=num_rules)
         return freq, contrib
 
 
@@ -405,22 +1906,29 @@ class MCMCGraphSampler:
 #      (pass ensured edges through the lexicon parameter?)
 # TODO init_lexicon() at creation
 class MCMCSemiSupervisedGraphSampler(MCMCGraphSampler):
+    default_proposals = False
+
     def __init__(self, model, lexicon, edges, ensured_conn, warmup_iter, sampl_iter):
         MCMCGraphSampler.__init__(self, model, lexicon, edges, warmup_iter, sampl_iter)
         self.ensured_conn = ensured_conn
 
-    def determine_move_proposal(self, edge):
-        edges_to_add, edges_to_remove, prop_prob_ratio =\
-            MCMCGraphSampler.determine_move_proposal(self, edge)
+    def determine_move_proposal(self, edge_id):
+        edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio, depth_change =\
+            MCMCGraphSampler.determine_move_proposal(self, edge_id)
+        edges_to_add = [self.edge_set[e_id] for e_id in edge_ids_to_add]
+        edges_to_remove = [self.edge_set[e_id] for e_id in edge_ids_to_remove]
         removed_conn = set((e.source, e.target) for e in edges_to_remove) -\
                 set((e.source, e.target) for e in edges_to_add)
         if removed_conn & self.ensured_conn:
             raise ImpossibleMoveException()
         else:
-            return edges_to_add, edges_to_remove, prop_prob_ratio
+            return edge_ids_to_add, edge_ids_to_remove, prop_prob_ratio, \
+                   depth_change
 
 
 class MCMCSupervisedGraphSampler(MCMCGraphSampler):
+    default_proposals = False
+
     def __init__(self, full_graph, model, **kwargs):
         logging.getLogger('main').debug('Creating a supervised graph sampler.')
         MCMCGraphSampler.__init__(self, full_graph, model, **kwargs)
@@ -431,42 +1939,41 @@ class MCMCSupervisedGraphSampler(MCMCGraphSampler):
     # etc.
     def _create_initial_branching(self):
         branching = self.full_graph.empty_branching()
-        for target in self.full_graph.lexicon:
-            edges = self.full_graph.ingoing_edges(target)
-            if edges:
-                branching.add_edge(random.choice(edges))
+        target_ids = range(len(self.full_graph.lexicon)) \
+                     if self.proposal_edge_ids is None \
+                     else np.unique(self.edge_target_ids[
+                                        self.proposal_edge_ids]).tolist()
+        for target_id in target_ids:
+            edge_ids = self.full_graph.ingoing_edge_ids(target_id)
+            if edge_ids:
+                branching.add_edge_id(self.random_stream.choice(edge_ids))
         return branching
 
-    def run_sampling(self) -> None:
-        self.cache_costs()
-        self.branching = self._create_initial_branching()
-        self.set_initial_branching(self.branching)
-        logging.getLogger('main').debug(\
-            'initial log-likelihood: {}'.format(self._logl))
-        logging.getLogger('main').info('Warming up the sampler...')
-        self.reset()
-        for i in tqdm.tqdm(range(self.warmup_iter)):
-            self.next()
-        logging.getLogger('main').debug(\
-            'log-likelihood after warmup: {}'.format(self._logl))
-        self.reset()
-        logging.getLogger('main').info('Sampling...')
-        for i in tqdm.tqdm(range(self.sampling_iter)):
-            self.next()
-        self.update_stats()
-
-    def determine_move_proposal(self, edge):
-        edge_to_add, edge_to_delete = None, None
-        if self.branching.has_edge(edge.source, edge.target, edge.rule):
-            alt_edges = self.full_graph.ingoing_edges(edge.target)
-            edge_to_add = random.choice(alt_edges)
-            edge_to_delete = edge
+    def determine_move_proposal(self, edge_id):
+        edge_id_to_add, edge_id_to_delete = None, None
+        # every move replaces the parent of the target node
+        self.move_type = 'swap_parent'
+        target_id = int(self.edge_target_ids[edge_id])
+        if self.branching.has_edge_id(edge_id):
+            alt_edge_ids = self.full_graph.ingoing_edge_ids(target_id)
+            edge_id_to_add = self.random_stream.choice(alt_edge_ids)
+            edge_id_to_delete = edge_id
         else:
-            edge_to_add = edge
-            edge_to_delete = self.branching.ingoing_edges(edge.target)[0]
+            edge_id_to_add = edge_id
+            edge_id_to_delete = int(self.branching.parent_edge[target_id])
         # depths in a supervised setting are already fixed in the training
         # graph
-        return [edge_to_add], [edge_to_delete], 1, 0
+        return [edge_id_to_add], [edge_id_to_delete], 1, 0
+
+    def exact_edge_marginals(self, edge_ids :np.ndarray) -> np.ndarray:
+        # every node chooses one of its ingoing edges independently
+        targets, idx = np.unique(self.edge_target_ids[edge_ids],
+                                 return_inverse=True)
+        costs = self.edge_delta_cache[edge_ids]
+        min_cost = np.full(len(targets), np.inf)
+        np.minimum.at(min_cost, idx, costs)
+        weights = np.exp(min_cost[idx] - costs)
+        return weights / np.bincount(idx, weights=weights)[idx]
 
 #     def run_sampling(self):
 #         self.reset()
@@ -482,7 +1989,75 @@ class MCMCGraphSamplerFactory:
             return MCMCGraphSampler(*args, **kwargs)
 
 
+class TagTransitionMatrices:
+    '''The tag transition matrices of the (untagged) edges: the entry
+       [t1, t2] of the matrix of an edge is the probability ratio of
+       the edge deriving a word with tag t2 from a word with tag t1.
+       The matrices are sparse -- only their nonzero entries are stored,
+       in flat arrays grouped by edge (`offsets[e]:offsets[e+1]` are
+       the entries of edge `e`). The products with the forward and
+       backward probability vectors are computed for many edges at once.'''
+
+    def __init__(self, num_edges :int, num_tags :int, edge_ids :np.ndarray,
+                 source_tags :np.ndarray, target_tags :np.ndarray,
+                 values :np.ndarray) -> None:
+        order = np.argsort(edge_ids, kind='stable')
+        self.num_tags = num_tags
+        self.offsets = np.zeros(num_edges+1, dtype=np.int64)
+        np.cumsum(np.bincount(edge_ids, minlength=num_edges),
+                  out=self.offsets[1:])
+        self.source_tags = source_tags[order]
+        self.target_tags = target_tags[order]
+        self.values = values[order]
+
+    def __len__(self) -> int:
+        return len(self.offsets)-1
+
+    def entries(self, edge_ids :np.ndarray) \
+               -> Tuple[np.ndarray, np.ndarray]:
+        '''Return the indices of the entries of the given edges and
+           the position in `edge_ids` of the edge of each entry.'''
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        starts = self.offsets[edge_ids]
+        lengths = self.offsets[edge_ids+1] - starts
+        rows = np.repeat(np.arange(len(edge_ids)), lengths)
+        idx = np.arange(len(rows)) + \
+              np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return idx, rows
+
+    def backward_messages(self, edge_ids :np.ndarray,
+                          vectors :np.ndarray) -> np.ndarray:
+        '''Return the products `M[e] @ v` for the edges `e` in `edge_ids`
+           and the corresponding rows `v` of `vectors`.'''
+        idx, rows = self.entries(edge_ids)
+        T = self.num_tags
+        weights = self.values[idx] * vectors[rows, self.target_tags[idx]]
+        return np.bincount(rows * T + self.source_tags[idx], weights=weights,
+                           minlength=len(edge_ids)*T).reshape(-1, T)
+
+    def backward_message(self, edge_id :int, vector :np.ndarray,
+                         out :np.ndarray) -> np.ndarray:
+        '''Compute the product `M[e] @ v` for a single edge into `out`
+           (without allocating arrays).'''
+        out.fill(0)
+        for i in range(self.offsets[edge_id], self.offsets[edge_id+1]):
+            out[self.source_tags[i]] += \
+                self.values[i] * vector[self.target_tags[i]]
+        return out
+
+    def forward_messages(self, edge_ids :np.ndarray,
+                         vectors :np.ndarray) -> np.ndarray:
+        '''Return the products `v @ M[e]` for the edges `e` in `edge_ids`
+           and the corresponding rows `v` of `vectors`.'''
+        idx, rows = self.entries(edge_ids)
+        T = self.num_tags
+        weights = self.values[idx] * vectors[rows, self.source_tags[idx]]
+        return np.bincount(rows * T + self.target_tags[idx], weights=weights,
+                           minlength=len(edge_ids)*T).reshape(-1, T)
+
+
 class MCMCTagSampler(MCMCGraphSampler):
+    default_proposals = False
 
     def __init__(self, full_graph :FullGraph,
                        model :ModelSuite,
@@ -490,85 +2065,146 @@ class MCMCTagSampler(MCMCGraphSampler):
                        warmup_iter :int = 1000,
                        sampling_iter :int = 100000,
                        iter_stat_interval :int = 1,
-                       min_subtree_prob = 1e-100):
+                       min_subtree_prob = 1e-100,
+                       seed :Any = None,
+                       predict_batch_size :int = 1000,
+                       compute_leaf_prob :bool = False,
+                       edge_batch_size :int = 100000,
+                       num_processes :int = 1,
+                       tag_prob_interval :int = 1000):
         self.tagset = tagset
         logging.getLogger('main').debug('tagset = {}'.format(str(tagset)))
         self.tag_idx = { tag : i for i, tag in enumerate(tagset) }
         self.min_subtree_prob = min_subtree_prob
+        self.predict_batch_size = predict_batch_size
+        self.edge_batch_size = edge_batch_size
+        self.num_processes = num_processes
+        # the tag probabilities of the changed trees are recomputed every
+        # `tag_prob_interval` iterations (see update_tag_prob())
+        self.tag_prob_interval = tag_prob_interval
         untagged_edge_set, self.edge_tr_mat = \
             self._compute_untagged_edges_and_transition_mat(full_graph, model)
         untagged_full_graph = FullGraph(full_graph.lexicon, untagged_edge_set)
         super().__init__(untagged_full_graph, model, warmup_iter=warmup_iter,
                          sampling_iter=sampling_iter,
-                         iter_stat_interval=iter_stat_interval)
+                         iter_stat_interval=iter_stat_interval,
+                         seed=seed)
+        # the statistics are notified of every move (see accept_move())
+        self.journal = None
         self._compute_root_prob()
-        self._fast_compute_leaf_prob()
+        if compute_leaf_prob:
+            self._compute_leaf_prob()
+        else:
+            self._fast_compute_leaf_prob()
         self.init_forward_prob()
         self.init_backward_prob()
         self.write_debug_info()
 
+    def _rule_index(self) -> Tuple[List[Rule], np.ndarray]:
+        # the untagged rules of the edges are not in the rule set
+        # of the model
+        rules = list(self.edge_set.get_edge_ids_by_rule())
+        rule_ids = np.empty(len(self.edge_set), dtype=np.int64)
+        for r_id, edge_ids in \
+                enumerate(self.edge_set.get_edge_ids_by_rule().values()):
+            rule_ids[edge_ids] = r_id
+        return rules, rule_ids
+
     def _compute_root_prob(self):
         logging.getLogger('main').info('Computing root probabilities...')
-        self.root_prob = \
-            np.zeros((len(self.lexicon), len(self.tagset)), dtype=np.float64)
-        for w_id, entry in tqdm.tqdm(enumerate(self.lexicon),
-                                     total=len(self.lexicon)):
-            self.root_prob[w_id,:] = \
-                np.exp(-self.model.root_model.root_cost(entry)) * \
-                self.model.root_tag_model.predict_tags([entry])
+        root_costs = self.model.root_model.root_costs(self.lexicon)
+        tag_probs = self.model.root_tag_model.predict_tags(
+                        self.lexicon, batch_size=self.predict_batch_size)
+        self.root_prob = np.exp(-root_costs).reshape((-1, 1)) * \
+                         np.asarray(tag_probs, dtype=np.float64)
 
     def _fast_compute_leaf_prob(self):
         logging.getLogger('main').info('Computing leaf probabilities...')
         self.leaf_prob = np.ones((len(self.lexicon), len(self.tagset)))   # ;-)
 
     def _compute_leaf_prob(self):
+        '''Compute the probability of every word having no outgoing edges
+           given its tag: the product of (1 - edge probability) over
+           all edges that the rules allow from the tagged word (also
+           to words outside of the lexicon).
+
+           The candidate edges are obtained by looking up the tagged words
+           in a transducer of all rules, in parallel on shards of
+           the lexicon. Every rule appends a marker symbol with its ID
+           to the output, so that the rule of each result is known.
+           The edge probabilities are computed in batches of at most
+           `edge_batch_size` edges.'''
         logging.getLogger('main').info('Computing leaf probabilities...')
-        self.leaf_prob = np.ones((len(self.lexicon), len(self.tagset)), dtype=np.float64)
-        edge_set = EdgeSet(lexicon)
-
-        def _empty_edge_set(edge_set):
-            lexicon = edge_set.lexicon
-            n = len(edge_set)
-            probs = 1-self.model.edges_prob(edge_set)
-            for e_id, edge in enumerate(edge_set):
-                word = lexicon.get_by_symstr(''.join(edge.source.word))[0]
-                w_id = lexicon.get_id(word)
-                t_id = self.tag_idx[edge.source.tag]
-                self.leaf_prob[w_id,t_id] *= probs[e_id]
-            edge_set = EdgeSet(lexicon)
-            print(n)
-            return edge_set
-
-        lexicon_tr = self.lexicon.to_fst()
-        lexicon_tr.concatenate(FST.generator(self.tagset))
-        rules_tr = self.model.rule_set.to_fst()
-        tr = hfst.HfstTransducer(lexicon_tr)
-        tr.compose(rules_tr)
-        tr.determinize()
-        tr.minimize()
-        FST.save_transducer(tr, 'tr.fsm')
-        
-        tr_path = full_path('tr.fsm')
-        cmd = ['hfst-fst2strings', tr_path]
-        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.DEVNULL, 
-                             universal_newlines=True, bufsize=1)
-        while True:
-            line = p.stdout.readline().strip()
-            if line:
-                w1, w2 = line.split(':')
-                n1 = LexiconEntry(w1)
-                n2 = LexiconEntry(w2)
-                rules = extract_all_rules(n1, n2)
-                for rule in rules:
-                    if rule in rule_set:
-                        edge_set.add(GraphEdge(n1, n2, rule))
-            else:
-                break
-            if len(edge_set) > 300000:
-                edge_set = _empty_edge_set(edge_set)
-        edge_set = _empty_edge_set(edge_set)
+
+        def _extract_edges(w_ids :List[int],
+                           output_fun :Callable[..., None],
+                           lexicon :Lexicon,
+                           tagset :List[Tuple[str]],
+                           rule_set :'RuleSet') -> None:
+            rules_tr = FST.binary_disjunct(
+                [FST.seq_to_transducer(
+                     rule.seq() + ((hfst.EPSILON, '{{RULE{}}}'.format(r_id)),),
+                     alphabet=shared.multichar_symbols) \
+                 for r_id, rule in enumerate(rule_set)])
+            rules_tr.convert(hfst.ImplementationType.HFST_OL_TYPE)
+            for w_id in w_ids:
+                for t_id, tag in enumerate(tagset):
+                    source = LexiconEntry(lexicon[w_id].literal + ''.join(tag))
+                    results = set(t.replace(hfst.EPSILON, '') for t, c in \
+                                  rules_tr.lookup(source.symstr))
+                    edges = []
+                    for result in sorted(results):
+                        i = result.rindex('{RULE')
+                        target_str, r_id = result[:i], int(result[i+5:-1])
+                        try:
+                            target = LexiconEntry(target_str)
+                        except Exception as e:
+                            logging.getLogger('main').debug(\
+                                'Invalid target word: {} ({})'\
+                                .format(target_str, e))
+                            continue
+                        if target.word != source.word:
+                            edges.append((target.literal, r_id))
+                    output_fun((w_id, t_id, edges))
+
+        rule_set = self.model.rule_set
+        log_leaf_prob = np.zeros((len(self.lexicon), len(self.tagset)))
+        w_ids, t_ids, edges = [], [], []
+
+        def _add_edge_probs():
+            # the probability of every candidate edge is looked up in
+            # the edge set by ID, so that it matches the (word, tag) pair
+            # of the candidate even if the edge set merged some edges
+            edge_set = EdgeSet(self.lexicon, edges)
+            e_ids = np.array([edge_set.get_id(edge) for edge in edges],
+                             dtype=np.int64)
+            probs = self.model.edges_prob(edge_set)[e_ids]
+            np.add.at(log_leaf_prob, (w_ids, t_ids), np.log1p(-probs))
+            w_ids.clear()
+            t_ids.clear()
+            edges.clear()
+
+        results = parallel_execute(function=_extract_edges,
+                                   data=list(range(len(self.lexicon))),
+                                   num_processes=self.num_processes,
+                                   additional_args=(self.lexicon, self.tagset,
+                                                    rule_set),
+                                   show_progressbar=True,
+                                   progressbar_total=\
+                                       len(self.lexicon)*len(self.tagset))
+        for w_id, t_id, targets in results:
+            source = LexiconEntry(self.lexicon[w_id].literal + \
+                                  ''.join(self.tagset[t_id]))
+            for target_str, r_id in targets:
+                w_ids.append(w_id)
+                t_ids.append(t_id)
+                edges.append(GraphEdge(source, LexiconEntry(target_str),
+                                       rule_set[r_id]))
+            if len(edges) >= self.edge_batch_size:
+                _add_edge_probs()
+        if edges:
+            _add_edge_probs()
+        self.leaf_prob = np.exp(log_leaf_prob)
 
     def _compute_untagged_edges_and_transition_mat(self, full_graph, model):
         logging.getLogger('main').info('Computing transition matrices...')
@@ -582,284 +2218,268 @@ class MCMCTagSampler(MCMCGraphSampler):
         edge_prob = model.edges_prob(full_graph.edge_set)
         edge_prob_ratios = edge_prob / (1-edge_prob)
         untagged_edge_set = EdgeSet(full_graph.lexicon)
-        T = len(self.tagset)
-        edge_ids_by_untagged_edge = []
-        for e_id, edge in enumerate(full_graph.edge_set):
+        num_edges = len(full_graph.edge_set)
+        untagged_edge_ids = np.empty(num_edges, dtype=np.int64)
+        source_tags = np.empty(num_edges, dtype=np.int64)
+        target_tags = np.empty(num_edges, dtype=np.int64)
+        for e_id, edge in tqdm.tqdm(enumerate(full_graph.edge_set),
+                                    total=num_edges):
             untagged_edge = _untag_edge(full_graph.lexicon, edge)
             if untagged_edge not in untagged_edge_set:
                 untagged_edge_set.add(untagged_edge)
-                edge_ids_by_untagged_edge.append(list())
-            ue_id = untagged_edge_set.get_id(untagged_edge)
-            edge_ids_by_untagged_edge[ue_id].append(e_id)
-        edge_tr_mat = []
-        for ue_id, e_ids in tqdm.tqdm(enumerate(edge_ids_by_untagged_edge), \
-                                      total=len(edge_ids_by_untagged_edge)):
-            tr_array = np.zeros((T, T))
-            for e_id in e_ids:
-                edge = full_graph.edge_set[e_id]
-                t1_id = self.tag_idx[edge.rule.tag_subst[0]]
-                t2_id = self.tag_idx[edge.rule.tag_subst[1]]
-                tr_array[t1_id,t2_id] = edge_prob_ratios[e_id]
-            if ue_id != len(edge_tr_mat):
-                raise Exception('Inconsistent untagged edge IDs!')
-            edge_tr_mat.append(csr_matrix(tr_array))
+            untagged_edge_ids[e_id] = untagged_edge_set.get_id(untagged_edge)
+            source_tags[e_id] = self.tag_idx[edge.rule.tag_subst[0]]
+            target_tags[e_id] = self.tag_idx[edge.rule.tag_subst[1]]
+        edge_tr_mat = TagTransitionMatrices(len(untagged_edge_set),
+                                            len(self.tagset),
+                                            untagged_edge_ids, source_tags,
+                                            target_tags, edge_prob_ratios)
         return untagged_edge_set, edge_tr_mat
 
     def init_forward_prob(self):
-        self.forward_prob = \
-            np.empty((len(self.lexicon), len(self.tagset)), dtype=np.float64)
-        for w_id in range(len(self.lexicon)):
-            self.forward_prob[w_id,:] = self.root_prob[w_id,:]
+        self.forward_prob = np.copy(self.root_prob)
 
     def init_backward_prob(self):
-        self.backward_prob = \
-            np.empty((len(self.lexicon), len(self.tagset)), dtype=np.float64)
-        for w_id in range(len(self.lexicon)):
-            self.backward_prob[w_id,:] = self.leaf_prob[w_id,:]
+        self.backward_prob = np.copy(self.leaf_prob)
+        # backward_msg[v] -- the message from v to its parent, i.e.
+        # the product of the transition matrix of the ingoing edge of v
+        # with backward_prob[v] (undefined for roots)
+        self.backward_msg = np.ones_like(self.backward_prob)
+        # the buffers used by the proposals (see _changed_backward_prob()),
+        # allocated once and cleared after every use (see _clear_scratch())
+        num_nodes = len(self.lexicon)
+        self._new_parent_edge = np.full(num_nodes, -2, dtype=np.int64)
+        self._edge_removed = np.zeros(len(self.edge_set), dtype=np.bool_)
+        self._affected = np.zeros(num_nodes, dtype=np.bool_)
+        self._num_pending = np.zeros(num_nodes, dtype=np.int64)
+        self._is_old_root = np.zeros(num_nodes, dtype=np.bool_)
+        self._nodes = np.empty(num_nodes, dtype=np.int64)
+        self._ready = np.empty(num_nodes, dtype=np.int64)
+        self._roots = np.empty(num_nodes, dtype=np.int64)
+        self._old_roots = np.empty(num_nodes, dtype=np.int64)
+        self._num_nodes, self._num_roots, self._num_old_roots = 0, 0, 0
+        self._new_backward_prob = np.empty_like(self.backward_prob)
+        self._msg = np.empty(len(self.tagset))
+        self._scratch_move = None   # type: Tuple[List[int], List[int]]
 
     def reset(self):
         self.iter_num = 0
         self.impossible_moves = 0
         self.tag_freq = np.zeros((len(self.lexicon), len(self.tagset)))
         self.last_modified = np.zeros(len(self.lexicon))
+        # the tag probabilities of every word in the current branching,
+        # as of the last call of update_tag_prob()
+        self.tag_prob = np.zeros((len(self.lexicon), len(self.tagset)))
+        # the roots of the trees changed since the last update_tag_prob()
+        self._tree_changed = np.ones(len(self.lexicon), dtype=np.bool_)
         for stat in self.stats.values():
             stat.reset()
 
     def run_sampling(self) -> None:
-        self.branching = self.full_graph.empty_branching()
+        self.branching = self.full_graph.empty_branching(
+                             dynamic_index=self.dynamic_index)
         self.reset()
         logging.getLogger('main').info('Warming up the sampler...')
         for i in tqdm.tqdm(range(self.warmup_iter)):
             self.next()
         self.reset()
+        self.update_tag_prob()
         logging.getLogger('main').info('Sampling...')
         for i in tqdm.tqdm(range(self.sampling_iter)):
             self.next()
+            if self.iter_num % self.tag_prob_interval == 0:
+                self.update_tag_prob()
         self.finalize()
 
-    def compute_acc_prob(self, edges_to_add, edges_to_remove, prop_prob_ratio, depth_change):
-        if len(edges_to_add) == 1 and len(edges_to_remove) == 0:
-            tgt_id = self.lexicon.get_id(edges_to_add[0].target)
-            prob = np.sum(self.root_prob[tgt_id,:]*self.backward_prob[tgt_id,:])
-            if prob == 0:
-                return 0
-            return self.compute_acc_prob_for_subtree(\
-                       edges_to_add, edges_to_remove) / prob * prop_prob_ratio
-        elif len(edges_to_add) == 0 and len(edges_to_remove) == 1:
-            tgt_id = self.lexicon.get_id(edges_to_remove[0].target)
-            prob = np.sum(self.root_prob[tgt_id,:]*self.backward_prob[tgt_id,:])
-            return self.compute_acc_prob_for_subtree(\
-                       edges_to_add, edges_to_remove) * prob * prop_prob_ratio
+    def _clear_scratch(self) -> None:
+        '''Reset the buffers filled by _changed_backward_prob().'''
+        if self._scratch_move is None:
+            return
+        edge_ids_to_add, edge_ids_to_remove = self._scratch_move
+        for e_id in edge_ids_to_add:
+            self._new_parent_edge[self.edge_target_ids[e_id]] = -2
+        for e_id in edge_ids_to_remove:
+            self._new_parent_edge[self.edge_target_ids[e_id]] = -2
+            self._edge_removed[e_id] = False
+        nodes = self._nodes[:self._num_nodes]
+        self._affected[nodes] = False
+        self._num_pending[nodes] = 0
+        self._num_nodes, self._num_roots = 0, 0
+        self._scratch_move = None
+
+    def _changed_backward_prob(self, edge_ids_to_add :List[int],
+                               edge_ids_to_remove :List[int]) -> None:
+        '''Compute the backward probabilities that would change if
+           the given edges were added and removed. Only the nodes on
+           the paths from the sources of the changed edges to their
+           (new) roots are affected. Their other children contribute
+           the cached messages from backward_msg.
+
+           The results are left in the preallocated buffers: the affected
+           nodes in `_nodes[:_num_nodes]`, their new backward
+           probabilities in the same rows of `_new_backward_prob` and
+           the roots of the trees containing the changed edges after
+           the change in `_roots[:_num_roots]`.'''
+        self._clear_scratch()
+        self._scratch_move = (edge_ids_to_add, edge_ids_to_remove)
+        parent_edge = self.branching.parent_edge
+        new_parent_edge = self._new_parent_edge
+        affected, num_pending = self._affected, self._num_pending
+        for e_id in edge_ids_to_remove:
+            new_parent_edge[self.edge_target_ids[e_id]] = -1
+            self._edge_removed[e_id] = True
+        for e_id in edge_ids_to_add:
+            new_parent_edge[self.edge_target_ids[e_id]] = e_id
+        # the affected nodes: ancestors (after the change) of the sources
+        # of changed edges; num_pending[v] is the number of affected
+        # children of v
+        num_nodes, num_roots = 0, 0
+        for edge_ids in (edge_ids_to_add, edge_ids_to_remove):
+            for e_id in edge_ids:
+                v_id = self.edge_source_ids[e_id]
+                while not affected[v_id]:
+                    affected[v_id] = True
+                    self._nodes[num_nodes] = v_id
+                    num_nodes += 1
+                    p_e_id = new_parent_edge[v_id]
+                    if p_e_id == -2:
+                        p_e_id = parent_edge[v_id]
+                    if p_e_id < 0:
+                        self._roots[num_roots] = v_id
+                        num_roots += 1
+                        break
+                    v_id = self.edge_source_ids[p_e_id]
+                    num_pending[v_id] += 1
+        for e_id in edge_ids_to_remove:
+            t_id = self.edge_target_ids[e_id]
+            if new_parent_edge[t_id] == -1 and not affected[t_id]:
+                self._roots[num_roots] = t_id
+                num_roots += 1
+        self._num_nodes, self._num_roots = num_nodes, num_roots
+        # recompute the affected nodes after their affected children
+        num_ready = 0
+        for i in range(num_nodes):
+            if num_pending[self._nodes[i]] == 0:
+                self._ready[num_ready] = self._nodes[i]
+                num_ready += 1
+        while num_ready > 0:
+            num_ready -= 1
+            v_id = self._ready[num_ready]
+            b = self._new_backward_prob[v_id]
+            b[:] = self.leaf_prob[v_id]
+            e_id = self.branching.first_child_edge[v_id]
+            while e_id >= 0:
+                if not self._edge_removed[e_id]:
+                    self._multiply_by_message(b, e_id)
+                e_id = self.branching.next_sibling_edge[e_id]
+            for e_id in edge_ids_to_add:
+                if self.edge_source_ids[e_id] == v_id:
+                    self._multiply_by_message(b, e_id)
+            p_e_id = new_parent_edge[v_id]
+            if p_e_id == -2:
+                p_e_id = parent_edge[v_id]
+            if p_e_id >= 0:
+                u_id = self.edge_source_ids[p_e_id]
+                num_pending[u_id] -= 1
+                if num_pending[u_id] == 0:
+                    self._ready[num_ready] = u_id
+                    num_ready += 1
+
+    def _multiply_by_message(self, b :np.ndarray, e_id :int) -> None:
+        '''Multiply `b` by the message over the edge `e_id` from its
+           target, as it would be after the change prepared by
+           _changed_backward_prob().'''
+        c_id = self.edge_target_ids[e_id]
+        if self._affected[c_id]:
+            b *= self.edge_tr_mat.backward_message(
+                     e_id, self._new_backward_prob[c_id], self._msg)
+        elif self.branching.parent_edge[c_id] != e_id:
+            b *= self.edge_tr_mat.backward_message(
+                     e_id, self.backward_prob[c_id], self._msg)
         else:
-            edges_to_change_by_root = {}
-            for edge in edges_to_add:
-                root = self.branching.root(edge.source)
-                if root not in edges_to_change_by_root:
-                    edges_to_change_by_root[root] = (list(), list())
-                edges_to_change_by_root[root][0].append(edge)
-            for edge in edges_to_remove:
-                root = self.branching.root(edge.source)
-                if root not in edges_to_change_by_root:
-                    edges_to_change_by_root[root] = (list(), list())
-                edges_to_change_by_root[root][1].append(edge)
-            prob = 1.0
-            for root, (edges_to_add, edges_to_remove) in \
-                    edges_to_change_by_root.items():
-                logging.getLogger('main').debug(\
-                    'edges_to_change_by_root[{}] = {} ;;; {}'\
-                    .format(str(root),
-                            '; '.join(str(edge) for edge in edges_to_add),
-                            '; '.join(str(edge) for edge in edges_to_remove)))
-                prob *= self.compute_acc_prob_for_subtree(\
-                            edges_to_add, edges_to_remove)
-            return prob * prop_prob_ratio
-
-    def compute_acc_prob_for_subtree(self, edges_to_add, edges_to_remove):
-
-        def _build_modified_subtree(edges_to_add, edges_to_remove):
-            '''Return a subset of self.branching with `edges_to_add` added 
-               and `edges_to_remove` removed. The returned subset contains
-               all nodes, for which the backward probability changes,
-               together with their children. It is a tree rooted in the common
-               ancestor of source nodes of changed edges, plus target nodes
-               of edges that would introduce a cycle (in case of the "flip"
-               move.'''
-
-            def _common_ancestor(node_1, node_2, depth_1=None, depth_2=None):
-                if node_1 == node_2:
-                    return node_1
-                if depth_1 is None:
-                    depth_1 = self.branching.depth(node_1)
-                if depth_2 is None:
-                    depth_2 = self.branching.depth(node_2)
-                if max(depth_1, depth_2) <= 0:
-                    return None
-                if depth_1 < depth_2:
-                    return _common_ancestor(node_1, self.branching.parent(node_2),\
-                                            depth_1, depth_2-1)
-                elif depth_1 > depth_2:
-                    return _common_ancestor(self.branching.parent(node_1), node_2,\
-                                            depth_1-1, depth_2)
-                else:
-                    return _common_ancestor(self.branching.parent(node_1), \
-                                            self.branching.parent(node_2), \
-                                            depth_1-1, depth_2-1)
-
-            def _add_outgoing_edges(branching, node):
-                for oe in self.branching.outgoing_edges(node):
-                    if not branching.has_edge(oe.source, oe.target, oe.rule):
-                        branching.add_edge(oe)
-
-            edges_to_change = edges_to_add + edges_to_remove
-            subtree_root = edges_to_change[0].source
-            for edge in edges_to_change[1:]:
-                subtree_root = _common_ancestor(subtree_root, edge.source)
-            root_of_subtree_root = self.branching.root(subtree_root)
-            for edge in edges_to_change:
-                if self.branching.root(edge.target) == root_of_subtree_root:
-                    subtree_root = _common_ancestor(subtree_root, edge.target)
-            modified_subtree = Branching()
-            modified_nodes = set()
-            # create a copy of a fragment of the branching
-            # containing paths from subtree_root to each source of a changed
-            # edge
-            for src in [edge.source for edge in edges_to_change]:
-                node = src
-                modified_nodes.add(node)
-                _add_outgoing_edges(modified_subtree, node)
-                while node != subtree_root:
-                    ie = self.branching.ingoing_edges(node)[0]
-                    modified_subtree.add_edge(ie)
-                    if ie.source not in modified_nodes:
-                        _add_outgoing_edges(modified_subtree, ie.source)
-                        modified_nodes.add(ie.source)
-                    node = ie.source
-            # perform the changes on our copy
-            for edge in edges_to_add:
-                modified_subtree.add_edge(edge)
-                if edge.target not in modified_nodes:
-                    _add_outgoing_edges(modified_subtree, edge.target)
-                    modified_nodes.add(edge.target)
-            for edge in edges_to_remove:
-                modified_subtree.remove_edge(edge)
-            return modified_subtree, modified_nodes
-
-        def _list_nodes_breadth_first(branching, nodes):
-            # list tree nodes in the order of increasing depth
-            queue = [branching.root(list(nodes)[0])]
-            result = []
-            while queue:
-                node = queue.pop(0)
-                result.append(node)
-                for successor in branching.successors(node):
-                    if successor in nodes:
-                        queue.append(successor)
-            return result
-
-        def _recompute_backward_prob(branching, nodes):
-            # recompute the backward probabilities for the given nodes
-            # (in reverse order) according to the given branching
-            # TODO refactor -- code duplication with
-            #      MCMCTagSampler.recompute_backward_prob_for_node()
-            new_backward_prob = np.empty((len(nodes), len(self.tagset)),
-                                         dtype=np.float64)
-            for i in range(len(nodes)-1, -1, -1):
-                node = nodes[i]
-                w_id = self.lexicon.get_id(node)
-                new_backward_prob[i,:] = self.leaf_prob[w_id,:]
-                for edge in branching.outgoing_edges(node):
-                    e_id = self.full_graph.edge_set.get_id(edge)
-                    b = new_backward_prob[nodes.index(edge.target),:] \
-                        if edge.target in nodes \
-                        else self.backward_prob[self.lexicon.get_id(edge.target),:]
-                    new_backward_prob[i,:] *= self.edge_tr_mat[e_id].dot(b)
-            return new_backward_prob
-
-        def _recompute_root_forward_prob(branching, root, edges_to_remove):
-            r_id = self.lexicon.get_id(root)
-            if self.branching.parent(root) is not None and \
-                   self.branching.ingoing_edges(root)[0] \
-                        not in edges_to_remove:
-                # the parent of our subtree root is outside of the changed
-                # subtree -> forward probability did not change
-                return np.copy(self.forward_prob[r_id,:])
+            b *= self.backward_msg[c_id]
+
+    def _old_root_log_prob(self, v_id :int) -> float:
+        '''Return the log-probability of the tree containing `v_id`, or 0
+           if the tree was already counted (see compute_acc_prob()).'''
+        r_id = self.branching.root_id(v_id)
+        if self._is_old_root[r_id]:
+            return 0.0
+        self._is_old_root[r_id] = True
+        self._old_roots[self._num_old_roots] = r_id
+        self._num_old_roots += 1
+        return math.log(np.dot(self.root_prob[r_id], self.backward_prob[r_id]))
+
+    def compute_acc_prob(self, edge_ids_to_add, edge_ids_to_remove,
+                         prop_prob_ratio, depth_change):
+        '''The ratio of the probabilities of the trees containing
+           the changed edges after and before the change, where
+           the probability of a tree is the sum over all its taggings.'''
+        self._changed_backward_prob(edge_ids_to_add, edge_ids_to_remove)
+        log_prob_ratio = 0.0
+        for i in range(self._num_roots):
+            r_id = self._roots[i]
+            if self._affected[r_id]:
+                prob = np.dot(self.root_prob[r_id],
+                              self._new_backward_prob[r_id])
             else:
-                # the former parent of our root is inside the changed subtree
-                # and its deriving edge was removed, or our subtree root
-                # was previously a true tree root; either way, now it is
-                # a true root
-                return np.copy(self.root_prob[r_id,:])
-
-        modified_subtree, modified_nodes = \
-            _build_modified_subtree(edges_to_add, edges_to_remove)
-        modified_nodes = \
-            _list_nodes_breadth_first(modified_subtree, modified_nodes)
-        new_backward_prob = \
-            _recompute_backward_prob(modified_subtree, modified_nodes)
-        new_root_forward_prob = \
-           _recompute_root_forward_prob(modified_subtree, modified_nodes[0],
-                                        edges_to_remove)
-        r_id = self.lexicon.get_id(modified_nodes[0])
-
-        old_prob = np.sum(self.forward_prob[r_id,:] * \
-                          self.backward_prob[r_id,:])
-        new_prob = np.sum(new_root_forward_prob * new_backward_prob[0,:])
-        acc_prob = 0 \
-                   if new_prob < self.min_subtree_prob \
-                   else new_prob / old_prob
-        return acc_prob
-
-    def recompute_forward_prob_for_node(self, node):
-        w_id = self.lexicon.get_id(node)
-        old_value = np.copy(self.forward_prob[w_id,:])
-        if self.branching.parent(node) is None:
-            result = np.copy(self.root_prob[w_id,:])
-        else:
-            parent = self.branching.parent(node)
-            par_id = self.lexicon.get_id(parent)
-            result = np.copy(self.forward_prob[par_id,:])
-            for edge in self.branching.outgoing_edges(parent):
-                if edge.target != node:
-                    e_id = self.full_graph.edge_set.get_id(edge)
-                    w2_id = self.lexicon.get_id(edge.target)
-                    result *= self.edge_tr_mat[e_id].dot(self.backward_prob[w2_id,:])
-            e_id = self.full_graph.edge_set.get_id(\
-                       self.branching.ingoing_edges(node)[0])
-            result = np.dot(result, self.edge_tr_mat[e_id].toarray())
-        self.forward_prob[w_id,:] = result
-        if not np.any(result > 0):
-            root = self.branching.root(node)
-            parent = self.branching.parent(node)
-            print()
-            print('root =', root)
-            print('subtree size =', self.branching.subtree_size(root))
-            print('subtree height =', self.branching.height(root))
-            print('root prob.=', self.root_prob[self.lexicon.get_id(root),:])
-            print('parent forward prob.=', self.forward_prob[self.lexicon.get_id(parent),:])
-            print('Zero forward prob. for: {} (old value = {})'\
-                  .format(self.lexicon[w_id], old_value))
-            raise Exception()
-
-    def recompute_forward_prob_for_subtree(self, root):
-        self.recompute_forward_prob_for_node(root)
-        for node in self.branching.successors(root):
-            self.recompute_forward_prob_for_subtree(node)
-
-    def recompute_backward_prob_for_node(self, node):
-        w_id = self.lexicon.get_id(node)
-        result = np.copy(self.leaf_prob[w_id,:])
-        for edge in self.branching.outgoing_edges(node):
-            e_id = self.full_graph.edge_set.get_id(edge)
-            w2_id = self.lexicon.get_id(edge.target)
-            result *= self.edge_tr_mat[e_id].dot(self.backward_prob[w2_id,:])
-        self.backward_prob[w_id,:] = result
-        if not np.any(result > 0):
-            raise Exception('Zero backward prob. for: {}'.format(self.lexicon[w_id]))
-
-    def recompute_backward_prob_for_subtree(self, root):
-        for node in self.branching.successors(root):
-            self.recompute_backward_prob_for_subtree(node)
-        self.recompute_backward_prob_for_node(root)
+                prob = np.dot(self.root_prob[r_id], self.backward_prob[r_id])
+            if prob < self.min_subtree_prob:
+                return 0
+            log_prob_ratio += math.log(prob)
+        for edge_ids in (edge_ids_to_add, edge_ids_to_remove):
+            for e_id in edge_ids:
+                log_prob_ratio -= \
+                    self._old_root_log_prob(self.edge_source_ids[e_id]) + \
+                    self._old_root_log_prob(self.edge_target_ids[e_id])
+        self._is_old_root[self._old_roots[:self._num_old_roots]] = False
+        self._num_old_roots = 0
+        return math.exp(log_prob_ratio) * prop_prob_ratio
+
+    def _sibling_products(self, parent_ids :np.ndarray,
+                          msg :np.ndarray) -> np.ndarray:
+        '''For every row of `msg` (the message of a child of the node in
+           `parent_ids`), return the product of the messages of all other
+           children of the same parent (which must all be included).'''
+        order = np.argsort(parent_ids, kind='stable')
+        sorted_parent_ids = parent_ids[order]
+        is_first = np.ones(len(order), dtype=np.bool_)
+        is_first[1:] = sorted_parent_ids[1:] != sorted_parent_ids[:-1]
+        starts = np.flatnonzero(is_first)
+        groups = np.cumsum(is_first) - 1
+        # the zeros are counted separately, so that the product of
+        # the others can be obtained by division
+        is_zero = msg[order] == 0
+        nonzero = np.where(is_zero, 1, msg[order])
+        products = np.multiply.reduceat(nonzero, starts, axis=0)[groups]
+        num_zeros = np.add.reduceat(is_zero.astype(np.int64), starts,
+                                    axis=0)[groups]
+        result = np.empty_like(msg)
+        result[order] = np.where(num_zeros > is_zero, 0, products / nonzero)
+        return result
+
+    def compute_forward_prob(self, w_ids :np.ndarray,
+                             depths :np.ndarray) -> None:
+        '''Recompute the forward probabilities of the given nodes, which
+           must consist of whole trees, from the roots downwards, one
+           level (given by `depths`) at a time. The message to a child is
+           computed from the forward probability of its parent and
+           the cached messages of its siblings.'''
+        order = np.argsort(depths, kind='stable')
+        w_ids, depths = w_ids[order], depths[order]
+        bounds = np.searchsorted(depths, np.arange(1, depths[-1]+2))
+        root_ids = w_ids[:bounds[1]]
+        self.forward_prob[root_ids] = self.root_prob[root_ids]
+        for d in range(1, len(bounds)-1):
+            child_ids = w_ids[bounds[d]:bounds[d+1]]
+            e_ids = self.branching.parent_edge[child_ids]
+            parent_ids = self.edge_source_ids[e_ids]
+            vectors = self.forward_prob[parent_ids] * \
+                      self.leaf_prob[parent_ids] * \
+                      self._sibling_products(parent_ids,
+                                             self.backward_msg[child_ids])
+            self.forward_prob[child_ids] = \
+                self.edge_tr_mat.forward_messages(e_ids, vectors)
 
     def check_probs_for_subtree(self, root, value=None):
         w_id = self.lexicon.get_id(root)
@@ -873,50 +2493,67 @@ class MCMCTagSampler(MCMCGraphSampler):
                 return False
         return True
 
-    def update_tag_freq_for_node(self, node):
-        w_id = self.lexicon.get_id(node)
-        cur_tag_freq = self.forward_prob[w_id,:] * self.backward_prob[w_id,:]
-        cur_tag_freq_sum = np.sum(cur_tag_freq)
-        if cur_tag_freq_sum > 0:
-            cur_tag_freq /= np.sum(cur_tag_freq)
-        self.tag_freq[w_id,:] = \
-            (self.tag_freq[w_id,:] * self.last_modified[w_id] + \
-             cur_tag_freq * (self.iter_num - self.last_modified[w_id])) /\
-            self.iter_num
-        self.last_modified[w_id] = self.iter_num
-
-    def update_tag_freq_for_subtree(self, root):
-        self.update_tag_freq_for_node(root)
-        for node in self.branching.successors(root):
-            self.update_tag_freq_for_subtree(node)
-
-    def accept_move(self, edges_to_add, edges_to_remove):
+    def update_tag_freq(self, w_ids :np.ndarray) -> None:
+        '''Account for the current tag probabilities of the given words
+           in the averages over iterations `tag_freq`.'''
+        if self.iter_num > 0:
+            last_modified = self.last_modified[w_ids].reshape((-1, 1))
+            self.tag_freq[w_ids] = \
+                (self.tag_freq[w_ids] * last_modified + \
+                 self.tag_prob[w_ids] * (self.iter_num - last_modified)) / \
+                self.iter_num
+        self.last_modified[w_ids] = self.iter_num
+
+    def update_tag_prob(self) -> None:
+        '''Recompute the tag probabilities of the words in the trees
+           changed since the last call (after accounting for their
+           previous values in `tag_freq`). In between, the tag
+           probabilities of the changed trees keep their previous values,
+           so that accepting a move only updates the backward
+           probabilities on the changed paths and not whole trees.'''
+        depths, jumps = self.branching.ancestor_index()
+        w_ids = np.flatnonzero(self._tree_changed[jumps[-1]])
+        self._tree_changed.fill(False)
+        if len(w_ids) == 0:
+            return
+        self.update_tag_freq(w_ids)
+        self.compute_forward_prob(w_ids, depths[w_ids])
+        tag_prob = self.forward_prob[w_ids] * self.backward_prob[w_ids]
+        tag_prob_sum = np.sum(tag_prob, axis=1, keepdims=True)
+        self.tag_prob[w_ids] = \
+            np.where(tag_prob_sum > 0,
+                     tag_prob / np.where(tag_prob_sum > 0, tag_prob_sum, 1),
+                     tag_prob)
+
+    def accept_move(self, edge_ids_to_add, edge_ids_to_remove):
+        if self._scratch_move != (edge_ids_to_add, edge_ids_to_remove):
+            self._changed_backward_prob(edge_ids_to_add, edge_ids_to_remove)
         # remove edges and update stats
-        roots_changed = set()
-        for e in edges_to_remove:
-            self.branching.remove_edge(e)
-            roots_changed.add(self.branching.root(e.source))
-            roots_changed.add(e.target)
+        for e_id in edge_ids_to_remove:
+            self.branching.remove_edge_id(e_id)
             for stat in self.stats.values():
-                stat.edge_removed(e)
+                stat.edge_removed(e_id)
         # add edges and update stats
-        for e in edges_to_add:
-            self.branching.add_edge(e)
-            roots_changed.add(self.branching.root(e.source))
+        for e_id in edge_ids_to_add:
+            self.branching.add_edge_id(e_id)
             for stat in self.stats.values():
-                stat.edge_added(e)
-        roots_changed = { root for root in roots_changed \
-                          if self.branching.parent(root) is None }
-        for root in roots_changed:
-            self.update_tag_freq_for_subtree(root)
-        for root in roots_changed:
-            self.recompute_backward_prob_for_subtree(root)
-        for root in roots_changed:
-            self.recompute_forward_prob_for_subtree(root)
+                stat.edge_added(e_id)
+        # update the backward probabilities and the messages to parents
+        nodes = self._nodes[:self._num_nodes]
+        self.backward_prob[nodes] = self._new_backward_prob[nodes]
+        v_ids = np.concatenate(
+                    (nodes, self.edge_target_ids[edge_ids_to_add]))
+        v_ids = v_ids[self.branching.parent_edge[v_ids] >= 0]
+        self.backward_msg[v_ids] = self.edge_tr_mat.backward_messages(
+            self.branching.parent_edge[v_ids], self.backward_prob[v_ids])
+        # the tag probabilities change in the whole trees containing
+        # the changed edges (see update_tag_prob())
+        self._tree_changed[self._roots[:self._num_roots]] = True
+        self._clear_scratch()
 
     def finalize(self):
-        for node in self.lexicon:
-            self.update_tag_freq_for_node(node)
+        self.update_tag_prob()
+        self.update_tag_freq(np.arange(len(self.lexicon)))
         for stat in self.stats.values():
             stat.update()
 
@@ -936,13 +2573,14 @@ class MCMCTagSampler(MCMCGraphSampler):
 
     def write_edge_tr_mat(self, filename):
         with open_to_write(filename) as fp:
+            tr = self.edge_tr_mat
             for e_id, edge in enumerate(self.full_graph.edge_set):
                 tag_probs = []
-                edge_tr_mat = self.edge_tr_mat[e_id]
-                for (t1_id, t2_id), val in edge_tr_mat.todok().items():
-                    tag_1 = self.tagset[t1_id]
-                    tag_2 = self.tagset[t2_id]
-                    tag_probs.append((''.join(tag_1), ''.join(tag_2), str(val)))
+                for i in range(tr.offsets[e_id], tr.offsets[e_id+1]):
+                    tag_1 = self.tagset[tr.source_tags[i]]
+                    tag_2 = self.tagset[tr.target_tags[i]]
+                    tag_probs.append((''.join(tag_1), ''.join(tag_2),
+                                      str(tr.values[i])))
                 write_line(fp, (str(edge), ' '.join([t1+':'+t2+':'+prob \
                                                      for t1, t2, prob in tag_probs])))
 
@@ -1,11 +1,51 @@
-from morle.datastruct.graph import GraphEdge
-from morle.datastruct.lexicon import LexiconEntry
 from morle.datastruct.rules import Rule
 
 import numpy as np
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Tuple
+
+
+def _mean_and_chain_var(states :List[Any], weights :List[float] = None) \
+                       -> Tuple[Any, Any]:
+    '''Compute the (weighted) average and the between-chain variance of
+       values obtained from independent chains (elementwise for arrays).'''
+    values = np.array(states, dtype=np.float64)
+    mean = np.average(values, axis=0, weights=weights)
+    if len(states) > 1:
+        var = np.var(values, axis=0, ddof=1)
+    else:
+        var = np.zeros_like(mean)
+    return mean, var
+
+
+def _average_with_changes(val :np.ndarray, last_modified :np.ndarray,
+                          current :np.ndarray, idx :np.ndarray,
+                          changes :np.ndarray, iter_nums :np.ndarray,
+                          iter_num :int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Update the averages over iterations `val` of piecewise constant
+       values (like the number of edges of each rule) with journaled
+       changes. The averages are accounted up to `last_modified` and
+       `current` are the values at that time. The change `changes[i]` of
+       the value `idx[i]` happened in iteration `iter_nums[i]` (and is
+       counted from the next iteration on). Returns the averages up to
+       `iter_num` and the total change of each value.'''
+    total_change = np.bincount(idx, weights=changes, minlength=len(val))
+    # the sum of the values over iterations last_modified+1..iter_num
+    value_sum = (current + total_change) * iter_num - \
+                current * last_modified - \
+                np.bincount(idx, weights=changes*iter_nums,
+                            minlength=len(val))
+    return (val * last_modified + value_sum) / iter_num, total_change
+
 
 class MCMCStatistic:
+    # attributes that make up the state of the statistic during sampling
+    # (saved in checkpoints)
+    checkpoint_attrs = ()           # type: Tuple[str, ...]
+    # if True, the sampler passes the changes to the statistic in batches
+    # through flush() instead of calling edge_added(), edge_removed()
+    # and next_iter()
+    journaled = False
+
     def __init__(self, sampler :'MCMCGraphSampler') -> None:
         self.sampler = sampler
 #         self.reset()
@@ -16,17 +56,76 @@ class MCMCStatistic:
     def update(self) -> None:
         pass
 
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         pass
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         pass
 
     def next_iter(self) -> None:
         pass
 
+    def move_done(self, move_type :str, accepted :bool,
+                  proposal_time :float, acceptance_time :float) -> None:
+        pass
+
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        '''Process the changes recorded in the move journal since
+           the last flush (see MoveJournal), in chronological order,
+           and account for the state of the sampler up to the current
+           iteration.'''
+        pass
+
+    def checkpoint_state(self) -> Dict[str, np.ndarray]:
+        return { attr : np.asarray(getattr(self, attr)) \
+                 for attr in self.checkpoint_attrs }
+
+    def restore_state(self, state :Dict[str, np.ndarray]) -> None:
+        '''Restore the state saved by checkpoint_state().'''
+        for attr in self.checkpoint_attrs:
+            value = state[attr]
+            setattr(self, attr, value.item() if value.ndim == 0 \
+                                else value.copy())
+
+    def state(self) -> Any:
+        '''Return the final value of the statistic in a form that can be
+           sent to another process and passed to merge().'''
+        raise NotImplementedError()
+
+    def merge(self, states :List[Any], weights :List[float] = None) -> None:
+        '''Set the statistic to the average of the states of several
+           independent chains, weighted by `weights` (e.g. the lengths of
+           the chains). The between-chain variance is stored in
+           `chain_var`.'''
+        raise NotImplementedError()
+
+    def component_state(self, edge_ids :np.ndarray) -> Any:
+        '''Return the part of the final state that concerns the connected
+           components containing the given edges. Passed to
+           merge_components().'''
+        return self.state()
+
+    def merge_components(self, states :List[Any],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        '''Set the statistic to the combination of states obtained by
+           sampling disjoint sets of connected components (given by
+           their edge IDs) separately. By default, the states are
+           averaged like the states of independent chains.'''
+        self.merge(states, weights)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> Any:
+        '''Return the state (as component_state()) corresponding to
+           the exact marginal probabilities of the given edges, or None
+           if the statistic cannot be computed from them.'''
+        return None
+
 
 class ScalarStatistic(MCMCStatistic):
+    checkpoint_attrs = ('val', 'last_modified')
+
     def __init__(self, sampler :'MCMCGraphSampler') -> None:
         super().__init__(sampler)
     
@@ -38,27 +137,42 @@ class ScalarStatistic(MCMCStatistic):
     def update(self) -> None:
         raise NotImplementedError()
 
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         raise NotImplementedError()
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         raise NotImplementedError()
 
     def value(self) -> float:
         return self.val
 
+    def state(self) -> float:
+        return self.val
+
+    def merge(self, states :List[float], weights :List[float] = None) \
+             -> None:
+        mean, var = _mean_and_chain_var(states, weights)
+        self.val, self.chain_var = float(mean), float(var)
+
 
 class ExpectedCostStatistic(ScalarStatistic):
+    checkpoint_attrs = ('val', 'last_modified', 'current_logl')
+    journaled = True
+
     def __init__(self, sampler :'MCMCGraphSampler') -> None:
         super().__init__(sampler)
 
+    def reset(self) -> None:
+        super().reset()
+        self.current_logl = getattr(self.sampler, '_logl', 0.0)
+
     def update(self) -> None:
         pass
     
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         pass
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         pass
     
     def next_iter(self):
@@ -66,6 +180,34 @@ class ExpectedCostStatistic(ScalarStatistic):
             (self.val * (self.sampler.iter_num-1) + self.sampler.logl()) \
             / self.sampler.iter_num
 
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        iter_num = self.sampler.iter_num
+        if iter_num == 0:
+            return
+        # the log-likelihood after a move counts for the iteration
+        # of the move and all following ones
+        changes = np.diff(logls, prepend=self.current_logl)
+        logl_sum = self.current_logl * (iter_num - self.last_modified) + \
+                   float(np.dot(changes, iter_num - iter_nums + 1))
+        self.val = (self.val * self.last_modified + logl_sum) / iter_num
+        self.last_modified = iter_num
+        if len(logls) > 0:
+            self.current_logl = float(logls[-1])
+
+    def merge_components(self, states :List[float],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        # the log-likelihood is additive over the components
+        base = self.sampler.empty_branching_logl()
+        self.val = base + sum(state - base for state in states)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> float:
+        return self.sampler.empty_branching_logl() + \
+               float(np.dot(edge_marginals,
+                            self.sampler.edge_delta_cache[edge_ids]))
+
 
 class TimeStatistic(ScalarStatistic):
     def reset(self, sampler :'MCMCGraphSampler') -> None:
@@ -75,10 +217,10 @@ class TimeStatistic(ScalarStatistic):
     def update(self):
         self.val = time.time() - self.started
     
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         pass
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         pass
     
     def next_iter(self):
@@ -86,13 +228,15 @@ class TimeStatistic(ScalarStatistic):
 
 
 class AcceptanceRateStatistic(ScalarStatistic):
+    journaled = True
+
     def update(self):
         pass
     
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         self.acceptance()
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         self.acceptance()
 
     def acceptance(self) -> None:
@@ -101,24 +245,198 @@ class AcceptanceRateStatistic(ScalarStatistic):
                        self.sampler.iter_num
             self.last_modified = self.sampler.iter_num
 
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        # the rate is the number of iterations with an accepted move
+        # up to the last one
+        accepted_iters = np.unique(iter_nums[iter_nums > self.last_modified])
+        if len(accepted_iters) > 0:
+            last_iter = int(accepted_iters[-1])
+            self.val = (self.val * self.last_modified +
+                        len(accepted_iters)) / last_iter
+            self.last_modified = last_iter
+
+
+class MoveStatistic(MCMCStatistic):
+    '''Number of proposals, acceptance rate and time spent in proposal
+       and acceptance for each type of move.'''
+
+    move_types = ('add', 'delete', 'flip_1', 'flip_2', 'swap_parent',
+                  'impossible')
+    checkpoint_attrs = ('num_proposed', 'num_accepted', 'proposal_time',
+                        'acceptance_time')
+
+    def __init__(self, sampler :'MCMCGraphSampler') -> None:
+        super().__init__(sampler)
+        self.move_type_index = \
+            { move_type : i for i, move_type in enumerate(self.move_types) }
+
+    def reset(self) -> None:
+        self.num_proposed = np.zeros(len(self.move_types), dtype=np.int64)
+        self.num_accepted = np.zeros(len(self.move_types), dtype=np.int64)
+        self.proposal_time = np.zeros(len(self.move_types))
+        self.acceptance_time = np.zeros(len(self.move_types))
+
+    def move_done(self, move_type :str, accepted :bool,
+                  proposal_time :float, acceptance_time :float) -> None:
+        idx = self.move_type_index[move_type]
+        self.num_proposed[idx] += 1
+        if accepted:
+            self.num_accepted[idx] += 1
+        self.proposal_time[idx] += proposal_time
+        self.acceptance_time[idx] += acceptance_time
+
+    def acceptance_rate(self) -> np.ndarray:
+        return self.num_accepted / np.maximum(self.num_proposed, 1)
+
+    def state(self) -> np.ndarray:
+        return np.vstack([self.num_proposed, self.num_accepted,
+                          self.proposal_time, self.acceptance_time])
+
+    def merge(self, states :List[np.ndarray],
+              weights :List[float] = None) -> None:
+        # the counts and times of all chains add up
+        total = np.sum(states, axis=0)
+        self.num_proposed = total[0].astype(np.int64)
+        self.num_accepted = total[1].astype(np.int64)
+        self.proposal_time, self.acceptance_time = total[2], total[3]
+
 
 class IterationStatistic(MCMCStatistic):
+    '''The values are kept in a ring buffer of fixed capacity. When it is
+       full, the sampler passes the values of all iteration statistics to
+       the trace file (see MCMCGraphSampler.write_trace()), which removes
+       them from the buffers by take_values(). Only the values that are
+       not in the trace file yet are available through `values` and
+       value() and saved in checkpoints.'''
+
+    checkpoint_attrs = ('values', 'num_traced')
+    # the number of values kept in memory
+    CAPACITY = 4096
+
     def reset(self) -> None:
-        self.values = []        # type: List[float]
+        self._buffer = np.empty(self.CAPACITY)
+        # the position of the oldest value in the buffer
+        self._start = 0
+        self.num_values = 0
+        # the number of values passed to the trace file and removed from
+        # the buffer (see take_values())
+        self.num_traced = 0
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._buffer[(self._start + np.arange(self.num_values)) % \
+                            self.CAPACITY]
+
+    @values.setter
+    def values(self, values :np.ndarray) -> None:
+        self._buffer = np.empty(self.CAPACITY)
+        self._start, self.num_values = 0, 0
+        self.append_values(values)
+
+    def append_values(self, values :np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        i = 0
+        while i < len(values):
+            if self.num_values == self.CAPACITY:
+                self.sampler.write_trace()
+                if self.num_values == self.CAPACITY:
+                    raise RuntimeError('The buffer of an iteration statistic'
+                                       ' could not be emptied.')
+            end = (self._start + self.num_values) % self.CAPACITY
+            size = min(len(values)-i, self.CAPACITY-self.num_values,
+                       self.CAPACITY-end)
+            self._buffer[end:end+size] = values[i:i+size]
+            self.num_values += size
+            i += size
 
     def value(self, iter_num :int) -> float:
         if iter_num % self.sampler.iter_stat_interval != 0:
             raise KeyError(iter_num)
-        return self.values[iter_num // self.sampler.iter_stat_interval-1]
+        idx = iter_num // self.sampler.iter_stat_interval - 1
+        if idx < self.num_traced or idx >= self.num_traced+self.num_values:
+            raise KeyError(iter_num)
+        return float(self._buffer[(self._start + idx - self.num_traced) % \
+                                  self.CAPACITY])
+
+    def take_values(self, num_values :int = None) -> np.ndarray:
+        '''Return the oldest `num_values` values (by default all) and
+           remove them (used to pass the values to the trace file).'''
+        if num_values is None:
+            num_values = self.num_values
+        values = self.values[:num_values]
+        self._start = (self._start + num_values) % self.CAPACITY
+        self.num_values -= num_values
+        self.num_traced += num_values
+        return values
+
+    def state(self) -> np.ndarray:
+        return self.values
+
+    def merge(self, states :List[np.ndarray],
+              weights :List[float] = None) -> None:
+        '''Append the averages of the values of several chains (at
+           the same iterations, e.g. blocks of rows read from their
+           trace files, see MCMCGraphSampler._merge_traces()). The values
+           are only available up to the length of the shortest chain.'''
+        length = min(len(values) for values in states)
+        self.append_values(
+            np.mean([values[:length] for values in states], axis=0))
 
 
 class CostAtIterationStatistic(IterationStatistic):
+    checkpoint_attrs = ('values', 'num_traced', 'last_modified',
+                        'current_logl')
+    journaled = True
+
+    def reset(self) -> None:
+        super().reset()
+        self.last_modified = 0
+        self.current_logl = getattr(self.sampler, '_logl', 0.0)
+
     def next_iter(self) -> None:
         if self.sampler.iter_num % self.sampler.iter_stat_interval == 0:
-            self.values.append(self.sampler.logl())
+            self.append_values([self.sampler.logl()])
+
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        interval = self.sampler.iter_stat_interval
+        points = np.arange((self.last_modified // interval + 1) * interval,
+                           self.sampler.iter_num+1, interval)
+        # the last record up to each point determines the log-likelihood
+        logl_after = np.concatenate(([self.current_logl], logls))
+        self.append_values(
+            logl_after[np.searchsorted(iter_nums, points, side='right')])
+        self.last_modified = self.sampler.iter_num
+        if len(logls) > 0:
+            self.current_logl = float(logls[-1])
+
+    def merge_components(self, states :List[np.ndarray],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        # the log-likelihood is additive over the components; the parts
+        # that stopped earlier keep their last value (the values are
+        # appended like in merge())
+        base = self.sampler.empty_branching_logl()
+        length = max(len(state) for state in states)
+        values = np.full(length, base)
+        for state in states:
+            if len(state) > 0:
+                values += np.pad(np.asarray(state) - base,
+                                 (0, length-len(state)), mode='edge')
+        self.append_values(values)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> List[float]:
+        # the expected value at every iteration
+        return [self.sampler.empty_branching_logl() + \
+                float(np.dot(edge_marginals,
+                             self.sampler.edge_delta_cache[edge_ids]))]
 
 
 class EdgeStatistic(MCMCStatistic):
+    checkpoint_attrs = ('val', 'last_modified')
+
     def reset(self) -> None:
         self.val = np.zeros(len(self.sampler.edge_set))
         self.last_modified = np.zeros(len(self.sampler.edge_set),
@@ -127,10 +445,10 @@ class EdgeStatistic(MCMCStatistic):
     def update(self) -> None:
         raise NotImplementedError()
 
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         raise NotImplementedError()
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         raise NotImplementedError()
 
     def next_iter(self):
@@ -142,108 +460,279 @@ class EdgeStatistic(MCMCStatistic):
     def value_at(self, idx :int) -> float:
         return float(self.val[idx])
 
+    def state(self) -> np.ndarray:
+        return self.val
+
+    def merge(self, states :List[np.ndarray],
+              weights :List[float] = None) -> None:
+        self.val, self.chain_var = _mean_and_chain_var(states, weights)
+
+    def component_state(self, edge_ids :np.ndarray) -> np.ndarray:
+        return self.val[edge_ids]
+
+    def merge_components(self, states :List[np.ndarray],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        for state, part_edge_ids in zip(states, edge_ids):
+            self.val[part_edge_ids] = state
+
 
 class EdgeFrequencyStatistic(EdgeStatistic):
+    journaled = True
+
+    def reset(self) -> None:
+        super().reset()
+        # presence of each edge in the current branching
+        self.present = np.zeros(len(self.sampler.edge_set), dtype=np.bool_)
+        branching = getattr(self.sampler, 'branching', None)
+        if branching is not None:
+            self.present[branching.edge_ids()] = True
+
     def update(self) -> None:
-        for edge in self.sampler.edge_set:
-            if self.sampler.branching.has_edge(edge.source, edge.target, edge.rule):
-                # not really removing -- just accounting for the fact that
-                # the edge was present in the last graphs
-                self.edge_removed(edge)
-            else:
-                # not really adding -- just accounting for the fact that
-                # the edge was absent in the last graphs
-                self.edge_added(edge)
-
-    def edge_added(self, edge :GraphEdge) -> None:
-        idx = self.sampler.edge_set.get_id(edge)
+        # account for the presence or absence of each edge since its
+        # last modification
+        iter_num = self.sampler.iter_num
+        if iter_num == 0:
+            return
+        self.val = (self.val * self.last_modified +\
+                    self.present * (iter_num - self.last_modified)) /\
+                   iter_num
+        self.last_modified.fill(iter_num)
+
+    def edge_added(self, edge_id :int) -> None:
+        idx = edge_id
         self.val[idx] =\
             self.val[idx] * self.last_modified[idx] / self.sampler.iter_num
         self.last_modified[idx] = self.sampler.iter_num
+        self.present[idx] = True
 
-    def edge_removed(self, edge :GraphEdge) -> None:
-        idx = self.sampler.edge_set.get_id(edge)
+    def edge_removed(self, edge_id :int) -> None:
+        idx = edge_id
         self.val[idx] =\
             (self.val[idx] * self.last_modified[idx] +\
              (self.sampler.iter_num - self.last_modified[idx])) /\
             self.sampler.iter_num
         self.last_modified[idx] = self.sampler.iter_num
+        self.present[idx] = False
+
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        if self.sampler.iter_num == 0:
+            return
+        self.val, change = _average_with_changes(
+            self.val, self.last_modified, self.present, edge_ids, signs,
+            iter_nums, self.sampler.iter_num)
+        self.present = (self.present + change) > 0
+        self.last_modified.fill(self.sampler.iter_num)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> np.ndarray:
+        return edge_marginals
+
+
+class RaoBlackwellEdgeFrequencyStatistic(EdgeStatistic):
+    '''The expected frequency of each edge, estimated as the average over
+       every `interval`-th iteration of the conditional probability that
+       the edge is the parent edge of its target, given the parents of all
+       other nodes. The alternatives are the other ingoing edges of
+       the target that do not create a cycle and the target being a root.
+       Converges faster than EdgeFrequencyStatistic, especially for edges
+       competing for the same target. Valid only without the depth cost.
+
+       The interval is rounded up to a multiple of the diagnostic interval
+       of the sampler, at which the batches of moves end (the branching
+       is read in next_iter()).'''
+    checkpoint_attrs = ('val', 'num_samples')
+
+    def __init__(self, sampler :'MCMCGraphSampler',
+                 interval :int = 1000) -> None:
+        super().__init__(sampler)
+        step = getattr(sampler, 'diagnostic_interval', 1)
+        self.interval = -(-max(interval, 1) // step) * step
+
+    def reset(self) -> None:
+        self.val = np.zeros(len(self.sampler.edge_set))
+        self.num_samples = 0
+
+    def update(self) -> None:
+        if self.num_samples == 0:
+            self.add_sample()
+
+    def edge_added(self, edge_id :int) -> None:
+        pass
+
+    def edge_removed(self, edge_id :int) -> None:
+        pass
+
+    def next_iter(self) -> None:
+        if self.sampler.iter_num % self.interval == 0:
+            self.add_sample()
+
+    def add_sample(self) -> None:
+        '''Add the conditional probabilities of the edges given
+           the current branching to the average.'''
+        sampler = self.sampler
+        edge_ids = sampler.proposal_edge_ids
+        if edge_ids is None:
+            edge_ids = np.arange(len(sampler.edge_set))
+        source_ids = sampler.edge_source_ids[edge_ids]
+        target_ids = sampler.edge_target_ids[edge_ids]
+        # an edge creates a cycle if its target is an ancestor of
+        # its source (or the source itself)
+        depths, jumps = sampler.branching.ancestor_index()
+        distances = depths[source_ids] - depths[target_ids]
+        creates_cycle = (distances >= 0) & \
+            (sampler.branching.ancestors_at_distance(
+                 jumps, source_ids, np.maximum(distances, 0)) == target_ids)
+        # the log-weights relative to the target being a root
+        log_weights = np.where(creates_cycle, -np.inf,
+                               -sampler.edge_delta_cache[edge_ids])
+        max_log_weights = np.zeros(len(depths))
+        np.maximum.at(max_log_weights, target_ids, log_weights)
+        weights = np.exp(log_weights - max_log_weights[target_ids])
+        norm = np.exp(-max_log_weights) + \
+               np.bincount(target_ids, weights=weights, minlength=len(depths))
+        self.val[edge_ids] = \
+            (self.val[edge_ids] * self.num_samples + \
+             weights / norm[target_ids]) / (self.num_samples+1)
+        self.num_samples += 1
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> np.ndarray:
+        return edge_marginals
 
 
 class UnorderedWordPairStatistic(MCMCStatistic):
-    def key_from_edge(edge :GraphEdge) -> Tuple[LexiconEntry, LexiconEntry]:
-        if edge.source < edge.target:
-            return (edge.source, edge.target)
-        else:
-            return (edge.target, edge.source)
+    '''A statistic with a value for every unordered pair of words
+       connected by an edge (see MCMCGraphSampler.word_pair_index()).'''
+
+    checkpoint_attrs = ('values', 'last_modified')
+
+    def __init__(self, sampler :'MCMCGraphSampler') -> None:
+        super().__init__(sampler)
+        self.pair_keys, self.edge_pair_ids = sampler.word_pair_index()
 
     def reset(self) -> None:
-        self.values = np.zeros(len(self.sampler.unordered_word_pair_index))
-        self.last_modified =\
-            np.zeros(len(self.sampler.unordered_word_pair_index),
-                     dtype=np.int64)
+        self.values = np.zeros(len(self.pair_keys))
+        self.last_modified = np.zeros(len(self.pair_keys), dtype=np.int64)
     
     def update(self) -> None:
         raise NotImplementedError()
 
-    def edge_added(self, edge :GraphEdge) -> None:
+    def edge_added(self, edge_id :int) -> None:
         raise NotImplementedError()
 
-    def edge_removed(self, edge :GraphEdge) -> None:
+    def edge_removed(self, edge_id :int) -> None:
         raise NotImplementedError()
 
     def next_iter(self):
         pass
     
-    def value(self, key :Tuple[LexiconEntry, LexiconEntry]) -> float:
-        idx = self.sampler.unordered_word_pair_index[key]
-        return self.values[idx]
+    def value(self, key :Tuple[int, int]) -> float:
+        'Return the value for a pair of words given by lexicon IDs.'
+        packed_key = self.sampler.word_pair_keys(*key)
+        idx = int(np.searchsorted(self.pair_keys, packed_key))
+        if idx >= len(self.pair_keys) or self.pair_keys[idx] != packed_key:
+            raise KeyError(key)
+        return float(self.values[idx])
+
+    def state(self) -> np.ndarray:
+        return self.values
+
+    def merge(self, states :List[np.ndarray],
+              weights :List[float] = None) -> None:
+        self.values, self.chain_var = _mean_and_chain_var(states, weights)
+
+    def component_state(self, edge_ids :np.ndarray) -> np.ndarray:
+        return self.values[self.edge_pair_ids[edge_ids]]
+
+    def merge_components(self, states :List[np.ndarray],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        for state, part_edge_ids in zip(states, edge_ids):
+            self.values[self.edge_pair_ids[part_edge_ids]] = state
 
 
 class UndirectedEdgeFrequencyStatistic(UnorderedWordPairStatistic):
+    journaled = True
+
+    def reset(self) -> None:
+        super().reset()
+        # number of edges between each word pair in the current branching
+        self.present_count = np.zeros(len(self.values), dtype=np.int64)
+        branching = getattr(self.sampler, 'branching', None)
+        if branching is not None:
+            np.add.at(self.present_count,
+                      self.edge_pair_ids[branching.edge_ids()], 1)
+
     def update(self) -> None:
-        for edge in self.sampler.edge_set:
-            if self.sampler.branching.has_edge(\
-                        edge.source, edge.target, edge.rule):
-                # not really removing -- just accounting for the fact that
-                # the edge was present in the last graphs
-                self.edge_removed(edge)
-            elif self.sampler.branching.has_edge(edge.source, edge.target) or \
-                 self.sampler.branching.has_edge(edge.target, edge.source):
-                pass
-            else:
-                # not really adding -- just accounting for the fact that
-                # the edge was absent in the last graphs
-                self.edge_added(edge)
-
-    def edge_added(self, edge :GraphEdge) -> None:
-        key = UnorderedWordPairStatistic.key_from_edge(edge)
-        idx = self.sampler.unordered_word_pair_index[key]
+        iter_num = self.sampler.iter_num
+        if iter_num == 0:
+            return
+        self.values = (self.values * self.last_modified +\
+                       (self.present_count > 0) *\
+                       (iter_num - self.last_modified)) / iter_num
+        self.last_modified.fill(iter_num)
+
+    def edge_added(self, edge_id :int) -> None:
+        idx = self.edge_pair_ids[edge_id]
+        self.present_count[idx] += 1
+        if self.present_count[idx] > 1:
+            # the pair was already present
+            return
         self.values[idx] =\
             self.values[idx] * self.last_modified[idx] / self.sampler.iter_num
         self.last_modified[idx] = self.sampler.iter_num
 
-    def edge_removed(self, edge :GraphEdge) -> None:
-        key = UnorderedWordPairStatistic.key_from_edge(edge)
-        idx = self.sampler.unordered_word_pair_index[key]
+    def edge_removed(self, edge_id :int) -> None:
+        idx = self.edge_pair_ids[edge_id]
+        self.present_count[idx] -= 1
+        if self.present_count[idx] > 0:
+            # the pair is still present
+            return
         self.values[idx] =\
             (self.values[idx] * self.last_modified[idx] +\
              (self.sampler.iter_num - self.last_modified[idx])) /\
             self.sampler.iter_num
         self.last_modified[idx] = self.sampler.iter_num
 
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        if self.sampler.iter_num == 0:
+            return
+        # between iterations, at most one edge between a pair of words
+        # is present, so the counts can be averaged directly
+        self.values, change = _average_with_changes(
+            self.values, self.last_modified, self.present_count,
+            self.edge_pair_ids[edge_ids], signs, iter_nums,
+            self.sampler.iter_num)
+        self.present_count += change.astype(np.int64)
+        self.last_modified.fill(self.sampler.iter_num)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> np.ndarray:
+        # at most one edge between a pair of words is present at a time
+        idx = np.unique(self.edge_pair_ids[edge_ids],
+                        return_inverse=True)[1]
+        return np.bincount(idx, weights=edge_marginals)[idx]
+
 
 class RuleStatistic(MCMCStatistic):
+    checkpoint_attrs = ('val', 'last_modified')
+
     def reset(self) -> None:
         self.val = np.zeros(len(self.sampler.rule_set))
         self.last_modified = np.zeros(len(self.sampler.rule_set), 
                                       dtype=np.int64)
     
     def update(self) -> None:
-        for rule in self.sampler.rule_set:
-            self.update_rule(rule)
+        for idx in range(len(self.sampler.rule_set)):
+            self.update_rule_id(idx)
     
     def update_rule(self, rule :Rule) -> None:
+        self.update_rule_id(self.sampler.rule_set.get_id(rule))
+
+    def update_rule_id(self, idx :int) -> None:
         raise NotImplementedError()
 
     def value(self) -> np.ndarray:
@@ -251,6 +740,19 @@ class RuleStatistic(MCMCStatistic):
     
     def value_at(self, rule :Rule) -> float:
         return self.val[self.sampler.rule_set.get_id(rule)]
+
+    def state(self) -> np.ndarray:
+        return self.val
+
+    def merge(self, states :List[np.ndarray],
+              weights :List[float] = None) -> None:
+        self.val, self.chain_var = _mean_and_chain_var(states, weights)
+
+    def merge_components(self, states :List[np.ndarray],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        # the edges of a rule are distributed among the parts
+        self.val = np.sum(states, axis=0)
 # 
 #     TODO deprecated
 #     def values_dict(self) -> Dict[Rule, float]:
@@ -261,8 +763,10 @@ class RuleStatistic(MCMCStatistic):
 
 
 class RuleFrequencyStatistic(RuleStatistic):
-    def update_rule(self, rule :Rule) -> None:
-        idx = self.sampler.rule_set.get_id(rule)
+    checkpoint_attrs = ('val', 'last_modified', 'current_count')
+    journaled = True
+
+    def update_rule_id(self, idx :int) -> None:
         self.val[idx] = \
             (self.val[idx] * self.last_modified[idx] +\
              self.current_count[idx] * (self.sampler.iter_num - self.last_modified[idx])) /\
@@ -274,34 +778,91 @@ class RuleFrequencyStatistic(RuleStatistic):
         self.current_count = np.zeros(len(self.sampler.rule_set),
                                       dtype=np.int32)
         for rule in self.sampler.rule_set:
-            edges = self.sampler.branching.get_edges_for_rule(rule)
-            self.current_count[self.sampler.rule_set.get_id(rule)] = len(edges)
+            self.current_count[self.sampler.rule_set.get_id(rule)] = \
+                self.sampler.branching.num_edges_for_rule(rule)
     
-    def edge_added(self, edge :GraphEdge) -> None:
-        self.update_rule(edge.rule)
-        self.current_count[self.sampler.rule_set.get_id(edge.rule)] += 1
-
-    def edge_removed(self, edge :GraphEdge) -> None:
-        self.update_rule(edge.rule)
-        self.current_count[self.sampler.rule_set.get_id(edge.rule)] -= 1
+    def edge_added(self, edge_id :int) -> None:
+        idx = self.sampler.edge_rule_ids[edge_id]
+        self.update_rule_id(idx)
+        self.current_count[idx] += 1
+
+    def edge_removed(self, edge_id :int) -> None:
+        idx = self.sampler.edge_rule_ids[edge_id]
+        self.update_rule_id(idx)
+        self.current_count[idx] -= 1
+
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        if self.sampler.iter_num == 0:
+            return
+        self.val, change = _average_with_changes(
+            self.val, self.last_modified, self.current_count,
+            self.sampler.edge_rule_ids[edge_ids], signs, iter_nums,
+            self.sampler.iter_num)
+        self.current_count += change.astype(self.current_count.dtype)
+        self.last_modified.fill(self.sampler.iter_num)
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> np.ndarray:
+        return np.bincount(self.sampler.edge_rule_ids[edge_ids],
+                           weights=edge_marginals,
+                           minlength=len(self.sampler.rule_set))
 
 
 class RuleExpectedContributionStatistic(RuleStatistic):
-    def update_rule(self, rule :Rule) -> None:
-        idx = self.sampler.rule_set.get_id(rule)
-        if self.last_modified[idx] < self.sampler.iter_num:
-            edges = self.sampler.branching.get_edges_for_rule(rule)
-            new_value = self.sampler.cost_of_change([], edges) -\
-                self.sampler.model.rule_cost(rule)
-            self.val[idx] = \
-                (self.val[idx] * self.last_modified[idx] +\
-                 new_value * (self.sampler.iter_num - self.last_modified[idx])) /\
-                self.sampler.iter_num
-            self.last_modified[idx] = self.sampler.iter_num
-    
-    def edge_added(self, edge :GraphEdge) -> None:
-        self.update_rule(edge.rule)
+    checkpoint_attrs = ('val', 'last_modified', 'current_value')
+    journaled = True
 
-    def edge_removed(self, edge :GraphEdge) -> None:
-        self.update_rule(edge.rule)
+    def update_rule_id(self, idx :int) -> None:
+        self.val[idx] = \
+            (self.val[idx] * self.last_modified[idx] +\
+             self.current_value[idx] * (self.sampler.iter_num - self.last_modified[idx])) /\
+            self.sampler.iter_num
+        self.last_modified[idx] = self.sampler.iter_num
 
+    def reset(self) -> None:
+        super().reset()
+        self.rule_costs = self.sampler.model.rules_cost(self.sampler.rule_set)
+        # the contribution of each rule in the current branching
+        self.current_value = -self.rule_costs
+        edge_ids = self.sampler.branching.edge_ids()
+        np.subtract.at(self.current_value,
+                       self.sampler.edge_rule_ids[edge_ids],
+                       self.sampler.edge_delta_cache[edge_ids])
+
+    def edge_added(self, edge_id :int) -> None:
+        idx = self.sampler.edge_rule_ids[edge_id]
+        self.update_rule_id(idx)
+        self.current_value[idx] -= self.sampler.edge_delta_cache[edge_id]
+
+    def edge_removed(self, edge_id :int) -> None:
+        idx = self.sampler.edge_rule_ids[edge_id]
+        self.update_rule_id(idx)
+        self.current_value[idx] += self.sampler.edge_delta_cache[edge_id]
+
+    def flush(self, iter_nums :np.ndarray, edge_ids :np.ndarray,
+              signs :np.ndarray, logls :np.ndarray) -> None:
+        if self.sampler.iter_num == 0:
+            return
+        self.val, change = _average_with_changes(
+            self.val, self.last_modified, self.current_value,
+            self.sampler.edge_rule_ids[edge_ids],
+            -signs * self.sampler.edge_delta_cache[edge_ids], iter_nums,
+            self.sampler.iter_num)
+        self.current_value += change
+        self.last_modified.fill(self.sampler.iter_num)
+
+    def merge_components(self, states :List[np.ndarray],
+                         edge_ids :List[np.ndarray],
+                         weights :List[float] = None) -> None:
+        # the cost of the rule is included in the state of every part
+        self.val = np.sum(states, axis=0) + (len(states)-1) * self.rule_costs
+
+    def exact_state(self, edge_ids :np.ndarray,
+                    edge_marginals :np.ndarray) -> np.ndarray:
+        rule_costs = self.sampler.model.rules_cost(self.sampler.rule_set)
+        return -rule_costs - \
+               np.bincount(self.sampler.edge_rule_ids[edge_ids],
+                           weights=edge_marginals *\
+                                   self.sampler.edge_delta_cache[edge_ids],
+                           minlength=len(self.sampler.rule_set))
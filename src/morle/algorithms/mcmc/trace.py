@@ -0,0 +1,145 @@
+'''Streaming the values of the iteration statistics to a trace file during
+   sampling: a TSV file with a header line and a line for every recorded
+   iteration. The file grows while the sampler is running, so that
+   the convergence can be followed live (e.g. with `tail -f`), and
+   the values do not have to be kept in memory.'''
+
+from morle.utils.files import full_path, open_to_read, open_to_write
+
+import itertools
+import numpy as np
+import os
+import queue
+import threading
+from typing import List
+
+
+class TraceWriter:
+    '''Rows of the form (iteration number, values of the statistics) are
+       copied into a preallocated ring of `num_blocks` blocks of
+       `block_size` rows and appended to the file by a background thread,
+       while the sampler continues. If the thread falls behind, write()
+       waits for a free block, so the memory used is constant.
+
+       An error in the background thread is raised by the next call of
+       write(), flush() or close().'''
+
+    # the interval (in seconds) in which a waiting call checks whether
+    # the background thread is still running
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, filename :str, columns :List[str],
+                 block_size :int = 4096, num_blocks :int = 4,
+                 append :bool = False) -> None:
+        self.block_size = block_size
+        self.num_blocks = num_blocks
+        # the first column is the iteration number
+        self.blocks = np.empty((num_blocks, block_size, len(columns)+1))
+        self.fmt = '\t'.join(['%d'] + ['%.15g'] * len(columns))
+        self.free_blocks = queue.Queue()      # type: queue.Queue
+        self.full_blocks = queue.Queue()      # type: queue.Queue
+        for i in range(num_blocks):
+            self.free_blocks.put(i)
+        # the exception raised in the background thread (if any)
+        self.error = None                     # type: Exception
+        self.fp = open_to_write(filename, 'a' if append else 'w')
+        if not append:
+            self.fp.write('\t'.join(['iter_num'] + columns) + '\n')
+            self.fp.flush()
+        self.thread = threading.Thread(target=self._write_blocks,
+                                       daemon=True)
+        self.thread.start()
+
+    def write(self, iter_nums :np.ndarray, values :np.ndarray) -> None:
+        '''Append rows to the file. `values` has a column for every
+           statistic.'''
+        self._check_error()
+        for start in range(0, len(iter_nums), self.block_size):
+            end = min(start+self.block_size, len(iter_nums))
+            i = self._get_free_block()
+            self.blocks[i,:end-start,0] = iter_nums[start:end]
+            self.blocks[i,:end-start,1:] = values[start:end]
+            self.full_blocks.put((i, end-start))
+
+    def flush(self) -> None:
+        'Wait until all rows passed to write() are in the file.'
+        # all blocks are free once the background thread is done with them
+        blocks = [self._get_free_block() for i in range(self.num_blocks)]
+        for i in blocks:
+            self.free_blocks.put(i)
+        self._check_error()
+
+    def close(self) -> None:
+        self.full_blocks.put(None)
+        self.thread.join()
+        self.fp.close()
+        self._check_error()
+
+    def _check_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def _get_free_block(self) -> int:
+        while True:
+            self._check_error()
+            try:
+                return self.free_blocks.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                if not self.thread.is_alive():
+                    raise RuntimeError('The trace writer has stopped.')
+
+    def _write_blocks(self) -> None:
+        while True:
+            item = self.full_blocks.get()
+            if item is None:
+                break
+            i, size = item
+            # after an error, the blocks are only returned, so that
+            # the waiting calls can raise it
+            if self.error is None:
+                try:
+                    np.savetxt(self.fp, self.blocks[i,:size], fmt=self.fmt)
+                    self.fp.flush()
+                except Exception as e:
+                    self.error = e
+            self.free_blocks.put(i)
+
+
+class TraceReader:
+    '''Reads a trace file in blocks of at most `block_size` rows, so that
+       the file does not have to fit in memory (used to merge the traces of
+       several chains).'''
+
+    def __init__(self, filename :str, block_size :int = 4096) -> None:
+        self.block_size = block_size
+        self.fp = open_to_read(filename)
+        # the names of the statistics (without the iteration number)
+        self.columns = self.fp.readline().rstrip('\n').split('\t')[1:]
+
+    def read(self) -> np.ndarray:
+        '''Return the values of the statistics from the next block of
+           rows, with a column for every statistic (no rows at the end of
+           the file).'''
+        lines = list(itertools.islice(self.fp, self.block_size))
+        if not lines:
+            return np.empty((0, len(self.columns)))
+        return np.loadtxt(lines, delimiter='\t', ndmin=2)[:,1:]
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+def trace_file_size(filename :str) -> int:
+    '''Return the size of a trace file in bytes (0 if it does not
+       exist).'''
+    path = full_path(filename)
+    if not os.path.exists(path):
+        return 0
+    return os.path.getsize(path)
+
+
+def truncate_trace_file(filename :str, size :int) -> None:
+    '''Discard the rows after the first `size` bytes (e.g. those written
+       after the checkpoint from which sampling is resumed).'''
+    with open(full_path(filename), 'r+b') as fp:
+        fp.truncate(size)
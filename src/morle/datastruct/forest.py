@@ -0,0 +1,187 @@
+from typing import List
+
+
+class LinkCutForest:
+    '''A dynamic forest over nodes numbered 0..n-1, implemented as
+       link-cut trees (Sleator & Tarjan) with virtual subtree aggregates.
+
+       Supports linking a tree root as a child of another node, cutting
+       a node from its parent, and queries for the root, the depth,
+       the k-th ancestor and the sum of node values (as well as the number
+       of nodes) in the subtree of a node. All operations run in amortized
+       O(log n) time, independently of the shape of the trees.
+
+       The preferred paths are stored as splay trees ordered by depth.
+       `parent` holds either the splay tree parent or, for the root of
+       a splay tree, the path-parent pointer.'''
+
+    def __init__(self, num_nodes :int) -> None:
+        self.left = [-1] * num_nodes        # type: List[int]
+        self.right = [-1] * num_nodes       # type: List[int]
+        self.parent = [-1] * num_nodes      # type: List[int]
+        # node values and the sums over virtual (non-preferred) children
+        self.value = [0] * num_nodes        # type: List[int]
+        self.virtual_value = [0] * num_nodes
+        self.virtual_count = [0] * num_nodes
+        # aggregates over the splay subtree (size = number of path nodes,
+        # total_* = including the virtual subtrees)
+        self.size = [1] * num_nodes
+        self.total_value = [0] * num_nodes
+        self.total_count = [1] * num_nodes
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def link(self, child :int, parent :int) -> None:
+        'Attach a tree root `child` as a child of `parent`.'
+        self._access(child)
+        if self.left[child] >= 0:
+            raise ValueError('Node {} is not a root.'.format(child))
+        self._access(parent)
+        self.parent[child] = parent
+        self.virtual_value[parent] += self.total_value[child]
+        self.virtual_count[parent] += self.total_count[child]
+        self._update(parent)
+
+    def cut(self, child :int) -> None:
+        'Detach `child` (together with its subtree) from its parent.'
+        self._access(child)
+        l = self.left[child]
+        if l < 0:
+            raise ValueError('Node {} is a root.'.format(child))
+        self.parent[l] = -1
+        self.left[child] = -1
+        self._update(child)
+
+    def set_value(self, v :int, value :int) -> None:
+        self._access(v)
+        self.value[v] = value
+        self._update(v)
+
+    def root(self, v :int) -> int:
+        self._access(v)
+        x = v
+        while self.left[x] >= 0:
+            x = self.left[x]
+        self._splay(x)
+        return x
+
+    def depth(self, v :int) -> int:
+        'The depth of a node (roots have depth 1).'
+        self._access(v)
+        return self.size[v]
+
+    def ancestor_at_depth(self, v :int, depth :int) -> int:
+        'Return the ancestor of `v` at the given depth (or -1 if none).'
+        self._access(v)
+        if depth < 1 or depth > self.size[v]:
+            return -1
+        x, k = v, depth
+        while True:
+            l = self.left[x]
+            left_size = self.size[l] if l >= 0 else 0
+            if k <= left_size:
+                x = l
+            elif k == left_size + 1:
+                break
+            else:
+                k -= left_size + 1
+                x = self.right[x]
+        self._splay(x)
+        return x
+
+    def is_ancestor(self, u :int, v :int) -> bool:
+        'Check whether `u` is an ancestor of `v` (or the same node).'
+        if u == v:
+            return True
+        depth_u = self.depth(u)
+        return depth_u < self.depth(v) and \
+               self.ancestor_at_depth(v, depth_u) == u
+
+    def subtree_value(self, v :int) -> int:
+        'The sum of node values in the subtree rooted in `v`.'
+        self._access(v)
+        return self.value[v] + self.virtual_value[v]
+
+    def subtree_size(self, v :int) -> int:
+        self._access(v)
+        return 1 + self.virtual_count[v]
+
+    def _is_splay_root(self, x :int) -> bool:
+        p = self.parent[x]
+        return p < 0 or (self.left[p] != x and self.right[p] != x)
+
+    def _update(self, x :int) -> None:
+        l, r = self.left[x], self.right[x]
+        size = 1
+        total_value = self.value[x] + self.virtual_value[x]
+        total_count = 1 + self.virtual_count[x]
+        if l >= 0:
+            size += self.size[l]
+            total_value += self.total_value[l]
+            total_count += self.total_count[l]
+        if r >= 0:
+            size += self.size[r]
+            total_value += self.total_value[r]
+            total_count += self.total_count[r]
+        self.size[x] = size
+        self.total_value[x] = total_value
+        self.total_count[x] = total_count
+
+    def _rotate(self, x :int) -> None:
+        p = self.parent[x]
+        g = self.parent[p]
+        if self.left[p] == x:
+            b = self.right[x]
+            self.left[p] = b
+            self.right[x] = p
+        else:
+            b = self.left[x]
+            self.right[p] = b
+            self.left[x] = p
+        if b >= 0:
+            self.parent[b] = p
+        if g >= 0:
+            # if p is the root of its splay tree, g is a path-parent
+            # and its children stay unchanged
+            if self.left[g] == p:
+                self.left[g] = x
+            elif self.right[g] == p:
+                self.right[g] = x
+        self.parent[x] = g
+        self.parent[p] = x
+        self._update(p)
+        self._update(x)
+
+    def _splay(self, x :int) -> None:
+        while not self._is_splay_root(x):
+            p = self.parent[x]
+            if not self._is_splay_root(p):
+                g = self.parent[p]
+                if (self.left[g] == p) == (self.left[p] == x):
+                    self._rotate(p)
+                else:
+                    self._rotate(x)
+            self._rotate(x)
+
+    def _access(self, v :int) -> int:
+        '''Make the path from the root to `v` preferred and splay `v`
+           to the root of its splay tree. Return the last node at which
+           the path was joined.'''
+        last, x = -1, v
+        while x >= 0:
+            self._splay(x)
+            r = self.right[x]
+            # the former preferred child becomes virtual and vice versa
+            if r >= 0:
+                self.virtual_value[x] += self.total_value[r]
+                self.virtual_count[x] += self.total_count[r]
+            if last >= 0:
+                self.virtual_value[x] -= self.total_value[last]
+                self.virtual_count[x] -= self.total_count[last]
+            self.right[x] = last
+            self._update(x)
+            last, x = x, self.parent[x]
+        self._splay(v)
+        return last
+
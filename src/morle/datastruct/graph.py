@@ -1,3 +1,4 @@
+from morle.datastruct.forest import LinkCutForest
 from morle.datastruct.lexicon import Lexicon, LexiconEntry
 from morle.datastruct.rules import Rule, RuleSet
 from morle.utils.files import open_to_write, read_tsv_file, write_line
@@ -8,6 +9,8 @@ import logging
 import networkx as nx
 import numpy as np
 import random
+import scipy.sparse.csgraph
+from scipy.sparse import coo_matrix
 from typing import Dict, Iterable, List, Set, Tuple, Union
 
 
@@ -53,6 +56,8 @@ class EdgeSet:
         self.index = {}               # type: Dict[GraphEdge, int]
         self.edge_ids_by_rule = {}    # type: Dict[Rule, List[int]]
         self.next_id = 0
+        self._source_ids = None       # type: np.ndarray
+        self._target_ids = None       # type: np.ndarray
         if edges is not None:
             self.add(edges)
 
@@ -74,6 +79,7 @@ class EdgeSet:
     def add(self, edges :Union[GraphEdge, Iterable[GraphEdge]]) -> None:
         if isinstance(edges, GraphEdge):
             edges = [edges]
+        self._source_ids, self._target_ids = None, None
         for edge in edges:
             self.items.append(edge)
             self.index[edge] = self.next_id
@@ -98,6 +104,7 @@ class EdgeSet:
                 self.edge_ids_by_rule[edge.rule] = []
             self.edge_ids_by_rule[edge.rule].append(i)
         self.next_id = len(self.items)
+        self._source_ids, self._target_ids = None, None
         logging.getLogger('main').debug('Number of edges after deletion: {}'\
                                         .format(len(self.items)))
 
@@ -107,6 +114,22 @@ class EdgeSet:
     def get_edge_ids_by_rule(self) -> Dict[Rule, List[int]]:
         return self.edge_ids_by_rule
 
+    def source_ids(self) -> np.ndarray:
+        'Lexicon IDs of the source nodes, indexed by edge ID.'
+        if self._source_ids is None:
+            self._source_ids = np.array(
+                [self.lexicon.get_id(edge.source) for edge in self.items],
+                dtype=np.int64)
+        return self._source_ids
+
+    def target_ids(self) -> np.ndarray:
+        'Lexicon IDs of the target nodes, indexed by edge ID.'
+        if self._target_ids is None:
+            self._target_ids = np.array(
+                [self.lexicon.get_id(edge.target) for edge in self.items],
+                dtype=np.int64)
+        return self._target_ids
+
     def save(self, filename :str) -> None:
         with open_to_write(filename) as fp:
             for edge in self.__iter__():
@@ -240,6 +263,331 @@ class Branching(Graph):
         return self.edges_by_rule[rule]
 
 
+class ArrayBranching:
+    '''A branching over the nodes and edges of a FullGraph, stored as
+       arrays indexed by integer IDs (lexicon IDs for nodes, edge set IDs
+       for edges): the ingoing edge of every node, doubly-linked lists
+       of outgoing edges and the number of edges per rule.
+
+       Provides the interface of Branching, as well as ID-based variants
+       of the methods (suffixed with `_id`), which avoid hashing of
+       lexicon entries and edges.
+
+       If `dynamic_index` is set, the trees are additionally maintained
+       in a LinkCutForest, so that root, depth, path and subtree queries
+       take O(log n) instead of O(depth) or O(subtree size).'''
+
+    def __init__(self, full_graph :'FullGraph',
+                 dynamic_index :bool = False) -> None:
+        self.full_graph = full_graph
+        self.lexicon = full_graph.lexicon
+        self.edge_set = full_graph.edge_set
+        num_nodes, num_edges = len(self.lexicon), len(self.edge_set)
+        self.edge_source = self.edge_set.source_ids()
+        self.edge_target = self.edge_set.target_ids()
+        self.rules = list(self.edge_set.get_edge_ids_by_rule().keys())
+        self.rule_index = { rule : i for i, rule in enumerate(self.rules) }
+        self.edge_rule = np.empty(num_edges, dtype=np.int64)
+        self.edge_ids_by_rule = []      # type: List[np.ndarray]
+        for i, rule in enumerate(self.rules):
+            edge_ids = np.array(self.edge_set.get_edge_ids_by_rule()[rule],
+                                dtype=np.int64)
+            self.edge_rule[edge_ids] = i
+            self.edge_ids_by_rule.append(edge_ids)
+        # parent_edge[v] -- ID of the edge ingoing to v (-1 if v is a root)
+        self.parent_edge = np.full(num_nodes, -1, dtype=np.int64)
+        # outgoing edges of every node as a doubly-linked list
+        self.first_child_edge = np.full(num_nodes, -1, dtype=np.int64)
+        self.next_sibling_edge = np.full(num_edges, -1, dtype=np.int64)
+        self.prev_sibling_edge = np.full(num_edges, -1, dtype=np.int64)
+        self.num_children = np.zeros(num_nodes, dtype=np.int64)
+        self.rule_count = np.zeros(len(self.rules), dtype=np.int64)
+        self.num_edges = 0
+        # node values in the forest: 1 for non-leaves, 0 for leaves
+        self.forest = LinkCutForest(num_nodes) if dynamic_index else None
+
+    # ID-based interface
+
+    def has_edge_id(self, e_id :int) -> bool:
+        return self.parent_edge[self.edge_target[e_id]] == e_id
+
+    def parent_id(self, v_id :int) -> int:
+        e_id = self.parent_edge[v_id]
+        return -1 if e_id < 0 else int(self.edge_source[e_id])
+
+    def root_id(self, v_id :int) -> int:
+        if self.forest is not None:
+            return self.forest.root(int(v_id))
+        e_id = self.parent_edge[v_id]
+        while e_id >= 0:
+            v_id = self.edge_source[e_id]
+            e_id = self.parent_edge[v_id]
+        return int(v_id)
+
+    def ancestor_index(self) -> Tuple[np.ndarray, List[np.ndarray]]:
+        '''Compute the depth of every node and the tables of ancestors
+           at distances 1, 2, 4, ... (a root being its own ancestor),
+           for vectorized queries about many nodes at once. The last table
+           contains the roots.'''
+        ancestors = np.arange(len(self.parent_edge))
+        has_parent = self.parent_edge >= 0
+        ancestors[has_parent] = self.edge_source[self.parent_edge[has_parent]]
+        depths = has_parent.astype(np.int64)
+        jumps = [ancestors]
+        # pointer jumping: the distance covered doubles in every step
+        while True:
+            depths += depths[ancestors]
+            ancestors = ancestors[ancestors]
+            if np.array_equal(ancestors, jumps[-1]):
+                return depths + 1, jumps
+            jumps.append(ancestors)
+
+    @staticmethod
+    def ancestors_at_distance(jumps :List[np.ndarray], v_ids :np.ndarray,
+                              distances :np.ndarray) -> np.ndarray:
+        '''Return the ancestors of the given nodes at the given distances
+           (at most the depth of the node minus 1), using the tables
+           computed by ancestor_index().'''
+        for k, jump in enumerate(jumps):
+            v_ids = np.where((distances >> k) & 1, jump[v_ids], v_ids)
+        return v_ids
+
+    def depth_id(self, v_id :int) -> int:
+        if self.forest is not None:
+            return self.forest.depth(int(v_id))
+        result = 1
+        e_id = self.parent_edge[v_id]
+        while e_id >= 0:
+            result += 1
+            e_id = self.parent_edge[self.edge_source[e_id]]
+        return result
+
+    def has_path_id(self, source_id :int, target_id :int) -> bool:
+        'Check whether source is an ancestor of target (or the same node).'
+        if self.forest is not None:
+            return self.forest.is_ancestor(int(source_id),
+                                           int(target_id))
+        v_id = target_id
+        while v_id != source_id:
+            e_id = self.parent_edge[v_id]
+            if e_id < 0:
+                return False
+            v_id = self.edge_source[e_id]
+        return True
+
+    def ancestor_at_depth_id(self, v_id :int, depth :int) -> int:
+        'Return the ancestor of v at the given depth (the root has depth 1).'
+        if self.forest is not None:
+            return self.forest.ancestor_at_depth(int(v_id), depth)
+        for i in range(self.depth_id(v_id) - depth):
+            v_id = self.edge_source[self.parent_edge[v_id]]
+        return int(v_id)
+
+    def child_edge_ids(self, v_id :int) -> List[int]:
+        result = []
+        e_id = self.first_child_edge[v_id]
+        while e_id >= 0:
+            result.append(int(e_id))
+            e_id = self.next_sibling_edge[e_id]
+        return result
+
+    def children_ids(self, v_id :int) -> List[int]:
+        return [int(self.edge_target[e_id]) \
+                for e_id in self.child_edge_ids(v_id)]
+
+    def subtree_ids(self, v_id :int) -> List[int]:
+        'List the nodes of the subtree rooted in v in depth-first order.'
+        result, stack = [], [v_id]
+        while stack:
+            node_id = stack.pop()
+            result.append(node_id)
+            stack.extend(self.children_ids(node_id))
+        return result
+
+    def subtree_size_id(self, v_id :int) -> int:
+        if self.forest is not None:
+            return self.forest.subtree_size(int(v_id))
+        return len(self.subtree_ids(v_id))
+
+    def count_nonleaves_id(self, v_id :int) -> int:
+        if self.forest is not None:
+            return self.forest.subtree_value(int(v_id))
+        return sum(1 for node_id in self.subtree_ids(v_id) \
+                     if self.num_children[node_id] > 0)
+
+    def height_id(self, v_id :int) -> int:
+        result, stack = 0, [(v_id, 1)]
+        while stack:
+            node_id, h = stack.pop()
+            result = max(result, h)
+            stack.extend((child_id, h+1) \
+                         for child_id in self.children_ids(node_id))
+        return result
+
+    def is_edge_possible_id(self, e_id :int) -> bool:
+        source_id, target_id = self.edge_source[e_id], self.edge_target[e_id]
+        return source_id != target_id and \
+               self.parent_edge[target_id] < 0 and \
+               not self.has_path_id(target_id, source_id)
+
+    def add_edge_id(self, e_id :int) -> None:
+        source_id, target_id = self.edge_source[e_id], self.edge_target[e_id]
+        if self.parent_edge[target_id] >= 0:
+            raise Exception('More than one predecessor: {}'\
+                            .format(self.lexicon[int(target_id)]))
+        self.parent_edge[target_id] = e_id
+        first = self.first_child_edge[source_id]
+        self.next_sibling_edge[e_id] = first
+        self.prev_sibling_edge[e_id] = -1
+        if first >= 0:
+            self.prev_sibling_edge[first] = e_id
+        self.first_child_edge[source_id] = e_id
+        self.num_children[source_id] += 1
+        self.rule_count[self.edge_rule[e_id]] += 1
+        self.num_edges += 1
+        if self.forest is not None:
+            self.forest.link(int(target_id), int(source_id))
+            if self.num_children[source_id] == 1:
+                self.forest.set_value(int(source_id), 1)
+
+    def remove_edge_id(self, e_id :int) -> None:
+        source_id, target_id = self.edge_source[e_id], self.edge_target[e_id]
+        if self.parent_edge[target_id] != e_id:
+            raise KeyError(self.edge_set[int(e_id)])
+        self.parent_edge[target_id] = -1
+        prev, next_ = self.prev_sibling_edge[e_id], self.next_sibling_edge[e_id]
+        if prev >= 0:
+            self.next_sibling_edge[prev] = next_
+        else:
+            self.first_child_edge[source_id] = next_
+        if next_ >= 0:
+            self.prev_sibling_edge[next_] = prev
+        self.next_sibling_edge[e_id] = -1
+        self.prev_sibling_edge[e_id] = -1
+        self.num_children[source_id] -= 1
+        self.rule_count[self.edge_rule[e_id]] -= 1
+        self.num_edges -= 1
+        if self.forest is not None:
+            self.forest.cut(int(target_id))
+            if self.num_children[source_id] == 0:
+                self.forest.set_value(int(source_id), 0)
+
+    def edge_ids(self) -> np.ndarray:
+        'IDs of all edges contained in the branching.'
+        return self.parent_edge[self.parent_edge >= 0]
+
+    # interface compatible with Branching
+
+    def __contains__(self, node :LexiconEntry) -> bool:
+        return node in self.lexicon
+
+    def __len__(self) -> int:
+        return len(self.lexicon)
+
+    def nodes_iter(self) -> Iterable[LexiconEntry]:
+        return iter(self.lexicon)
+
+    def number_of_edges(self) -> int:
+        return self.num_edges
+
+    def edges_iter(self) -> Iterable[GraphEdge]:
+        return (self.edge_set[int(e_id)] for e_id in self.edge_ids())
+
+    def has_edge(self, source :LexiconEntry, target :LexiconEntry,
+                 rule :Rule = None) -> bool:
+        e_id = self.parent_edge[self.lexicon.get_id(target)]
+        if e_id < 0 or self.edge_source[e_id] != self.lexicon.get_id(source):
+            return False
+        return rule is None or self.edge_set[int(e_id)].rule == rule
+
+    def add_edge(self, edge :GraphEdge) -> None:
+        self.add_edge_id(self.edge_set.get_id(edge))
+
+    def remove_edge(self, edge :GraphEdge) -> None:
+        self.remove_edge_id(self.edge_set.get_id(edge))
+
+    def is_edge_possible(self, edge :GraphEdge) -> bool:
+        return self.is_edge_possible_id(self.edge_set.get_id(edge))
+
+    def parent(self, node :LexiconEntry) -> LexiconEntry:
+        p_id = self.parent_id(self.lexicon.get_id(node))
+        return self.lexicon[p_id] if p_id >= 0 else None
+
+    def predecessors(self, node :LexiconEntry) -> List[LexiconEntry]:
+        parent = self.parent(node)
+        return [parent] if parent is not None else []
+
+    def successors(self, node :LexiconEntry) -> List[LexiconEntry]:
+        return [self.lexicon[v_id] \
+                for v_id in self.children_ids(self.lexicon.get_id(node))]
+
+    def ingoing_edges(self, target :LexiconEntry) -> List[GraphEdge]:
+        e_id = self.parent_edge[self.lexicon.get_id(target)]
+        return [self.edge_set[int(e_id)]] if e_id >= 0 else []
+
+    def outgoing_edges(self, source :LexiconEntry) -> List[GraphEdge]:
+        return [self.edge_set[e_id] \
+                for e_id in self.child_edge_ids(self.lexicon.get_id(source))]
+
+    def edges_between(self, source :LexiconEntry, target :LexiconEntry) \
+                     -> List[GraphEdge]:
+        if source is None or target is None:
+            return []
+        e_id = self.parent_edge[self.lexicon.get_id(target)]
+        if e_id >= 0 and self.edge_source[e_id] == self.lexicon.get_id(source):
+            return [self.edge_set[int(e_id)]]
+        return []
+
+    def root(self, node :LexiconEntry) -> LexiconEntry:
+        return self.lexicon[self.root_id(self.lexicon.get_id(node))]
+
+    def depth(self, node :LexiconEntry) -> int:
+        return self.depth_id(self.lexicon.get_id(node))
+
+    def subtree_size(self, node :LexiconEntry) -> int:
+        return self.subtree_size_id(self.lexicon.get_id(node))
+
+    def count_nonleaves(self, node :LexiconEntry) -> int:
+        return self.count_nonleaves_id(self.lexicon.get_id(node))
+
+    def height(self, node :LexiconEntry) -> int:
+        return self.height_id(self.lexicon.get_id(node))
+
+    def has_path(self, source :LexiconEntry, target :LexiconEntry) -> bool:
+        return self.has_path_id(self.lexicon.get_id(source),
+                                self.lexicon.get_id(target))
+
+    def path(self, source :LexiconEntry, target :LexiconEntry) \
+            -> List[LexiconEntry]:
+        source_id = self.lexicon.get_id(source)
+        v_id, result = self.lexicon.get_id(target), []
+        while v_id != source_id:
+            if v_id < 0:
+                raise Exception('No path from {} to {}'.format(source, target))
+            result.append(self.lexicon[v_id])
+            v_id = self.parent_id(v_id)
+        result.append(source)
+        result.reverse()
+        return result
+
+    def edge_ids_for_rule(self, rule :Rule) -> np.ndarray:
+        'IDs of the edges with the given rule contained in the branching.'
+        if rule not in self.rule_index:
+            return np.empty(0, dtype=np.int64)
+        edge_ids = self.edge_ids_by_rule[self.rule_index[rule]]
+        return edge_ids[self.parent_edge[self.edge_target[edge_ids]] \
+                        == edge_ids]
+
+    def get_edges_for_rule(self, rule :Rule) -> List[GraphEdge]:
+        return [self.edge_set[int(e_id)] \
+                for e_id in self.edge_ids_for_rule(rule)]
+
+    def num_edges_for_rule(self, rule :Rule) -> int:
+        if rule not in self.rule_index:
+            return 0
+        return int(self.rule_count[self.rule_index[rule]])
+
+
 class FullGraph(Graph):
     def __init__(self, lexicon :Lexicon, edge_set :EdgeSet) -> None:
         super().__init__()
@@ -251,14 +599,55 @@ class FullGraph(Graph):
             self.add_node(lexentry)
         for edge in edge_set:
             self.add_edge(edge)
+        self._edge_ids_index = None
 
     def add_edge(self, edge :GraphEdge) -> None:
         super().add_edge(edge)
+        self._edge_ids_index = None
 
     def remove_edges(self, edges :List[GraphEdge]) -> None:
         self.edge_set.remove(edges)
         for edge in edges:
             super().remove_edge(edge)
+        self._edge_ids_index = None
+
+    def _build_edge_ids_index(self) -> None:
+        # edge IDs by (source ID, target ID) and by target ID
+        self._edge_ids_index = (defaultdict(list), defaultdict(list))
+        for e_id, (source_id, target_id) in \
+                enumerate(zip(self.edge_set.source_ids().tolist(),
+                              self.edge_set.target_ids().tolist())):
+            self._edge_ids_index[0][(source_id, target_id)].append(e_id)
+            self._edge_ids_index[1][target_id].append(e_id)
+
+    def connected_components(self) -> List[np.ndarray]:
+        '''Return the edge IDs of each weakly connected component
+           containing at least one edge, largest components first.'''
+        source_ids = self.edge_set.source_ids()
+        target_ids = self.edge_set.target_ids()
+        n = len(self.lexicon)
+        adjacency = coo_matrix((np.ones(len(source_ids)),
+                                (source_ids, target_ids)), shape=(n, n))
+        num_components, labels = \
+            scipy.sparse.csgraph.connected_components(adjacency,
+                                                      directed=False)
+        edge_labels = labels[source_ids]
+        edge_ids = np.argsort(edge_labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(edge_labels[edge_ids])) + 1
+        components = np.split(edge_ids, boundaries) if len(edge_ids) else []
+        components.sort(key=len, reverse=True)
+        return components
+
+    def edge_ids_between(self, source_id :int, target_id :int) -> List[int]:
+        'IDs of the edges between two nodes given by their lexicon IDs.'
+        if self._edge_ids_index is None:
+            self._build_edge_ids_index()
+        return self._edge_ids_index[0].get((source_id, target_id), [])
+
+    def ingoing_edge_ids(self, target_id :int) -> List[int]:
+        if self._edge_ids_index is None:
+            self._build_edge_ids_index()
+        return self._edge_ids_index[1].get(target_id, [])
 
 #     def load_edges_from_file(self, filename :str) -> None:
 #         starting_id = len(self.edges_list) + 1
@@ -279,21 +668,25 @@ class FullGraph(Graph):
         # choose an edge with uniform probability
         return random.choice(self.edge_set.items)
 
-    def empty_branching(self) -> Branching:
-        branching = Branching()
-        branching.add_nodes_from(self)
-        return branching
-
-    def random_branching(self) -> Branching:
-        # choose some edges randomly and compose a branching out of them
-        edges = list(iter(self.edge_set))
+    def empty_branching(self, dynamic_index :bool = False) -> ArrayBranching:
+        return ArrayBranching(self, dynamic_index=dynamic_index)
+
+    def random_branching(self, dynamic_index :bool = False,
+                         rng :np.random.Generator = None,
+                         edge_ids :np.ndarray = None) -> ArrayBranching:
+        '''Compose a branching out of randomly chosen edges. If `edge_ids`
+           is given, only those edges are considered.'''
+        if rng is None:
+            rng = np.random.default_rng()
+        edge_ids = rng.permutation(len(self.edge_set)) if edge_ids is None \
+                   else rng.permutation(edge_ids)
         logging.getLogger('main').debug(\
-            'random_branching(): {} potential edges'.format(len(edges)))
-        random.shuffle(edges)
-        branching = self.empty_branching()
-        for edge in edges:
-            if branching.is_edge_possible(edge) and random.random() < 0.5:
-                branching.add_edge(edge)
+            'random_branching(): {} potential edges'.format(len(edge_ids)))
+        selected = rng.random(len(edge_ids)) < 0.5
+        branching = self.empty_branching(dynamic_index=dynamic_index)
+        for e_id in edge_ids[selected].tolist():
+            if branching.is_edge_possible_id(e_id):
+                branching.add_edge_id(e_id)
         return branching
 
     # TODO edge weighting: use matrix operations!!!
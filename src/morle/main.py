@@ -81,6 +81,8 @@ def setup():
                           help='quiet mode: print less console output')
     ap.add_argument('-v', action='store_true', dest='verbose',
                           help='verbose mode: print more information in the log file')
+    ap.add_argument('--resume', action='store_true', dest='resume',
+                          help='resume an interrupted sampling run from the last checkpoint')
     ap.add_argument('--version', action='version', version=__version__)
 #    ap.add_argument('-p', '--progress', action='store_true', help='print progress of performed operations')
     args = ap.parse_args()
@@ -94,6 +96,7 @@ def setup():
     shared.options['interactive'] = args.interactive
     shared.options['quiet'] = args.quiet
     shared.options['verbose'] = args.verbose
+    shared.options['resume'] = args.resume
     process_config()
     setup_logger(args.quiet, args.verbose)
     return args.modules.split('+')
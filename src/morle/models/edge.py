@@ -33,6 +33,9 @@ class EdgeModel(Model):
         'Cost of having a rule in the model.'
         raise NotImplementedError()
 
+    def rules_cost(self, rules :Iterable[Rule]) -> np.ndarray:
+        return np.array([self.rule_cost(rule) for rule in rules])
+
     def recompute_costs(self) -> None:
         raise NotImplementedError()
 
@@ -83,6 +86,11 @@ class SimpleEdgeModel(EdgeModel):
         'Cost of having a rule in the model.'
         return self._rule_cost[self.rule_set.get_id(rule)]
 
+    def rules_cost(self, rules :Iterable[Rule]) -> np.ndarray:
+        if rules is self.rule_set:
+            return self._rule_cost.copy()
+        return self._rule_cost[[self.rule_set.get_id(rule) for rule in rules]]
+
     def set_probs(self, probs :np.ndarray) -> None:
         self.rule_prob = probs
         self._rule_appl_cost = -np.log(probs) + np.log(1-probs)
@@ -99,9 +107,8 @@ class SimpleEdgeModel(EdgeModel):
     def fit(self, edge_set :EdgeSet, weights :np.ndarray) -> None:
         # compute rule frequencies
         rule_freq = np.zeros(len(self.rule_set))
-        for i in range(weights.shape[0]):
-            rule_id = self.rule_set.get_id(edge_set[i].rule)
-            rule_freq[rule_id] += weights[i]
+        for rule, edge_ids in edge_set.get_edge_ids_by_rule().items():
+            rule_freq[self.rule_set.get_id(rule)] += np.sum(weights[edge_ids])
         # fit
         probs = (rule_freq + np.repeat(self.alpha-1, len(self.rule_set))) /\
                  (self.rule_domsize + np.repeat(self.alpha+self.beta-2,
@@ -210,6 +217,11 @@ class NeuralEdgeModel(EdgeModel):
         'Cost of having a rule in the model.'
         return self._rule_cost[self.rule_set.get_id(rule)]
 
+    def rules_cost(self, rules :Iterable[Rule]) -> np.ndarray:
+        if rules is self.rule_set:
+            return self._rule_cost.copy()
+        return self._rule_cost[[self.rule_set.get_id(rule) for rule in rules]]
+
     def fit(self, edge_set :EdgeSet, weights :np.ndarray) -> None:
         num_negex = int(len(edge_set) *\
                         shared.config['NeuralEdgeModel']\
@@ -18,6 +18,9 @@ class RootModel(Model):
     def root_cost(self, entry :LexiconEntry) -> float:
         raise NotImplementedError()
 
+    def root_costs(self, lexicon :Lexicon) -> np.ndarray:
+        return np.array([self.root_cost(entry) for entry in lexicon])
+
     def save(self, filename :str) -> None:
         raise NotImplementedError()
 
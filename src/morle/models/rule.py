@@ -5,6 +5,7 @@ from morle.utils.files import open_to_write, read_tsv_file, write_line
 from collections import defaultdict
 from typing import Iterable
 import math
+import numpy as np
 
 
 class RuleModel(Model):
@@ -14,6 +15,9 @@ class RuleModel(Model):
     def rule_cost(self, rule :Rule) -> float:
         raise NotImplementedError()
 
+    def rules_cost(self, rules :Iterable[Rule]) -> np.ndarray:
+        return np.array([self.rule_cost(rule) for rule in rules])
+
     def save(self, filename :str) -> None:
         raise NotImplementedError()
 
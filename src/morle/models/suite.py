@@ -106,6 +106,13 @@ class ModelSuite:
         result += self.edge_model.rule_cost(rule)
         result += self.added_rule_cost
         return result
+
+    def rules_cost(self, rules :Iterable[Rule]) -> np.ndarray:
+        result = self.edge_model.rules_cost(rules)
+        if self.rule_model is not None:
+            result += self.rule_model.rules_cost(rules)
+        result += self.added_rule_cost
+        return result
 # 
 #     def edge_cost(self, edge :GraphEdge) -> float:
 #         result = self.edge_model.edge_cost(edge)
@@ -99,7 +99,8 @@ class RNNTagModel(TagModel):
         self.nn.fit(X, y, epochs=10, sample_weight=weights, batch_size=64,
                     verbose=1)
         
-    def predict_tags(self, entries :Iterable[LexiconEntry]) -> np.ndarray:
+    def predict_tags(self, entries :Iterable[LexiconEntry],
+                     batch_size :int = 1000) -> np.ndarray:
         X_lst = []
         for entry in entries:
             X_lst.append([(self.alphabet_idx[sym] \
@@ -107,17 +108,16 @@ class RNNTagModel(TagModel):
                            else 0) \
                           for sym in entry.word])
         X = keras.preprocessing.sequence.pad_sequences(X_lst, maxlen=self.maxlen)
-        return self.nn.predict(X)
+        return self.nn.predict(X, batch_size=batch_size)
 
     def root_cost(self, entry :LexiconEntry) -> float:
         return self.root_costs([entry])[0]
 
-    def root_costs(self, lexicon :Lexicon) -> np.ndarray:
+    def root_costs(self, lexicon :Lexicon,
+                   batch_size :int = 1000) -> np.ndarray:
         X, y = self._prepare_data(lexicon)
-        y_pred = self.nn.predict(X)
-        probs = np.empty(y.shape[0])
-        for i in range(y.shape[0]):
-            probs[i] = y_pred[i,y[i]]
+        y_pred = self.nn.predict(X, batch_size=batch_size)
+        probs = y_pred[np.arange(y.shape[0]), y]
 #         return np.log(probs+1e-300)     # avoid zeros -- TODO a more elegant solution
         return -np.log(probs)
 
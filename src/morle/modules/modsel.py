@@ -31,19 +31,38 @@ def run() -> None:
     for iter_num in range(shared.config['modsel'].getint('iterations')):
         sampler = MCMCGraphSampler(full_graph, model,
                 shared.config['modsel'].getint('warmup_iterations'),
-                shared.config['modsel'].getint('sampling_iterations'))
+                shared.config['modsel'].getint('sampling_iterations'),
+                seed=shared.config['General'].getint('seed', fallback=None),
+                target_ess=shared.config['modsel'].getfloat('target_ess'),
+                max_rhat=shared.config['modsel'].getfloat('max_rhat'),
+                diagnostic_interval=\
+                    shared.config['modsel'].getint('diagnostic_interval'),
+                move_batch_size=\
+                    shared.config['modsel'].getint('move_batch_size'),
+                proposal_temperature=\
+                    shared.config['modsel'].getfloat('proposal_temperature'),
+                dynamic_index=shared.config['Models'].get('dynamic_index'))
         sampler.add_stat('acc_rate', AcceptanceRateStatistic(sampler))
         sampler.add_stat('edge_freq', EdgeFrequencyStatistic(sampler))
         sampler.add_stat('exp_cost', ExpectedCostStatistic(sampler))
-        sampler.run_sampling()
+        sampler.run_sampling(
+            num_chains=shared.config['modsel'].getint('num_chains'),
+            num_processes=shared.config['modsel'].getint('num_processes'),
+            component_batch_size=\
+                shared.config['modsel'].getint('component_batch_size'),
+            exact_component_size=\
+                shared.config['modsel'].getint('exact_component_size'),
+            num_temperatures=\
+                shared.config['modsel'].getint('num_temperatures'),
+            max_temperature=\
+                shared.config['modsel'].getfloat('max_temperature'),
+            swap_interval=shared.config['modsel'].getint('swap_interval'))
 
         # fit the model
         edge_weights = sampler.stats['edge_freq'].value()
-        root_weights = np.ones(len(full_graph.lexicon))
-        for idx in range(edge_weights.shape[0]):
-            root_id = \
-                full_graph.lexicon.get_id(full_graph.edge_set[idx].target)
-            root_weights[root_id] -= edge_weights[idx]
+        root_weights = 1 - np.bincount(full_graph.edge_set.target_ids(),
+                                       weights=edge_weights,
+                                       minlength=len(full_graph.lexicon))
         model.fit(sampler.lexicon, sampler.edge_set, 
                   root_weights, edge_weights)
 
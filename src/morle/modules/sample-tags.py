@@ -34,10 +34,13 @@ def run() -> None:
     tagset = model.root_tag_model.tagset
 
     # save baseline
+    predict_batch_size = \
+        shared.config['sample-tags'].getint('predict_batch_size')
+    baseline_probs = model.root_tag_model.predict_tags(
+                         lexicon, batch_size=predict_batch_size)
     with open_to_write('tags-baseline.txt') as outfp:
-        probs = model.root_tag_model.predict_tags(lexicon)
         for w_id in range(len(lexicon)):
-            tag_probs = sorted([(tag, probs[w_id,t_id]) \
+            tag_probs = sorted([(tag, baseline_probs[w_id,t_id]) \
                                 for t_id, tag in enumerate(tagset)],
                                reverse=True, key=itemgetter(1))
             tag_str = ' '.join([''.join(tag)+':'+str(prob) \
@@ -51,7 +54,16 @@ def run() -> None:
             warmup_iter=shared.config['sample-tags']\
                               .getint('warmup_iterations'),
             sampling_iter=shared.config['sample-tags']\
-                                .getint('sampling_iterations'))
+                                .getint('sampling_iterations'),
+            predict_batch_size=predict_batch_size,
+            compute_leaf_prob=shared.config['sample-tags']\
+                                    .getboolean('compute_leaf_prob'),
+            edge_batch_size=shared.config['sample-tags']\
+                                  .getint('edge_batch_size'),
+            num_processes=shared.config['sample-tags']\
+                                .getint('num_processes'),
+            tag_prob_interval=shared.config['sample-tags']\
+                                    .getint('tag_prob_interval'))
     sampler.add_stat('edge_freq', stats.EdgeFrequencyStatistic(sampler))
     sampler.add_stat('acc_rate', stats.AcceptanceRateStatistic(sampler))
     sampler.run_sampling()
@@ -64,7 +76,7 @@ def run() -> None:
 #                          for t_id, tag in enumerate(tagset)]
             probs = sampler.tag_freq[w_id,:]
             if np.sum(probs) <= 0:
-                probs = model.root_tag_model.predict_tags([lexicon[w_id]])[0,:]
+                probs = baseline_probs[w_id,:]
                 num_zero_probs += 1
             tag_probs = sorted([(tag, probs[t_id]) \
                                 for t_id, tag in enumerate(tagset)],
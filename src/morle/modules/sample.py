@@ -1,4 +1,5 @@
-from morle.algorithms.mcmc.samplers import MCMCGraphSamplerFactory
+from morle.algorithms.mcmc.samplers import MCMCGraphSamplerFactory, \
+    read_checkpoint
 import morle.algorithms.mcmc.statistics as stats
 from morle.datastruct.graph import EdgeSet, FullGraph
 from morle.datastruct.lexicon import Lexicon
@@ -38,7 +39,41 @@ def run() -> None:
                 warmup_iter=shared.config['sample'].getint('warmup_iterations'),
                 sampling_iter=shared.config['sample'].getint('sampling_iterations'),
                 iter_stat_interval=shared.config['sample'].getint('iter_stat_interval'),
-                depth_cost=shared.config['Models'].getfloat('depth_cost'))
+                depth_cost=shared.config['Models'].getfloat('depth_cost'),
+                dynamic_index=shared.config['Models'].get('dynamic_index'),
+                seed=shared.config['General'].getint('seed', fallback=None),
+                checkpoint_file=shared.filenames['sample-checkpoint'],
+                checkpoint_interval=\
+                    shared.config['sample'].getint('checkpoint_interval'),
+                target_ess=shared.config['sample'].getfloat('target_ess'),
+                max_rhat=shared.config['sample'].getfloat('max_rhat'),
+                diagnostic_interval=\
+                    shared.config['sample'].getint('diagnostic_interval'),
+                move_batch_size=\
+                    shared.config['sample'].getint('move_batch_size'),
+                proposal_temperature=\
+                    shared.config['sample'].getfloat('proposal_temperature'),
+                journal_file=shared.filenames['sample-journal'] \
+                    if shared.config['sample'].getboolean('save_journal') \
+                    else None,
+                trace_file=shared.filenames['sample-iter-stats'] \
+                    if shared.config['sample'].getboolean('stream_iter_stats') \
+                    else None,
+                output_format=shared.config['sample'].get('output_format'))
+    if shared.config['sample'].getboolean('warm_start'):
+        # start from the final branching of the fitting
+        if file_exists(shared.filenames['fit-checkpoint']):
+            checkpoint = read_checkpoint(shared.filenames['fit-checkpoint'])
+            if int(checkpoint['num_edges']) == len(edge_set):
+                logging.getLogger('main').info(\
+                    'Starting from the final branching of fit.')
+                sampler.initial_edge_ids = checkpoint['edge_ids']
+            else:
+                logging.getLogger('main').warning(\
+                    'The graph was changed since fit -- warm start ignored.')
+        else:
+            logging.getLogger('main').warning(\
+                'No fit checkpoint found -- warm start ignored.')
     if shared.config['sample'].getboolean('stat_cost'):
         sampler.add_stat('cost', stats.ExpectedCostStatistic(sampler))
     if shared.config['sample'].getboolean('stat_acc_rate'):
@@ -55,10 +90,24 @@ def run() -> None:
     if shared.config['sample'].getboolean('stat_rule_contrib'):
         sampler.add_stat('contrib', 
                          stats.RuleExpectedContributionStatistic(sampler))
+    if shared.config['sample'].getboolean('stat_moves'):
+        sampler.add_stat('moves', stats.MoveStatistic(sampler))
 
     # run sampling and print results
     logging.getLogger('main').info('Running sampling...')
-    sampler.run_sampling()
+    sampler.run_sampling(
+        num_chains=shared.config['sample'].getint('num_chains'),
+        num_processes=shared.config['sample'].getint('num_processes'),
+        resume=shared.options['resume'],
+        component_batch_size=\
+            shared.config['sample'].getint('component_batch_size'),
+        exact_component_size=\
+            shared.config['sample'].getint('exact_component_size'),
+        num_temperatures=\
+            shared.config['sample'].getint('num_temperatures'),
+        max_temperature=\
+            shared.config['sample'].getfloat('max_temperature'),
+        swap_interval=shared.config['sample'].getint('swap_interval'))
     sampler.summary()
 
     sampler.save_root_costs('sample-root-costs.txt')
@@ -15,6 +15,7 @@ config = configparser.ConfigParser()
 options = {\
     'quiet' : False,
     'verbose' : False,
+    'resume' : False,
     'working_dir' : ''
 }
 
@@ -29,6 +30,7 @@ filenames = {\
     'eval.wordlist' : 'input.testing',
     'eval.wordgen' : 'wordgen-eval.txt',
     'eval.report' : 'eval.txt',
+    'fit-checkpoint' : 'fit-checkpoint.npz',
     'fastss-tr' : 'fastss.fsm',
     'graph' : 'graph.txt',
     'analyze.graph' : 'graph.analyze',
@@ -45,10 +47,15 @@ filenames = {\
     'rules-modsel' : 'rules-modsel.txt',
     'rules-fit' : 'rules-fit.txt',
     'rules-tr' : 'rules.fsm',
+    'sample-checkpoint' : 'sample-checkpoint.npz',
     'sample-edge-stats' : 'sample-edge-stats.txt',
     'sample-iter-stats' : 'sample-iter-stats.txt',
+    'sample-journal' : 'sample-journal.bin',
+    'sample-move-stats' : 'sample-move-stats.txt',
     'sample-rule-stats' : 'sample-rule-stats.txt',
+    'sample-rules' : 'sample-rules.txt',
     'sample-wordpair-stats' : 'sample-wordpair-stats.txt',
+    'sample-words' : 'sample-words.txt',
     'tagger-tr' : 'tagger.fsm',
     'wordgen' : 'wordgen.txt',
     'wordlist' : 'input.training',
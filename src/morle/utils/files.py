@@ -93,6 +93,28 @@ def write_tsv_file(filename :str, row_iter :Iterable) -> None:
             writer.writerow(row)
 
 
+def write_tsv_columns(filename :str, columns :List[Any],
+                      header :Iterable[str] = None,
+                      chunk_size :int = 100000) -> None:
+    '''Write a table given as columns (NumPy arrays or lists of strings)
+       to a TSV file. The rows are formatted in chunks of `chunk_size`,
+       with a single conversion per column, which is much faster than
+       write_line() for large tables (the values are formatted the same
+       way).'''
+    num_rows = len(columns[0]) if columns else 0
+    with open_to_write(filename) as fp:
+        if header is not None:
+            write_line(fp, header)
+        for start in range(0, num_rows, chunk_size):
+            end = min(start+chunk_size, num_rows)
+            chunk = [col[start:end].astype(str).tolist() \
+                         if isinstance(col, np.ndarray) \
+                         else col[start:end] \
+                     for col in columns]
+            fp.write(''.join(line + '\n' \
+                             for line in map('\t'.join, zip(*chunk))))
+
+
 FILE_SIZES = {} # type: Dict[str, int]
 
 
@@ -71,6 +71,15 @@ def parallel_execute(function :Callable[..., None] = None,
             if not p.is_alive():
                 p.join()
                 joined[i] = True
+        if count == 0:
+            # nothing to do -- avoid taking CPU time from the workers
+            time.sleep(0.01)
+    # collect the results that were put in the queue after the last check
+    count = 0
+    while not queue.empty():
+        yield queue.get()
+        count += 1
     if show_progressbar:
+        progressbar.update(count)
         progressbar.close()
 
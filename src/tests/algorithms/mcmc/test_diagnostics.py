@@ -0,0 +1,46 @@
+from morle.algorithms.mcmc.diagnostics import \
+    autocorrelation_time, effective_sample_size, split_rhat
+
+import numpy as np
+import unittest
+
+
+def ar1(rng :np.random.Generator, n :int, phi :float) -> np.ndarray:
+    x = np.zeros(n)
+    noise = rng.normal(size=n)
+    for i in range(1, n):
+        x[i] = phi * x[i-1] + noise[i]
+    return x
+
+
+class DiagnosticsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.rng = np.random.default_rng(42)
+
+    def test_iid_trace(self) -> None:
+        x = self.rng.normal(size=5000)
+        self.assertLess(autocorrelation_time(x), 1.2)
+        self.assertGreater(effective_sample_size(x), 4000)
+
+    def test_correlated_trace(self) -> None:
+        # the integrated autocorrelation time of AR(1) is (1+phi)/(1-phi)
+        x = ar1(self.rng, 20000, 0.9)
+        tau = autocorrelation_time(x)
+        self.assertGreater(tau, 12)
+        self.assertLess(tau, 30)
+
+    def test_constant_trace(self) -> None:
+        x = np.ones(100)
+        self.assertEqual(autocorrelation_time(x), 1.0)
+        self.assertEqual(split_rhat([x, x]), 1.0)
+
+    def test_split_rhat(self) -> None:
+        chains = [self.rng.normal(size=2000) for i in range(3)]
+        self.assertLess(split_rhat(chains), 1.01)
+        chains[0] += 3
+        self.assertGreater(split_rhat(chains), 1.5)
+        # a trend within a single chain is detected by splitting
+        trend = np.linspace(0, 10, 2000) + self.rng.normal(size=2000)
+        self.assertGreater(split_rhat([trend]), 1.5)
+        self.assertEqual(split_rhat([np.ones(3)]), float('inf'))
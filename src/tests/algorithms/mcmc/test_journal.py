@@ -0,0 +1,57 @@
+from morle.algorithms.mcmc.journal import MoveJournal, end_journal_file, \
+    journal_file_size, read_journal_file, start_journal_file, \
+    truncate_journal_file
+import morle.shared as shared
+
+import numpy as np
+import tempfile
+import unittest
+
+
+class MoveJournalTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.working_dir = shared.options['working_dir']
+        shared.options['working_dir'] = self.tmpdir.name
+
+    def tearDown(self) -> None:
+        shared.options['working_dir'] = self.working_dir
+        self.tmpdir.cleanup()
+
+    def test_records(self) -> None:
+        journal = MoveJournal(capacity=6, reserve=4)
+        journal.append(3, 10, -1, 1.5)
+        journal.append(3, 11, 1, 1.5)
+        self.assertFalse(journal.is_full())
+        journal.append(5, 10, 1, 2.5)
+        self.assertTrue(journal.is_full())
+        iter_nums, edge_ids, signs, logls = journal.records()
+        self.assertEqual(iter_nums.tolist(), [3, 3, 5])
+        self.assertEqual(edge_ids.tolist(), [10, 11, 10])
+        self.assertEqual(signs.tolist(), [-1, 1, 1])
+        self.assertEqual(logls.tolist(), [1.5, 1.5, 2.5])
+        journal.clear()
+        self.assertEqual(len(journal.records()[0]), 0)
+
+    def test_file(self) -> None:
+        journal = MoveJournal()
+        start_journal_file('journal.bin', np.array([4, 7]), 10.0)
+        journal.append(2, 4, -1, 9.0)
+        journal.save('journal.bin')
+        size = journal_file_size('journal.bin')
+        journal.clear()
+        journal.append(6, 5, 1, 8.0)
+        journal.save('journal.bin')
+        # resuming from a checkpoint saved before the second move
+        truncate_journal_file('journal.bin', size)
+        journal.save('journal.bin')
+        end_journal_file('journal.bin', 9, 8.0)
+        initial_edge_ids, initial_logl, records, num_iter = \
+            read_journal_file('journal.bin')
+        self.assertEqual(initial_edge_ids.tolist(), [4, 7])
+        self.assertEqual(initial_logl, 10.0)
+        self.assertEqual(records['iter_num'].tolist(), [2, 6])
+        self.assertEqual(records['edge_id'].tolist(), [4, 5])
+        self.assertEqual(records['sign'].tolist(), [-1, 1])
+        self.assertEqual(num_iter, 9)
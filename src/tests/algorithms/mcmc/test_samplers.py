@@ -0,0 +1,542 @@
+from morle.algorithms.matrixtree import edge_marginals
+from morle.algorithms.mcmc.journal import MoveJournal, read_journal_file
+from morle.algorithms.mcmc.samplers import MCMCGraphSampler, \
+    MCMCTagSampler, RandomStream, TagTransitionMatrices, alias_table
+from morle.algorithms.mcmc.statistics import CostAtIterationStatistic, \
+    EdgeFrequencyStatistic
+from morle.datastruct.graph import EdgeSet, FullGraph, GraphEdge
+from morle.datastruct.lexicon import Lexicon, LexiconEntry
+from morle.datastruct.rules import Rule, RuleSet
+from morle.utils.files import full_path
+import morle.shared as shared
+
+import numpy as np
+import os
+import tempfile
+from types import SimpleNamespace
+import unittest
+import unittest.mock
+
+# fake config file
+CONFIG = '''
+[General]
+encoding = utf-8
+date_format = %%d.%%m.%%Y %%H:%%M
+supervised = no
+
+[Models]
+root_feature_model = none
+edge_feature_model = none
+
+[Features]
+word_vec_dim = 100
+
+[FST]
+transducer_type = 1
+'''
+
+shared.config.read_string(CONFIG)
+
+
+class RandomStreamTest(unittest.TestCase):
+
+    def test_reproducibility(self) -> None:
+        streams = [RandomStream(np.random.default_rng(7), 10, block_size=16) \
+                   for i in range(2)]
+        values = [[(s.edge_id(), s.uniform()) for i in range(50)] \
+                  for s in streams]
+        self.assertEqual(values[0], values[1])
+
+    def test_ranges(self) -> None:
+        stream = RandomStream(np.random.default_rng(), 3, block_size=8)
+        for i in range(100):
+            self.assertIn(stream.edge_id(), (0, 1, 2))
+            u = stream.uniform()
+            self.assertTrue(0 <= u < 1)
+            self.assertIn(stream.choice(['a', 'b']), ('a', 'b'))
+
+    def test_batches(self) -> None:
+        # batches continue the same sequence as single draws
+        streams = [RandomStream(np.random.default_rng(7), 10, block_size=16) \
+                   for i in range(2)]
+        edge_ids = [streams[0].edge_id() for i in range(40)]
+        self.assertEqual(streams[1].edge_id_batch(3).tolist() + \
+                         streams[1].edge_id_batch(12).tolist() + \
+                         [streams[1].edge_id() for i in range(5)] + \
+                         streams[1].edge_id_batch(20).tolist(), edge_ids)
+        streams = [RandomStream(np.random.default_rng(7), 10, block_size=16) \
+                   for i in range(2)]
+        uniforms = [streams[0].uniform() for i in range(40)]
+        self.assertTrue(np.allclose(
+            np.concatenate((streams[1].uniform_batch(10),
+                            streams[1].uniform_batch(30))), uniforms))
+
+    def test_edge_weights(self) -> None:
+        weights = np.array([1.0, 0.0, 3.0, 0.5, 0.5])
+        prob, alias = alias_table(weights)
+        # the probability of every index summed over the table
+        probs = np.bincount(alias, weights=1-prob, minlength=5) + prob
+        self.assertTrue(np.allclose(probs / 5, weights / weights.sum()))
+        stream = RandomStream(np.random.default_rng(3), 5, block_size=1000,
+                              edge_weights=weights)
+        counts = np.bincount(stream.edge_id_batch(10000), minlength=5)
+        self.assertEqual(counts[1], 0)
+        self.assertTrue(np.allclose(counts / 10000, weights / weights.sum(),
+                                    atol=0.02))
+
+
+class ReplaceBranchingTest(unittest.TestCase):
+    '''Test the exchange of branchings between tempering replicas.'''
+
+    def setUp(self) -> None:
+        lexicon = Lexicon([LexiconEntry(word) \
+                           for word in ('mach', 'macht', 'machte')])
+        rules = { 't' : Rule.from_string(':/:t'),
+                  'e' : Rule.from_string(':/:e'),
+                  'te' : Rule.from_string(':/:te') }
+        edges = [('mach', 'macht', 't'), ('macht', 'machte', 'e'),
+                 ('mach', 'machte', 'te')]
+        edge_set = EdgeSet(lexicon, [GraphEdge(lexicon[source],
+                                               lexicon[target], rules[rule]) \
+                                     for source, target, rule in edges])
+        full_graph = FullGraph(lexicon, edge_set)
+        # only the attributes accessed by _replace_branching() are needed
+        self.sampler = SimpleNamespace(
+            branching=full_graph.empty_branching(), _logl=10.0, iter_num=7,
+            edge_delta_cache=np.array([-1.0, -2.0, -4.0]),
+            journal=MoveJournal(), dispatched_stats=[])
+        self.sampler.cost_of_change = lambda *args: \
+            MCMCGraphSampler.cost_of_change(self.sampler, *args)
+        for e_id in (0, 1):
+            self.sampler.branching.add_edge_id(e_id)
+
+    def test_replace_branching(self) -> None:
+        MCMCGraphSampler._replace_branching(self.sampler, np.array([0, 2]))
+        self.assertEqual(sorted(self.sampler.branching.edge_ids().tolist()),
+                         [0, 2])
+        self.assertAlmostEqual(self.sampler._logl, 8.0)
+        iter_nums, edge_ids, signs, logls = self.sampler.journal.records()
+        self.assertEqual(iter_nums.tolist(), [7, 7])
+        self.assertEqual(edge_ids.tolist(), [1, 2])
+        self.assertEqual(signs.tolist(), [-1, 1])
+        self.assertEqual(logls.tolist(), [8.0, 8.0])
+
+
+class WordPairIndexTest(unittest.TestCase):
+    '''Test the index of the unordered word pairs.'''
+
+    def setUp(self) -> None:
+        # the lexicon IDs are not in alphabetical order
+        lexicon = Lexicon([LexiconEntry(word) \
+                           for word in ('machte', 'mach', 'macht')])
+        # only the attributes accessed by word_pair_index() are needed
+        self.sampler = SimpleNamespace(
+            lexicon=lexicon, edge_source_ids=np.array([0, 1, 2, 1]),
+            edge_target_ids=np.array([1, 0, 0, 2]),
+            _word_ranks=None, _word_pair_keys=None, _edge_pair_ids=None)
+        for method in ('word_ranks', 'word_pair_keys', 'word_pair_index'):
+            setattr(self.sampler, method,
+                    getattr(MCMCGraphSampler, method)\
+                        .__get__(self.sampler))
+
+    def test_word_pair_index(self) -> None:
+        pair_keys, edge_pair_ids = self.sampler.word_pair_index()
+        self.assertEqual(self.sampler.word_ranks().tolist(), [2, 0, 1])
+        self.assertEqual(edge_pair_ids.tolist(), [1, 1, 2, 0])
+        # the words of every pair are in alphabetical order
+        word_ids = np.argsort(self.sampler.word_ranks())
+        self.assertEqual([(str(self.sampler.lexicon[int(word_ids[k // 3])]),
+                           str(self.sampler.lexicon[int(word_ids[k % 3])])) \
+                          for k in pair_keys],
+                         [('mach', 'macht'), ('mach', 'machte'),
+                          ('macht', 'machte')])
+
+
+class TagTransitionMatricesTest(unittest.TestCase):
+
+    def test_messages(self) -> None:
+        rng = np.random.default_rng(5)
+        # entries in random order, edge 2 without entries
+        edge_ids = np.array([3, 0, 1, 0, 3, 3])
+        source_tags = np.array([0, 1, 2, 0, 2, 2])
+        target_tags = np.array([1, 1, 0, 2, 2, 0])
+        values = rng.uniform(size=6)
+        tr = TagTransitionMatrices(4, 3, edge_ids, source_tags, target_tags,
+                                   values)
+        dense = np.zeros((4, 3, 3))
+        dense[edge_ids, source_tags, target_tags] = values
+        e_ids = np.array([3, 2, 0, 3])
+        vectors = rng.uniform(size=(4, 3))
+        self.assertTrue(np.allclose(
+            tr.backward_messages(e_ids, vectors),
+            np.einsum('nst,nt->ns', dense[e_ids], vectors)))
+        self.assertTrue(np.allclose(
+            tr.forward_messages(e_ids, vectors),
+            np.einsum('ns,nst->nt', vectors, dense[e_ids])))
+        out = np.empty(3)
+        for e_id, vector in zip(e_ids, vectors):
+            tr.backward_message(e_id, vector, out)
+            self.assertTrue(np.allclose(out, dense[e_id] @ vector))
+
+
+class TagSamplerTest(unittest.TestCase):
+    '''Compare the incrementally updated probabilities of the tag sampler
+       with a recursive computation from scratch after random moves.'''
+
+    def setUp(self) -> None:
+        self.rng = np.random.default_rng(11)
+        words = ['a'*(i+1) for i in range(8)]
+        lexicon = Lexicon([LexiconEntry(word) for word in words])
+        rule = Rule.from_string(':/:a')
+        # edges between random pairs of words
+        pairs = [(i, j) for i in range(len(words)) \
+                        for j in range(len(words)) \
+                        if i != j and self.rng.uniform() < 0.6]
+        edge_set = EdgeSet(lexicon, [GraphEdge(lexicon[words[i]],
+                                               lexicon[words[j]], rule) \
+                                     for i, j in pairs])
+        full_graph = FullGraph(lexicon, edge_set)
+        # all entries of the matrices (in random order), so that no tree
+        # has zero probability
+        num_tags = 3
+        edge_ids, source_tags, target_tags = \
+            self.rng.permutation(np.indices((len(edge_set), num_tags,
+                                             num_tags)).reshape(3, -1).T).T
+        values = self.rng.uniform(0.1, 1.0, size=len(edge_ids))
+        self.dense = np.zeros((len(edge_set), num_tags, num_tags))
+        np.add.at(self.dense, (edge_ids, source_tags, target_tags), values)
+        # only the attributes used by the moves are set
+        sampler = MCMCTagSampler.__new__(MCMCTagSampler)
+        sampler.lexicon, sampler.edge_set = lexicon, edge_set
+        sampler.edge_source_ids = edge_set.source_ids()
+        sampler.edge_target_ids = edge_set.target_ids()
+        sampler.branching = full_graph.empty_branching()
+        sampler.tagset = [(str(t),) for t in range(num_tags)]
+        sampler.edge_tr_mat = TagTransitionMatrices(
+            len(edge_set), num_tags, edge_ids, source_tags, target_tags,
+            values)
+        sampler.root_prob = self.rng.uniform(size=(len(words), num_tags))
+        sampler.leaf_prob = self.rng.uniform(size=(len(words), num_tags))
+        sampler.min_subtree_prob = 0
+        sampler.stats = {}
+        sampler.init_forward_prob()
+        sampler.init_backward_prob()
+        sampler.reset()
+        self.sampler = sampler
+
+    def _parents(self, edge_ids_to_add=(), edge_ids_to_remove=()) -> dict:
+        parent_edge = { v_id : e_id \
+                        for v_id, e_id in \
+                            enumerate(self.sampler.branching.parent_edge) \
+                        if e_id >= 0 }
+        for e_id in edge_ids_to_remove:
+            del parent_edge[self.sampler.edge_target_ids[e_id]]
+        for e_id in edge_ids_to_add:
+            parent_edge[self.sampler.edge_target_ids[e_id]] = e_id
+        return parent_edge
+
+    def _backward_prob(self, parent_edge :dict) -> np.ndarray:
+        s = self.sampler
+        children = { v_id : [] for v_id in range(len(s.lexicon)) }
+        for v_id, e_id in parent_edge.items():
+            children[s.edge_source_ids[e_id]].append(e_id)
+
+        def _backward(v_id):
+            b = s.leaf_prob[v_id].copy()
+            for e_id in children[v_id]:
+                b *= self.dense[e_id] @ _backward(s.edge_target_ids[e_id])
+            return b
+
+        return np.array([_backward(v_id) for v_id in range(len(s.lexicon))])
+
+    def _log_prob(self, parent_edge :dict) -> float:
+        s = self.sampler
+        backward_prob = self._backward_prob(parent_edge)
+        return sum(np.log(np.dot(s.root_prob[v_id], backward_prob[v_id])) \
+                   for v_id in range(len(s.lexicon)) \
+                   if v_id not in parent_edge)
+
+    def _tag_prob(self, parent_edge :dict) -> np.ndarray:
+        s = self.sampler
+        backward_prob = self._backward_prob(parent_edge)
+        forward_prob = np.zeros_like(backward_prob)
+
+        def _forward(v_id):
+            if v_id not in parent_edge:
+                return s.root_prob[v_id]
+            e_id = parent_edge[v_id]
+            u_id = s.edge_source_ids[e_id]
+            vector = _forward(u_id) * s.leaf_prob[u_id]
+            for w_id, f_id in parent_edge.items():
+                if w_id != v_id and s.edge_source_ids[f_id] == u_id:
+                    vector = vector * (self.dense[f_id] @ backward_prob[w_id])
+            return vector @ self.dense[e_id]
+
+        tag_prob = np.array([_forward(v_id) * backward_prob[v_id] \
+                             for v_id in range(len(s.lexicon))])
+        return tag_prob / tag_prob.sum(axis=1, keepdims=True)
+
+    def _random_move(self):
+        '''Delete a random edge or add it, replacing the current
+           parent of its target (if any).'''
+        s = self.sampler
+        while True:
+            e_id = int(self.rng.integers(len(s.edge_set)))
+            if s.branching.parent_edge[s.edge_target_ids[e_id]] == e_id:
+                return [], [e_id]
+            # the source must not be a descendant of the target
+            v_id = s.edge_source_ids[e_id]
+            while v_id != s.edge_target_ids[e_id] and \
+                    s.branching.parent_edge[v_id] >= 0:
+                v_id = s.edge_source_ids[s.branching.parent_edge[v_id]]
+            if v_id == s.edge_target_ids[e_id]:
+                continue
+            p_e_id = s.branching.parent_edge[s.edge_target_ids[e_id]]
+            return [e_id], ([int(p_e_id)] if p_e_id >= 0 else [])
+
+    def test_random_moves(self) -> None:
+        s = self.sampler
+        s.update_tag_prob()
+        for i in range(300):
+            edge_ids_to_add, edge_ids_to_remove = self._random_move()
+            old_log_prob = self._log_prob(self._parents())
+            new_log_prob = self._log_prob(
+                self._parents(edge_ids_to_add, edge_ids_to_remove))
+            acc_prob = s.compute_acc_prob(edge_ids_to_add, edge_ids_to_remove,
+                                          1.0, 0)
+            self.assertAlmostEqual(np.log(acc_prob),
+                                   new_log_prob - old_log_prob)
+            if self.rng.uniform() < 0.7:
+                s.accept_move(edge_ids_to_add, edge_ids_to_remove)
+            parent_edge = self._parents()
+            self.assertTrue(np.allclose(s.backward_prob,
+                                        self._backward_prob(parent_edge)))
+            v_ids = np.array(list(parent_edge), dtype=np.int64)
+            if len(v_ids) > 0:
+                self.assertTrue(np.allclose(
+                    s.backward_msg[v_ids],
+                    np.einsum('nst,nt->ns',
+                              self.dense[s.branching.parent_edge[v_ids]],
+                              s.backward_prob[v_ids])))
+            if i % 10 == 0:
+                s.update_tag_prob()
+                self.assertTrue(np.allclose(s.tag_prob,
+                                            self._tag_prob(parent_edge)))
+
+
+class LeafProbTest(unittest.TestCase):
+
+    def test_leaf_prob(self) -> None:
+        lexicon = Lexicon([LexiconEntry('mach'), LexiconEntry('machen')])
+        tagset = [('<VB>',), ('<NN>',)]
+        rule_set = RuleSet()
+        for rule in (':/:en___<VB>:<VB>', ':/:t___<VB>:<NN>',
+                     ':/en:___<VB>:<VB>'):
+            rule_set.add(Rule.from_string(rule), 1)
+        # the edge probabilities depend on the source and the rule
+        edge_probs = { ('mach<VB>', ':/:en___<VB>:<VB>') : 0.2,
+                       ('mach<VB>', ':/:t___<VB>:<NN>') : 0.3,
+                       ('machen<VB>', ':/:en___<VB>:<VB>') : 0.4,
+                       ('machen<VB>', ':/:t___<VB>:<NN>') : 0.5,
+                       ('machen<VB>', ':/en:___<VB>:<VB>') : 0.6 }
+        model = SimpleNamespace(
+            rule_set=rule_set,
+            edges_prob=lambda edge_set: np.array(
+                [edge_probs[edge.source.literal, str(edge.rule)] \
+                 for edge in edge_set]))
+        sampler = MCMCTagSampler.__new__(MCMCTagSampler)
+        sampler.lexicon, sampler.tagset, sampler.model = \
+            lexicon, tagset, model
+        sampler.num_processes = 1
+        for edge_batch_size in (2, 100):
+            sampler.edge_batch_size = edge_batch_size
+            sampler._compute_leaf_prob()
+            self.assertTrue(np.allclose(
+                sampler.leaf_prob,
+                [[(1-0.2)*(1-0.3), 1.0],
+                 [(1-0.4)*(1-0.5)*(1-0.6), 1.0]]))
+
+
+class Interrupted(Exception):
+    pass
+
+
+class SamplerTest(unittest.TestCase):
+    '''Run the sampler on a small graph with fixed costs.'''
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.working_dir = shared.options['working_dir']
+        shared.options['working_dir'] = self.tmpdir.name
+        # copies of the same component for several stems, so that
+        # batches of moves contain independent moves
+        stems = ('mach', 'sag', 'lach', 'kauf')
+        lexicon = Lexicon([LexiconEntry(word.format(stem)) \
+                           for stem in stems \
+                           for word in ('{}', '{}en', '{}t', '{}te',
+                                        'ge{}t')])
+        rules = { 'en' : Rule.from_string(':/:en'),
+                  't' : Rule.from_string(':/:t'),
+                  'e' : Rule.from_string(':/:e'),
+                  'ge' : Rule.from_string(':ge/:'),
+                  'te' : Rule.from_string(':/:te') }
+        edges = [('{}', '{}en', 'en'), ('{}en', '{}', 'en'),
+                 ('{}', '{}t', 't'), ('{}t', '{}', 't'),
+                 ('{}t', '{}te', 'e'), ('{}', '{}te', 'te'),
+                 ('{}te', '{}t', 'e'), ('{}t', 'ge{}t', 'ge'),
+                 ('ge{}t', '{}t', 'ge')]
+        edge_set = EdgeSet(lexicon,
+                           [GraphEdge(lexicon[source.format(stem)],
+                                      lexicon[target.format(stem)],
+                                      rules[rule]) \
+                            for stem in stems \
+                            for source, target, rule in edges])
+        self.full_graph = FullGraph(lexicon, edge_set)
+        rule_set = RuleSet()
+        for rule in rules.values():
+            rule_set.add(rule, 1)
+        # only the costs are needed from the model
+        root_costs = np.tile([3.0, 4.0, 3.5, 5.0, 4.5], len(stems))
+        edge_costs = np.tile([3.5, 4.0, 3.0, 3.0, 4.5, 5.0, 4.5, 4.5, 4.0],
+                             len(stems))
+        self.model = SimpleNamespace(
+            rule_set=rule_set, null_cost=lambda: 0.0,
+            roots_cost=lambda lexicon: root_costs.copy(),
+            edges_cost=lambda edge_set: edge_costs.copy())
+
+    def tearDown(self) -> None:
+        shared.options['working_dir'] = self.working_dir
+        self.tmpdir.cleanup()
+
+    def _sampler(self, **kwargs) -> MCMCGraphSampler:
+        sampler = MCMCGraphSampler(self.full_graph, self.model,
+                                   warmup_iter=1000, seed=7, **kwargs)
+        sampler.add_stat('edge_freq', EdgeFrequencyStatistic(sampler))
+        sampler.add_stat('iter_cost', CostAtIterationStatistic(sampler))
+        return sampler
+
+    def assertMarginalsEqual(self, sampler :MCMCGraphSampler) -> None:
+        '''Compare the edge frequencies of a finished run with the exact
+           marginals.'''
+        expected = edge_marginals(sampler.edge_source_ids,
+                                  sampler.edge_target_ids,
+                                  sampler.edge_delta_cache)
+        self.assertTrue(np.all((expected > 0.05) & (expected < 0.95)))
+        self.assertTrue(np.allclose(sampler.stats['edge_freq'].value(),
+                                    expected, atol=0.03))
+
+    def test_edge_frequencies(self) -> None:
+        sampler = self._sampler(sampling_iter=200000)
+        sampler.run_sampling()
+        self.assertMarginalsEqual(sampler)
+
+    def test_move_batches(self) -> None:
+        sampler = self._sampler(sampling_iter=100000, move_batch_size=10)
+        sampler.run_sampling()
+        self.assertMarginalsEqual(sampler)
+
+    def test_proposal_temperature(self) -> None:
+        # the edges are proposed with different probabilities
+        sampler = self._sampler(sampling_iter=200000,
+                                proposal_temperature=1.0)
+        sampler.run_sampling()
+        self.assertFalse(np.allclose(sampler.edge_proposal_weights, 1))
+        self.assertMarginalsEqual(sampler)
+
+    def test_tempering(self) -> None:
+        # only the replica at temperature 1 feeds the statistics, and
+        # the branchings passed down by the (frequent) swaps must not
+        # bias it
+        sampler = self._sampler(sampling_iter=100000)
+        sampler.run_sampling(num_temperatures=3, max_temperature=20.0,
+                             swap_interval=10)
+        self.assertEqual(sampler.temperature, 1.0)
+        self.assertMarginalsEqual(sampler)
+
+    def test_resume(self) -> None:
+        # an uninterrupted run
+        sampler = self._sampler(sampling_iter=10000,
+                                journal_file='journal-1.bin')
+        sampler.run_sampling()
+        # the same run, interrupted after the checkpoint at iteration 6000
+        # (the moves after it are written to the journal file and must be
+        # discarded on resuming)
+        settings = dict(sampling_iter=10000, journal_file='journal-2.bin',
+                        checkpoint_file='checkpoint.npz',
+                        checkpoint_interval=1000)
+        interrupted = self._sampler(**settings)
+        iteration_done = interrupted._iteration_done
+
+        def _interrupt() -> bool:
+            if interrupted.phase == 'sampling' and \
+                    interrupted.iter_num == 6500:
+                # (also flushes the journal)
+                interrupted.write_trace()
+                raise Interrupted()
+            return iteration_done()
+
+        interrupted._iteration_done = _interrupt
+        with self.assertRaises(Interrupted):
+            interrupted.run_sampling()
+        # (the rows after the checkpoint in the spill file of
+        # the iteration statistics must be discarded as well)
+        interrupted.trace.close()
+        resumed = self._sampler(**settings)
+        resumed.run_sampling(resume=True)
+        self.assertEqual(resumed.iter_num, 10000)
+        self.assertEqual(sorted(resumed.branching.edge_ids().tolist()),
+                         sorted(sampler.branching.edge_ids().tolist()))
+        self.assertAlmostEqual(resumed.logl(), sampler.logl())
+        for name in ('edge_freq', 'iter_cost'):
+            self.assertTrue(np.allclose(resumed.stats[name].state(),
+                                        sampler.stats[name].state()))
+        journals = [read_journal_file(filename) \
+                    for filename in ('journal-1.bin', 'journal-2.bin')]
+        self.assertEqual(sorted(journals[0][0].tolist()),
+                         sorted(journals[1][0].tolist()))
+        self.assertTrue(np.array_equal(journals[0][2], journals[1][2]))
+        self.assertEqual(journals[0][3], journals[1][3])
+        traces = []
+        for i, s in enumerate((sampler, resumed)):
+            s.save_iter_stats('iter-stats-{}.txt'.format(i))
+            traces.append(self._read_trace('iter-stats-{}.txt'.format(i)))
+        self.assertEqual(traces[0][:,0].tolist(), list(range(1, 10001)))
+        self.assertTrue(np.array_equal(traces[0], traces[1]))
+
+    def _read_trace(self, filename :str) -> np.ndarray:
+        return np.loadtxt(full_path(filename), delimiter='\t', skiprows=1,
+                          ndmin=2)
+
+    @unittest.mock.patch.object(CostAtIterationStatistic, 'CAPACITY', 700)
+    def test_merge_chain_traces(self) -> None:
+        # the traces of the chains are merged into the trace file
+        sampler = self._sampler(sampling_iter=3000, trace_file='trace.txt')
+        sampler.run_sampling(num_chains=2)
+        merged = self._read_trace('trace.txt')
+        self.assertEqual(os.listdir(self.tmpdir.name), ['trace.txt'])
+        # the same chains run separately
+        traces = []
+        for seed in np.random.SeedSequence(7).spawn(2):
+            chain = self._sampler(sampling_iter=3000)
+            chain.cache_costs()
+            chain.set_seed(seed)
+            chain.run_chain()
+            chain.save_iter_stats('chain.txt')
+            traces.append(self._read_trace('chain.txt'))
+        self.assertEqual(merged[:,0].tolist(), list(range(1, 3001)))
+        self.assertTrue(np.allclose(merged[:,1],
+                                    (traces[0][:,1] + traces[1][:,1]) / 2))
+
+    @unittest.mock.patch.object(CostAtIterationStatistic, 'CAPACITY', 700)
+    def test_merge_component_traces(self) -> None:
+        # the cost is additive over the components -- its average over
+        # the merged trace must match the exact expected cost
+        sampler = self._sampler(sampling_iter=40000)
+        sampler.run_sampling(component_batch_size=1, exact_component_size=0)
+        sampler.save_iter_stats('iter-stats.txt')
+        merged = self._read_trace('iter-stats.txt')
+        self.assertEqual(merged[:,0].tolist(), list(range(1, 10001)))
+        edge_ids = np.arange(len(self.full_graph.edge_set))
+        expected = sampler.stats['iter_cost'].exact_state(
+                       edge_ids, sampler.exact_edge_marginals(edge_ids))[0]
+        self.assertAlmostEqual(np.mean(merged[:,1]), expected, delta=0.25)
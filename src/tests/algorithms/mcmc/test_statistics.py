@@ -0,0 +1,323 @@
+from morle.algorithms.mcmc.statistics import \
+    AcceptanceRateStatistic, CostAtIterationStatistic, \
+    EdgeFrequencyStatistic, ExpectedCostStatistic, MoveStatistic, \
+    RaoBlackwellEdgeFrequencyStatistic, RuleExpectedContributionStatistic, \
+    UndirectedEdgeFrequencyStatistic
+from morle.datastruct.graph import ArrayBranching
+
+import numpy as np
+from types import SimpleNamespace
+import unittest
+
+
+class StatisticMergeTest(unittest.TestCase):
+    '''Test merging the final states of independent chains.'''
+
+    def setUp(self) -> None:
+        # only the attributes accessed by the statistics are needed
+        self.sampler = SimpleNamespace(edge_set=[None] * 3,
+                                       iter_stat_interval=2)
+
+    def test_scalar_statistic(self) -> None:
+        stat = AcceptanceRateStatistic(self.sampler)
+        stat.reset()
+        stat.merge([0.2, 0.4, 0.6])
+        self.assertAlmostEqual(stat.value(), 0.4)
+        self.assertAlmostEqual(stat.chain_var, 0.04)
+
+    def test_edge_statistic(self) -> None:
+        states = []
+        for val in ([1.0, 0.0, 0.5], [0.0, 0.0, 0.5]):
+            stat = EdgeFrequencyStatistic(self.sampler)
+            stat.reset()
+            stat.val = np.array(val)
+            states.append(stat.state())
+        stat = EdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        stat.merge(states)
+        self.assertTrue(np.allclose(stat.value(), [0.5, 0.0, 0.5]))
+        self.assertTrue(np.allclose(stat.chain_var, [0.5, 0.0, 0.0]))
+
+    def test_move_statistic(self) -> None:
+        states = []
+        for accepted in (True, False):
+            stat = MoveStatistic(self.sampler)
+            stat.reset()
+            stat.move_done('flip_1', accepted, 0.5, 0.25)
+            stat.move_done('impossible', False, 0.5, 0.0)
+            states.append(stat.state())
+        stat = MoveStatistic(self.sampler)
+        stat.reset()
+        stat.merge(states)
+        flip_1 = stat.move_types.index('flip_1')
+        self.assertEqual(stat.num_proposed[flip_1], 2)
+        self.assertEqual(stat.num_accepted[flip_1], 1)
+        self.assertAlmostEqual(stat.acceptance_rate()[flip_1], 0.5)
+        self.assertAlmostEqual(stat.proposal_time.sum(), 2.0)
+        self.assertAlmostEqual(stat.acceptance_time.sum(), 0.5)
+        self.assertEqual(stat.num_proposed.sum(), 4)
+
+    def test_iteration_statistic(self) -> None:
+        stat = CostAtIterationStatistic(self.sampler)
+        stat.reset()
+        stat.merge([[1.0, 2.0], [3.0, 4.0]])
+        self.assertAlmostEqual(stat.value(2), 2.0)
+        self.assertAlmostEqual(stat.value(4), 3.0)
+
+
+class EdgeFrequencyUpdateTest(unittest.TestCase):
+    '''Test the accounting of edge presence during sampling.'''
+
+    def setUp(self) -> None:
+        # edges 0 and 1 connect the same pair of words (in both directions)
+        branching = SimpleNamespace(edge_ids=lambda: np.array([2]))
+        self.sampler = SimpleNamespace(
+            edge_set=[None] * 3,
+            word_pair_index=lambda: (np.array([1, 5]), np.array([0, 0, 1])),
+            branching=branching,
+            iter_num=0)
+
+    def test_edge_frequency(self) -> None:
+        stat = EdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        self.sampler.iter_num = 2
+        stat.edge_added(0)
+        self.sampler.iter_num = 5
+        stat.edge_removed(0)
+        stat.edge_added(1)
+        self.sampler.iter_num = 10
+        stat.update()
+        self.assertTrue(np.allclose(stat.value(), [0.3, 0.5, 1.0]))
+        self.assertTrue(np.all(stat.last_modified == 10))
+
+    def test_undirected_edge_frequency(self) -> None:
+        stat = UndirectedEdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        self.sampler.iter_num = 2
+        stat.edge_added(0)
+        self.sampler.iter_num = 5
+        stat.edge_removed(0)
+        stat.edge_added(1)
+        self.sampler.iter_num = 10
+        stat.update()
+        self.assertTrue(np.allclose(stat.values, [0.8, 1.0]))
+        # the pairs of words are given by lexicon IDs (the keys above
+        # are those of a lexicon of size 4 in alphabetical order)
+        self.sampler.word_pair_keys = \
+            lambda w_1, w_2: min(w_1, w_2) * 4 + max(w_1, w_2)
+        self.assertAlmostEqual(stat.value((1, 0)), 0.8)
+        self.assertAlmostEqual(stat.value((1, 1)), 1.0)
+        self.assertRaises(KeyError, stat.value, (0, 2))
+
+    def test_flush(self) -> None:
+        # the same changes as above, passed in two batches
+        self.sampler.iter_stat_interval = 3
+        self.sampler._logl = 1.0
+        stats = [EdgeFrequencyStatistic(self.sampler),
+                 UndirectedEdgeFrequencyStatistic(self.sampler),
+                 AcceptanceRateStatistic(self.sampler),
+                 ExpectedCostStatistic(self.sampler),
+                 CostAtIterationStatistic(self.sampler)]
+        for stat in stats:
+            stat.reset()
+        for iter_nums, edge_ids, signs, logls, iter_num in \
+                (([2], [0], [1], [2.0], 4),
+                 ([5, 5], [0, 1], [-1, 1], [3.0, 3.0], 10)):
+            self.sampler.iter_num = iter_num
+            for stat in stats:
+                stat.flush(np.array(iter_nums), np.array(edge_ids),
+                           np.array(signs, dtype=np.int8), np.array(logls))
+        self.assertTrue(np.allclose(stats[0].value(), [0.3, 0.5, 1.0]))
+        self.assertTrue(np.allclose(stats[1].values, [0.8, 1.0]))
+        self.assertAlmostEqual(stats[2].value(), 0.4)
+        self.assertAlmostEqual(stats[3].value(), 2.5)
+        self.assertEqual(stats[4].values.tolist(), [2.0, 3.0, 3.0])
+
+
+class RaoBlackwellEdgeFrequencyTest(unittest.TestCase):
+    '''Test the conditional edge probabilities given the branching.'''
+
+    def setUp(self) -> None:
+        # nodes 0, 1, 2; edges 0->1 (in the branching), 1->0, 0->2, 2->1
+        branching = SimpleNamespace(
+            ancestor_index=lambda: (np.array([0, 1, 0]),
+                                    [np.array([0, 0, 2]),
+                                     np.array([0, 0, 2])]),
+            ancestors_at_distance=ArrayBranching.ancestors_at_distance)
+        self.sampler = SimpleNamespace(edge_set=[None] * 4,
+                                       edge_source_ids=np.array([0, 1, 0, 2]),
+                                       edge_target_ids=np.array([1, 0, 2, 1]),
+                                       edge_delta_cache=\
+                                           np.array([0, 0, np.log(3), 0]),
+                                       proposal_edge_ids=None,
+                                       branching=branching,
+                                       diagnostic_interval=2,
+                                       iter_num=0)
+
+    def test_conditional_probabilities(self) -> None:
+        stat = RaoBlackwellEdgeFrequencyStatistic(self.sampler, interval=3)
+        self.assertEqual(stat.interval, 4)
+        stat.reset()
+        stat.update()
+        # 1->0 would create a cycle, the alternatives for 0->2 are weighted
+        # 1/3 to 1 (root)
+        expected = [1/3, 0, 0.25, 1/3]
+        self.assertTrue(np.allclose(stat.value(), expected))
+        self.sampler.edge_delta_cache = np.zeros(4)
+        for iter_num in range(1, 5):
+            self.sampler.iter_num = iter_num
+            stat.next_iter()
+        self.assertEqual(stat.num_samples, 2)
+        self.assertTrue(np.allclose(stat.value(), [1/3, 0, 0.375, 1/3]))
+
+
+class StatisticMergeComponentsTest(unittest.TestCase):
+    '''Test combining the states of separately sampled components.'''
+
+    def setUp(self) -> None:
+        # the components are {0, 1} and {2, 3} (edges 0 and 1 connect
+        # the same pair of words)
+        self.sampler = SimpleNamespace(
+            edge_set=[None] * 4,
+            word_pair_index=lambda: (np.array([1, 6, 11]),
+                                     np.array([0, 0, 1, 2])),
+            empty_branching_logl=lambda: 10.0,
+            iter_stat_interval=1)
+        self.edge_ids = [np.array([0, 1]), np.array([2, 3])]
+
+    def test_edge_statistics(self) -> None:
+        states = []
+        for edge_ids, val in zip(self.edge_ids, ([0.2, 0.3, 0, 0],
+                                                 [0, 0, 0.4, 0.5])):
+            stat = EdgeFrequencyStatistic(self.sampler)
+            stat.reset()
+            stat.val = np.array(val)
+            states.append(stat.component_state(edge_ids))
+        stat = EdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        stat.merge_components(states, self.edge_ids)
+        self.assertTrue(np.allclose(stat.value(), [0.2, 0.3, 0.4, 0.5]))
+
+    def test_word_pair_statistics(self) -> None:
+        states = []
+        for edge_ids, values in zip(self.edge_ids, ([0.5, 0, 0],
+                                                    [0, 0.4, 0.5])):
+            stat = UndirectedEdgeFrequencyStatistic(self.sampler)
+            stat.values = np.array(values)
+            states.append(stat.component_state(edge_ids))
+        stat = UndirectedEdgeFrequencyStatistic(self.sampler)
+        stat.values = np.zeros(3)
+        stat.merge_components(states, self.edge_ids)
+        self.assertTrue(np.allclose(stat.values, [0.5, 0.4, 0.5]))
+
+    def test_exact_state(self) -> None:
+        marginals = np.array([0.25, 0.5, 0.75, 1.0])
+        stat = EdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        stat.merge_components(
+            [stat.exact_state(edge_ids, marginals[edge_ids]) \
+             for edge_ids in self.edge_ids], self.edge_ids)
+        self.assertTrue(np.allclose(stat.value(), marginals))
+        stat = UndirectedEdgeFrequencyStatistic(self.sampler)
+        stat.values = np.zeros(3)
+        stat.merge_components(
+            [stat.exact_state(edge_ids, marginals[edge_ids]) \
+             for edge_ids in self.edge_ids], self.edge_ids)
+        self.assertTrue(np.allclose(stat.values, [0.75, 0.75, 1.0]))
+        self.assertIsNone(AcceptanceRateStatistic(self.sampler)\
+                          .exact_state(self.edge_ids[0], marginals[:2]))
+
+    def test_rule_contribution(self) -> None:
+        # edges 0 and 2 belong to rule 0, edges 1 and 3 to rule 1
+        sampler = SimpleNamespace(
+            rule_set=['r0', 'r1'],
+            model=SimpleNamespace(rules_cost=lambda rules: np.array([1., 2.])),
+            edge_rule_ids=np.array([0, 1, 0, 1]),
+            edge_delta_cache=np.array([-1.0, -2.0, -3.0, -4.0]))
+        stat = RuleExpectedContributionStatistic(sampler)
+        state = stat.exact_state(np.arange(4), np.array([0.5, 0.5, 1.0, 0.25]))
+        self.assertTrue(np.allclose(state, [2.5, 0.0]))
+
+    def test_cost_statistics(self) -> None:
+        # the log-likelihood is additive over components
+        stat = ExpectedCostStatistic(self.sampler)
+        stat.reset()
+        stat.merge_components([12.0, 7.0], self.edge_ids)
+        self.assertAlmostEqual(stat.value(), 9.0)
+        stat = CostAtIterationStatistic(self.sampler)
+        stat.reset()
+        stat.merge_components([[11.0, 12.0, 13.0], [8.0]], self.edge_ids)
+        self.assertEqual(stat.values.tolist(), [9.0, 10.0, 11.0])
+
+
+class StatisticCheckpointTest(unittest.TestCase):
+    '''Test saving and restoring the state of statistics.'''
+
+    def setUp(self) -> None:
+        self.sampler = SimpleNamespace(edge_set=[None] * 3,
+                                       iter_stat_interval=1)
+
+    def test_restore_state(self) -> None:
+        stat = EdgeFrequencyStatistic(self.sampler)
+        stat.reset()
+        stat.val[1], stat.last_modified[1] = 0.5, 10
+        restored = EdgeFrequencyStatistic(self.sampler)
+        restored.reset()
+        restored.restore_state(stat.checkpoint_state())
+        self.assertTrue(np.array_equal(restored.val, stat.val))
+        self.assertTrue(np.array_equal(restored.last_modified,
+                                       stat.last_modified))
+
+    def test_restore_scalar_and_iteration_state(self) -> None:
+        stat = AcceptanceRateStatistic(self.sampler)
+        stat.reset()
+        stat.val, stat.last_modified = 0.25, 4
+        restored = AcceptanceRateStatistic(self.sampler)
+        restored.restore_state(stat.checkpoint_state())
+        self.assertEqual((restored.val, restored.last_modified), (0.25, 4))
+        stat = CostAtIterationStatistic(self.sampler)
+        stat.reset()
+        stat.values = [1.0, 2.0]
+        restored = CostAtIterationStatistic(self.sampler)
+        restored.restore_state(stat.checkpoint_state())
+        restored.append_values([3.0])
+        self.assertEqual(restored.values.tolist(), [1.0, 2.0, 3.0])
+
+    def test_take_values(self) -> None:
+        stat = CostAtIterationStatistic(self.sampler)
+        stat.reset()
+        stat.values = [1.0, 2.0]
+        self.assertEqual(stat.take_values().tolist(), [1.0, 2.0])
+        stat.append_values([3.0])
+        restored = CostAtIterationStatistic(self.sampler)
+        restored.restore_state(stat.checkpoint_state())
+        self.assertEqual(restored.num_traced, 2)
+        self.assertEqual(restored.value(3), 3.0)
+        self.assertRaises(KeyError, restored.value, 2)
+        self.assertRaises(KeyError, restored.value, 4)
+
+    def test_ring_buffer(self) -> None:
+        # the sampler empties the full buffer by passing the values to
+        # the trace file
+        traced = []
+        stat = CostAtIterationStatistic(self.sampler)
+        self.sampler.write_trace = \
+            lambda: traced.extend(stat.take_values(stat.num_values-1))
+        stat.reset()
+        n = stat.CAPACITY
+        stat.append_values(np.arange(n-1))
+        stat.append_values(np.arange(n-1, n+2))
+        self.assertEqual(traced, list(range(n-1)))
+        self.assertTrue(np.array_equal(stat.values, np.arange(n-1, n+2)))
+        self.assertEqual(stat.value(n+2), n+1)
+        self.assertRaises(KeyError, stat.value, n-1)
+        # the values wrap around the end of the buffer
+        stat.append_values(np.arange(n+2, 3*n))
+        self.assertEqual(len(stat._buffer), n)
+        self.assertEqual(traced + stat.values.tolist(), list(range(3*n)))
+        self.assertEqual(stat.value(3*n), 3*n-1)
+        # only the values in the buffer are saved in checkpoints
+        restored = CostAtIterationStatistic(self.sampler)
+        restored.restore_state(stat.checkpoint_state())
+        self.assertEqual(restored.num_traced, len(traced))
+        self.assertEqual(restored.values.tolist(), stat.values.tolist())
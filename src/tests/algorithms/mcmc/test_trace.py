@@ -0,0 +1,58 @@
+from morle.algorithms.mcmc.trace import TraceWriter, trace_file_size, \
+    truncate_trace_file
+from morle.utils.files import read_tsv_file
+import morle.shared as shared
+
+import numpy as np
+import tempfile
+import unittest
+
+
+class TraceWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.working_dir = shared.options['working_dir']
+        shared.options['working_dir'] = self.tmpdir.name
+
+    def tearDown(self) -> None:
+        shared.options['working_dir'] = self.working_dir
+        self.tmpdir.cleanup()
+
+    def test_write(self) -> None:
+        # more rows than fit in the ring of blocks at once
+        trace = TraceWriter('trace.txt', ['a', 'b'], block_size=2,
+                            num_blocks=2)
+        trace.write(np.array([10, 20, 30, 40, 50]),
+                    np.array([[1.5, -1], [2.5, -2], [3.5, -3], [4.5, -4],
+                              [5.5, -5]]))
+        trace.flush()
+        size = trace_file_size('trace.txt')
+        trace.write(np.array([60]), np.array([[6.5, -6]]))
+        trace.close()
+        # resuming from a checkpoint saved before the last row
+        truncate_trace_file('trace.txt', size)
+        trace = TraceWriter('trace.txt', ['a', 'b'], append=True)
+        trace.write(np.array([60]), np.array([[7.5, -7]]))
+        trace.close()
+        rows = list(read_tsv_file('trace.txt'))
+        self.assertEqual(rows[0], ['iter_num', 'a', 'b'])
+        self.assertEqual([int(row[0]) for row in rows[1:]],
+                         [10, 20, 30, 40, 50, 60])
+        self.assertEqual([float(row[1]) for row in rows[1:]],
+                         [1.5, 2.5, 3.5, 4.5, 5.5, 7.5])
+        self.assertEqual([float(row[2]) for row in rows[1:]],
+                         [-1, -2, -3, -4, -5, -7])
+
+    def test_error(self) -> None:
+        # an error in the background thread is raised instead of waiting
+        # for the rows to be written
+        trace = TraceWriter('trace.txt', ['a'], block_size=1, num_blocks=2)
+        trace.fmt = '%q'
+        trace.write(np.array([10, 20, 30]), np.array([[1.0], [2.0], [3.0]]))
+        with self.assertRaises(ValueError):
+            trace.flush()
+        with self.assertRaises(ValueError):
+            trace.write(np.array([40]), np.array([[4.0]]))
+        with self.assertRaises(ValueError):
+            trace.close()
@@ -0,0 +1,60 @@
+from morle.algorithms.matrixtree import edge_marginals, max_marginal_edges
+
+import itertools
+import numpy as np
+import unittest
+
+
+def brute_force_marginals(source_ids, target_ids, edge_costs):
+    'Compute the marginals by enumerating all branchings.'
+    marginals, total = np.zeros(len(edge_costs)), 0.0
+    for selected in itertools.product((False, True), repeat=len(edge_costs)):
+        edges = [i for i in range(len(edge_costs)) if selected[i]]
+        parent = {}
+        for i in edges:
+            if target_ids[i] in parent:
+                break
+            parent[target_ids[i]] = source_ids[i]
+        else:
+            # check that there are no cycles
+            acyclic = True
+            for node in parent:
+                visited, cur = set(), node
+                while cur in parent and acyclic:
+                    visited.add(cur)
+                    cur = parent[cur]
+                    acyclic = cur not in visited
+            if acyclic:
+                weight = np.exp(-sum(edge_costs[i] for i in edges))
+                total += weight
+                marginals[edges] += weight
+    return marginals / total
+
+
+class MatrixTreeTest(unittest.TestCase):
+
+    def test_edge_marginals(self) -> None:
+        # contains a two-cycle and two edges between the same nodes
+        source_ids = np.array([3, 5, 5, 7, 3, 7])
+        target_ids = np.array([5, 3, 7, 9, 7, 3])
+        edge_costs = np.array([-2.0, 1.5, -8.0, 0.5, 3.0, -1.0])
+        self.assertTrue(np.allclose(
+            edge_marginals(source_ids, target_ids, edge_costs),
+            brute_force_marginals(source_ids, target_ids, edge_costs)))
+
+    def test_random_graphs(self) -> None:
+        rng = np.random.default_rng(0)
+        for i in range(20):
+            source_ids = rng.integers(0, 5, 7)
+            target_ids = (source_ids + rng.integers(1, 5, 7)) % 5
+            edge_costs = rng.normal(0, 5, 7)
+            self.assertTrue(np.allclose(
+                edge_marginals(source_ids, target_ids, edge_costs),
+                brute_force_marginals(source_ids, target_ids, edge_costs)))
+
+    def test_max_marginal_edges(self) -> None:
+        target_ids = np.array([1, 1, 2, 3])
+        marginals = np.array([0.3, 0.6, 0.4, 0.7])
+        # node 2 is more probably a root
+        self.assertEqual(max_marginal_edges(target_ids, marginals).tolist(),
+                         [3, 1])
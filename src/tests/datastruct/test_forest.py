@@ -0,0 +1,63 @@
+from morle.datastruct.forest import LinkCutForest
+
+import random
+import unittest
+
+
+class LinkCutForestTest(unittest.TestCase):
+    '''Compare the results of LinkCutForest with a naive parent array
+       on random sequences of operations.'''
+
+    def _naive_subtree(self, parent, v):
+        result, stack = [], [v]
+        while stack:
+            node = stack.pop()
+            result.append(node)
+            stack.extend(i for i, p in enumerate(parent) if p == node)
+        return result
+
+    def _naive_ancestors(self, parent, v):
+        result = [v]
+        while parent[result[-1]] >= 0:
+            result.append(parent[result[-1]])
+        return result
+
+    def test_random_operations(self) -> None:
+        n = 40
+        forest = LinkCutForest(n)
+        parent, value = [-1] * n, [0] * n
+        for i in range(3000):
+            op = random.random()
+            u, v = random.randrange(n), random.randrange(n)
+            if op < 0.4:
+                if parent[u] < 0 and u not in self._naive_ancestors(parent, v):
+                    forest.link(u, v)
+                    parent[u] = v
+            elif op < 0.6:
+                if parent[u] >= 0:
+                    forest.cut(u)
+                    parent[u] = -1
+            elif op < 0.7:
+                value[u] = random.randrange(3)
+                forest.set_value(u, value[u])
+            else:
+                ancestors = self._naive_ancestors(parent, u)
+                subtree = self._naive_subtree(parent, u)
+                self.assertEqual(forest.root(u), ancestors[-1])
+                self.assertEqual(forest.depth(u), len(ancestors))
+                self.assertEqual(forest.is_ancestor(v, u), v in ancestors)
+                self.assertEqual(forest.subtree_size(u), len(subtree))
+                self.assertEqual(forest.subtree_value(u),
+                                 sum(value[x] for x in subtree))
+                d = random.randint(1, len(ancestors))
+                self.assertEqual(forest.ancestor_at_depth(u, d),
+                                 ancestors[len(ancestors)-d])
+
+    def test_errors(self) -> None:
+        forest = LinkCutForest(3)
+        forest.link(1, 0)
+        with self.assertRaises(ValueError):
+            forest.link(1, 2)
+        with self.assertRaises(ValueError):
+            forest.cut(0)
+
@@ -0,0 +1,154 @@
+from morle.datastruct.graph import ArrayBranching, EdgeSet, FullGraph, \
+    GraphEdge
+from morle.datastruct.lexicon import Lexicon, LexiconEntry
+from morle.datastruct.rules import Rule
+import morle.shared as shared
+
+import numpy as np
+import unittest
+
+# fake config file
+CONFIG = '''
+[General]
+encoding = utf-8
+date_format = %%d.%%m.%%Y %%H:%%M
+supervised = no
+
+[Models]
+root_feature_model = none
+edge_feature_model = none
+
+[Features]
+word_vec_dim = 100
+'''
+
+shared.config.read_string(CONFIG)
+
+
+class ArrayBranchingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.lexicon = Lexicon([LexiconEntry(word) for word in \
+                                ('mach', 'machen', 'macht', 'machte',
+                                 'gemacht', 'machtest')])
+        self.rules = { 'en' : Rule.from_string(':/:en'),
+                       't' : Rule.from_string(':/:t'),
+                       'e' : Rule.from_string(':/:e'),
+                       'ge' : Rule.from_string(':ge/:'),
+                       'st' : Rule.from_string(':/:st') }
+        edges = [('mach', 'machen', 'en'), ('mach', 'macht', 't'),
+                 ('macht', 'machte', 'e'), ('macht', 'gemacht', 'ge'),
+                 ('machte', 'machtest', 'st'), ('machen', 'machtest', 'st')]
+        self.edge_set = EdgeSet(self.lexicon,
+                                [GraphEdge(self.lexicon[source],
+                                           self.lexicon[target],
+                                           self.rules[rule]) \
+                                 for source, target, rule in edges])
+        self.full_graph = FullGraph(self.lexicon, self.edge_set)
+        self.branching = ArrayBranching(self.full_graph)
+        for e_id in range(5):
+            self.branching.add_edge_id(e_id)
+
+    def test_structure(self) -> None:
+        b, lex = self.branching, self.lexicon
+        self.assertEqual(b.number_of_edges(), 5)
+        self.assertEqual(b.parent(lex['machtest']), lex['machte'])
+        self.assertIsNone(b.parent(lex['mach']))
+        self.assertEqual(b.root(lex['machtest']), lex['mach'])
+        self.assertEqual(b.depth(lex['machtest']), 4)
+        self.assertEqual(b.subtree_size(lex['macht']), 4)
+        self.assertEqual(b.count_nonleaves(lex['mach']), 3)
+        self.assertEqual(b.height(lex['mach']), 4)
+        self.assertEqual(set(b.successors(lex['macht'])),
+                         { lex['machte'], lex['gemacht'] })
+        self.assertEqual(b.path(lex['macht'], lex['machtest']),
+                         [lex['macht'], lex['machte'], lex['machtest']])
+        self.assertTrue(b.has_path(lex['mach'], lex['gemacht']))
+        self.assertFalse(b.has_path(lex['machen'], lex['gemacht']))
+
+    def test_add_and_remove(self) -> None:
+        b, lex = self.branching, self.lexicon
+        # 'machtest' already has a parent, 'mach' -> 'macht' would be a cycle
+        self.assertFalse(b.is_edge_possible_id(5))
+        b.remove_edge(self.edge_set[4])
+        self.assertTrue(b.is_edge_possible_id(5))
+        b.add_edge_id(5)
+        self.assertTrue(b.has_edge(lex['machen'], lex['machtest'],
+                                   self.rules['st']))
+        self.assertFalse(b.has_edge_id(4))
+        self.assertEqual(b.num_edges_for_rule(self.rules['st']), 1)
+        self.assertEqual(b.get_edges_for_rule(self.rules['st']),
+                         [self.edge_set[5]])
+        self.assertEqual(b.successors(lex['machte']), [])
+        self.assertEqual(sorted(b.edge_ids().tolist()), [0, 1, 2, 3, 5])
+
+    def test_edge_ids(self) -> None:
+        b, lex = self.branching, self.lexicon
+        self.assertEqual(self.full_graph.edge_ids_between(
+                             lex.get_id(lex['machen']),
+                             lex.get_id(lex['machtest'])), [5])
+        self.assertEqual(self.full_graph.edge_ids_between(
+                             lex.get_id(lex['machtest']),
+                             lex.get_id(lex['machen'])), [])
+        self.assertEqual(self.full_graph.ingoing_edge_ids(
+                             lex.get_id(lex['machtest'])), [4, 5])
+        self.assertEqual(b.edge_ids_for_rule(self.rules['st']).tolist(), [4])
+
+    def test_ancestor_index(self) -> None:
+        b, lex = self.branching, self.lexicon
+        depths, jumps = b.ancestor_index()
+        for word in ('mach', 'machen', 'machte', 'machtest'):
+            node_id = lex.get_id(lex[word])
+            self.assertEqual(depths[node_id], b.depth(lex[word]))
+            self.assertEqual(jumps[-1][node_id], lex.get_id(b.root(lex[word])))
+        # the grandparent of 'machtest'
+        self.assertEqual(jumps[1][lex.get_id(lex['machtest'])],
+                         lex.get_id(lex['macht']))
+
+    def test_ancestors_at_distance(self) -> None:
+        b, lex = self.branching, self.lexicon
+        depths, jumps = b.ancestor_index()
+        v_ids = np.array([lex.get_id(lex['machtest'])] * 4)
+        result = b.ancestors_at_distance(jumps, v_ids, np.array([0, 1, 2, 3]))
+        self.assertEqual(result.tolist(),
+                         [lex.get_id(lex[w]) for w in \
+                          ('machtest', 'machte', 'macht', 'mach')])
+
+
+class ArrayBranchingDynamicIndexTest(ArrayBranchingTest):
+    'The same tests with queries answered by the link-cut forest.'
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.branching = ArrayBranching(self.full_graph, dynamic_index=True)
+        for e_id in range(5):
+            self.branching.add_edge_id(e_id)
+
+
+
+class FullGraphTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.lexicon = Lexicon([LexiconEntry(word) for word in \
+                                ('mach', 'machen', 'macht', 'sag', 'sagen',
+                                 'und')])
+        rules = { 'en' : Rule.from_string(':/:en'),
+                  't' : Rule.from_string(':/:t') }
+        edges = [('sag', 'sagen', 'en'), ('mach', 'machen', 'en'),
+                 ('mach', 'macht', 't')]
+        self.edge_set = EdgeSet(self.lexicon,
+                                [GraphEdge(self.lexicon[source],
+                                           self.lexicon[target],
+                                           rules[rule]) \
+                                 for source, target, rule in edges])
+        self.full_graph = FullGraph(self.lexicon, self.edge_set)
+
+    def test_connected_components(self) -> None:
+        components = self.full_graph.connected_components()
+        # 'und' has no edges and does not form a component
+        self.assertEqual([c.tolist() for c in components], [[1, 2], [0]])
+
+    def test_random_branching(self) -> None:
+        for i in range(10):
+            b = self.full_graph.random_branching(edge_ids=np.array([1, 2]))
+            self.assertFalse(b.has_edge_id(0))
@@ -0,0 +1,34 @@
+from morle.utils.files import open_to_read, open_to_write, write_line, \
+    write_tsv_columns
+import morle.shared as shared
+
+import numpy as np
+import tempfile
+import unittest
+
+
+class WriteTSVColumnsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.working_dir = shared.options['working_dir']
+        shared.options['working_dir'] = self.tmpdir.name
+
+    def tearDown(self) -> None:
+        shared.options['working_dir'] = self.working_dir
+        self.tmpdir.cleanup()
+
+    def test_same_as_write_line(self) -> None:
+        words = ['a', 'b', 'c', 'd', 'e']
+        ids = np.array([3, 1, 4, 1, 5], dtype=np.int64)
+        values = np.array([0.1, 1e20, 1e-5, -3.0, 2/3])
+        with open_to_write('rows.txt') as fp:
+            write_line(fp, ('word', 'id', 'value'))
+            for i in range(len(words)):
+                write_line(fp, (words[i], ids[i], values[i]))
+        write_tsv_columns('columns.txt', [words, ids, values],
+                          header=('word', 'id', 'value'), chunk_size=2)
+        with open_to_read('rows.txt') as fp:
+            expected = fp.read()
+        with open_to_read('columns.txt') as fp:
+            self.assertEqual(fp.read(), expected)